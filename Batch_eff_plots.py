@@ -123,6 +123,7 @@ class Batch_eff_plots(hf.module.ModuleBase):
         ax.text(0, 1.05, 'Individual job history (last update: %s)' % lastTime_str, transform = ax.transAxes)
         #print lastTime_str
         fig1.savefig(hf.downloadService.getArchivePath(self.run, self.instance_name + "_batch_efficiency.png"), dpi = 60)
+        matplotlib.pyplot.close(fig1)
         data["filename_eff_plot"] = self.instance_name + "_batch_efficiency.png"
 
         fig2 = matplotlib.pyplot.figure()
@@ -162,5 +163,6 @@ class Batch_eff_plots(hf.module.ModuleBase):
                     tmp.set_alpha(0.7)
             matplotlib.pyplot.colorbar(pad = 0.01, fraction = 0.1)
         fig2.savefig(hf.downloadService.getArchivePath(self.run, self.instance_name + "_batch_efficiency_inst.png"), dpi = 60)
+        matplotlib.pyplot.close(fig2)
         data["filename_eff_inst_plot"] = self.instance_name + "_batch_efficiency_inst.png"
         return data
@@ -18,6 +18,8 @@ from sqlalchemy import *
 import json
 import ast
 from operator import itemgetter
+from collections import Counter
+from plot_service import PlotService
 
 
 class CMS6MachineStatus(hf.module.ModuleBase):
@@ -81,6 +83,7 @@ class CMS6MachineStatus(hf.module.ModuleBase):
 
     def prepareAcquisition(self):
         ''' acquire the config parameters given in the config file'''
+        PlotService.instance()
         link = self.config['sourceurl']
         self.plotsize_x = float(self.config['plotsize_x'])
         self.plotsize_y = float(self.config['plotsize_y'])
@@ -107,18 +110,7 @@ class CMS6MachineStatus(hf.module.ModuleBase):
 
     def extractData(self):
         import numpy as np
-        import matplotlib.pyplot as plt
-        from matplotlib.font_manager import FontProperties
 
-        def sitescan(machine_name, sites):  # function to find site for machine_name
-            i = 0
-            while sites[i] not in machine_name and i + 1 < len(sites):
-                i += 1
-            # put ekpsg and ekpsm in one group
-            if sites[i] == "ekpsm":
-                return "ekpsg"
-            else:
-                return sites[i]
         data = {}
         data["filename_plot"] = ''
         data["error_msg"] = ''
@@ -147,99 +139,96 @@ class CMS6MachineStatus(hf.module.ModuleBase):
             content_fixed = content.replace("}, }", "} }")
             services = json.loads(content_fixed)
             slot_id_list = list(services.keys())
-        # create lists with the values of 'State' and 'Activity' to count them
-        state_list = list(services[id]['State']for id in slot_id_list)
-        activity_list = list(services[id]['Activity'] for id in slot_id_list)
-        load_list = list(float(services[id]['LoadAvg']) for id in slot_id_list)
-        machine_name_list = list(services[id]['Machine']for id in slot_id_list)
-        condor_version_list = list(
-            services[id]['CondorVersion']for id in slot_id_list)
-        condor_load_list = list(
-            float(services[id]['TotalCondorLoadAvg'])for id in slot_id_list)
-        disk_list = list(
-            round(float(services[id]['Disk']) / (1024 * 1024), 2)for id in slot_id_list)
-        total_slot_list = list(
-            int(services[id]['TotalSlots'])for id in slot_id_list)
-        slot_count = len(slot_id_list)
-        condor_version_list = list(condor_version_list[i].replace(
-            "$", "")for i in xrange(slot_count))
-        # list of different machines
-        machine_names = list(set(machine_name_list))
-        # get list of different condor_versions
-        condor_versions = list(set(condor_version_list))
-        machine_slots = [0] * len(machine_names)
-        for i in xrange(slot_count):  # calculate how much slots are online in total
-            for k in xrange(len(machine_names)):
-                if machine_name_list[i] == machine_names[k] and machine_slots[k] == 0:
-                    machine_slots[k] = total_slot_list[i]
-        # get machine_names reduced to name of different sites
-        for k in xrange(len(machine_names)):
-            machine_names[k] = sitescan(machine_names[k], sites)
         sites.remove("ekpsm")
-        # create Arrays for plot and additional ones for Plot Details Subtable:
-        plot_claimed = np.zeros(len(sites))
-        plot_unclaimed = np.zeros(len(sites))
-        plot_machines_per_site = np.zeros(len(sites))
-        plot_avg_load_claimed = np.zeros(len(sites))
-        plot_avg_load_unclaimed = np.zeros(len(sites))
-        plot_disk = np.zeros(len(sites))
-        plot_weak = np.zeros(len(sites))
-        # lists for different possilble activities
-        plot_activity = {
-            "Idle": np.zeros(len(sites)),
-            "Busy": np.zeros(len(sites)),
-            "Suspended": np.zeros(len(sites)),
-            "Blocked": np.zeros(len(sites)),
-            "Retiring": np.zeros(len(sites))
-        }
-        condor_version_per_site = {}
+        site_index = {}
+
+        def sitescan(machine_name):  # index of the site for machine_name, -1 if unknown
+            # put ekpsg and ekpsm in one group
+            if machine_name not in site_index:
+                site_index[machine_name] = -1
+                for j, site in enumerate(sites):
+                    if site in machine_name or ("ekpsm" in machine_name and site == "ekpsg"):
+                        site_index[machine_name] = j
+                        break
+            return site_index[machine_name]
+        # activities a slot is counted in, blocked slots are idle slots that
+        # are drained or used by the owner
+        plot_activities = act_states + ["Blocked"]
+        activity_index = dict((activity, k) for k, activity in enumerate(act_states))
+        blocked_index = plot_activities.index("Blocked")
+        slot_count = len(slot_id_list)
+        # walk once over all slots and translate them into integer codes
+        state_list = []
+        activity_list = []
+        load_list = []
+        disk_list = []
+        condor_load_list = []
+        site_codes = np.empty(slot_count, dtype=int)
+        activity_codes = np.empty(slot_count, dtype=int)
+        claimed = np.zeros(slot_count, dtype=bool)
+        idle = np.zeros(slot_count, dtype=bool)
+        machine_slots = {}  # total number of slots per machine
+        machine_site = {}
+        condor_versions = set()
+        condor_version_per_site = Counter()
+        for i, id in enumerate(slot_id_list):
+            slot = services[id]
+            machine_name = slot['Machine']
+            state = slot['State']
+            activity = slot['Activity']
+            state_list.append(state)
+            activity_list.append(activity)
+            load_list.append(float(slot['LoadAvg']))
+            disk_list.append(round(float(slot['Disk']) / (1024 * 1024), 2))
+            condor_load_list.append(float(slot['TotalCondorLoadAvg']))
+            site_codes[i] = j = sitescan(machine_name)
+            claimed[i] = state == "Claimed"
+            idle[i] = activity == "Idle"
+            if activity == "Idle" and (state == "Drained" or state == "Owner"):
+                activity_codes[i] = blocked_index
+            else:
+                activity_codes[i] = activity_index.get(activity, -1)
+            if not machine_slots.get(machine_name):
+                machine_slots[machine_name] = int(slot['TotalSlots'])
+            machine_site[machine_name] = j
+            condor_version = slot['CondorVersion'].replace("$", "")
+            condor_versions.add(condor_version)
+            if j >= 0:
+                condor_version_per_site[(j, condor_version)] += 1
+        condor_versions = list(condor_versions)
+        machine_names = list(machine_site)
+        load_array = np.array(load_list)
+        # how much slots are claimed or set on Owner -> not available for new
+        # jobs, how much slots are idle and how much are claimed but weak
+        known = site_codes >= 0
+        claimed &= known
+        unclaimed = known & ~claimed & idle
+        weak = claimed & (load_array <= self.weak_threshold)
 
-        # Checking how many machines and how many slots are available per site and fill lists to
-        # shorten the information
-        for i in xrange(len(machine_name_list)):
-            for j in xrange(len(sites)):
-                # special conditition to sort ekpsg and ekpsm together
-                # how much machines are running per site
-                if sites[j] in machine_name_list[i] or ("ekpsm" in machine_name_list[i] and sites[j] == "ekpsg"):
-                    plot_disk[j] += disk_list[i]
-                    # how much slots are claimed or set on Owner -> not
-                    # available for new jobs
-                    if state_list[i] == "Claimed":
-                        plot_claimed[j] += 1
-                        plot_avg_load_claimed[j] += load_list[i]
-                        if load_list[i] <= self.weak_threshold:
-                            plot_weak[j] += 1
-                    elif activity_list[i] == "Idle":  # how much slots are idle
-                        plot_unclaimed[j] += 1
-                        plot_avg_load_unclaimed[j] += load_list[i]
-                    # filter slots by activity
-                    for activity in act_states:
-                        if activity_list[i] == activity:
-                            if activity_list[i] == "Idle" and (state_list[i] == "Drained" or state_list[i] == "Owner"):
-                                plot_activity["Blocked"][j] += 1
-                            else:
-                                plot_activity[activity][j] += 1
+        def per_site(mask, weights=None):  # sum up the selected slots per site
+            if weights is not None:
+                weights = weights[mask]
+            return np.bincount(site_codes[mask], weights=weights,
+                               minlength=len(sites)).astype(float)
+        # create Arrays for plot and additional ones for Plot Details Subtable:
+        plot_claimed = per_site(claimed)
+        plot_unclaimed = per_site(unclaimed)
+        machine_site_codes = np.array(machine_site.values(), dtype=int)
+        plot_machines_per_site = np.bincount(machine_site_codes[machine_site_codes >= 0],
+                                             minlength=len(sites)).astype(float)
+        plot_avg_load_claimed = per_site(claimed, load_array)
+        plot_avg_load_unclaimed = per_site(unclaimed, load_array)
+        plot_disk = per_site(known, np.array(disk_list))
+        plot_weak = per_site(weak)
+        # arrays for different possilble activities
+        plot_activity = {}
+        for k, activity in enumerate(plot_activities):
+            plot_activity[activity] = per_site(known & (activity_codes == k))
         for j in xrange(len(sites)):  # calculate the average load per site
-            plot_machines_per_site[j] = machine_names.count(sites[j])
-            try:
-                plot_avg_load_claimed[j] = round(
-                    float(plot_avg_load_claimed[j]) / float(plot_claimed[j]), 2)
-            except (ValueError, ZeroDivisionError):
-                plot_avg_load_claimed[j] = 0
-            try:
-                plot_avg_load_unclaimed[j] = round(
-                    float(plot_avg_load_unclaimed[j]) / float(plot_unclaimed[j]), 2)
-            except (ValueError, ZeroDivisionError):
-                plot_avg_load_unclaimed[j] = 0
-        for j in xrange(len(sites)):  # count different condor versions
-            temp = {}
-            # check different condor_versions per site
-            for k in xrange(len(condor_versions)):
-                temp[condor_versions[k]] = 0
-            condor_version_per_site[sites[j]] = temp
-        for i in xrange(slot_count):
-            condor_version_per_site[sitescan(machine_name_list[i], sites)][
-                condor_version_list[i]] += 1
+            if plot_claimed[j] > 0:
+                plot_avg_load_claimed[j] = round(plot_avg_load_claimed[j] / plot_claimed[j], 2)
+            if plot_unclaimed[j] > 0:
+                plot_avg_load_unclaimed[j] = round(plot_avg_load_unclaimed[j] / plot_unclaimed[j], 2)
         ###############
         # Make   plot #
         ###############
@@ -255,78 +244,45 @@ class CMS6MachineStatus(hf.module.ModuleBase):
             y = self.plotsize_y
         else:
             y = round(self.plotsize_y / self.min_plotsize, 1) * (len(sites))
-        fig = plt.figure(figsize=(self.plotsize_x, y))
-        axis = fig.add_subplot(111)
         ind = np.arange(len(sites))
         width = self.plot_width
+        slots_per_site = sum(plot_activity[activity] for activity in plot_activities)
+        # use log scale if the longest bar reaches log_limit
+        log_needed = len(sites) > 0 and slots_per_site.max() >= self.log_limit
         # create stacked horizontal bars
-        bar_1 = axis.barh(ind, plot_activity["Idle"], width, color=plot_color[
-                          'idle'], align='center')
-        bar_2 = axis.barh(ind, plot_activity["Busy"], width, color=plot_color[
-                          'busy'], align='center', left=plot_activity["Idle"])
-        bar_3 = axis.barh(ind, plot_activity["Suspended"], width, color=plot_color[
-                          'suspended'], align='center', left=plot_activity["Idle"] + plot_activity["Busy"])
-        bar_4 = axis.barh(ind, plot_activity["Retiring"], width, color=plot_color[
-                          'retiring'], align='center', left=plot_activity["Idle"] + plot_activity["Busy"] + plot_activity[
-                              "Suspended"])
-        bar_5 = axis.barh(ind, plot_activity["Blocked"], width, color=plot_color[
-                          'blocked'], align='center', left=plot_activity["Idle"] + plot_activity["Busy"] + plot_activity[
-                              "Suspended"] + plot_activity["Retiring"])
-        max_width = axis.get_xlim()[1]
-        # use log scale if max_width gets bigger than 1000
-        if max_width >= self.log_limit:
-            bar_1 = axis.barh(ind, plot_activity["Idle"], width, color=plot_color[
-                              'idle'], align='center', log=True)
-            bar_2 = axis.barh(ind, plot_activity["Busy"], width, color=plot_color[
-                              'busy'], align='center', left=plot_activity["Idle"], log=True)
-            bar_3 = axis.barh(ind, plot_activity["Suspended"], width, color=plot_color[
-                              'suspended'], align='center', left=plot_activity["Idle"] + plot_activity["Busy"], log=True)
-            bar_4 = axis.barh(ind, plot_activity["Retiring"], width, color=plot_color[
-                              'retiring'], align='center', left=plot_activity["Idle"] + plot_activity["Busy"] + plot_activity[
-                                  "Suspended"], log=True)
-            bar_5 = axis.barh(ind, plot_activity["Blocked"], width, color=plot_color[
-                              'blocked'], align='center', left=plot_activity["Idle"] + plot_activity["Busy"] + plot_activity[
-                                  "Suspended"] + plot_activity["Retiring"], log=True)
-            for i in xrange(len(sites)):
-                temp = sites[i] + " - " + \
-                    str(int(plot_activity["Idle"][i] + plot_activity["Busy"][i] + plot_activity["Suspended"][
-                        i] + plot_activity["Retiring"][i] + plot_activity["Blocked"][i])) + " Slots"
-                axis.text(axis.get_xlim()[0] + 0.5, i + (width / 2) +
-                          0.07, temp, ha='left', va="center")
-        else:
-            for i in xrange(len(sites)):
-                temp = sites[i] + " - " + \
-                    str(int(plot_activity["Idle"][i] + plot_activity["Busy"][i] + plot_activity["Suspended"][
-                        i] + plot_activity["Retiring"][i] + plot_activity["Blocked"][i])) + " Slots"
-                axis.text(1, i + (width / 2) + 0.07,
-                          temp, ha='left', va="center")
-        # set ylimit so fix look of plots with few users
-        if len(sites) < self.min_plotsize:
-            axis.set_ylim(-0.5, self.min_plotsize - 0.5)
-        else:
-            axis.set_ylim(-0.5, len(sites) - 0.5)
-        max_width = int(axis.get_xlim()[1] * (1 + self.plot_right_margin))
-        min_width = axis.get_xlim()[0]
-        axis.set_xlim(min_width, max_width)
-        axis.set_title('running slots per site')
-        axis.set_xlabel('number of slots')
-        axis.set_ylabel('site')
-        axis.set_yticks(ind)
-        axis.set_yticklabels('')
-        fontLeg = FontProperties()
-        fontLeg.set_size('small')
-        axis.legend((bar_1[0], bar_2[0], bar_3[0], bar_4[0], bar_5[0]), ('idle slots', 'busy slots', 'suspended slots', 'retiring slots', 'blocked slots'),
-                    loc=6, bbox_to_anchor=(0.8, 0.88), borderaxespad=0., prop=fontLeg)
-        plt.grid(axis=y)
+        layers = [{
+            'kind': 'bar', 'horizontal': True, 'stacked': True, 'width': width, 'log': log_needed,
+            'series': [{'values': plot_activity[activity], 'color': plot_color[activity.lower()],
+                        'label': activity.lower() + ' slots'} for activity in plot_activities],
+        }]
+        for i in xrange(len(sites)):
+            temp = sites[i] + " - " + str(int(slots_per_site[i])) + " Slots"
+            if log_needed:
+                layers.append({'kind': 'text', 'x': 0.01, 'axes_x': True, 'y': i + (width / 2) + 0.07, 'text': temp})
+            else:
+                layers.append({'kind': 'text', 'x': 1, 'y': i + (width / 2) + 0.07, 'text': temp})
         ##########
         # Output #
         ##########
         '''This module contains one plot, one summary subtable,
         one subtable with every information and one subtable to determine the
         different condor versions running on the different sites.'''
-        plt.tight_layout()
-        fig.savefig(hf.downloadService.getArchivePath(
-            self.run, self.instance_name + "_sites.png"), dpi=91)
+        PlotService.instance().submit({
+            'figsize': (self.plotsize_x, y),
+            'axes': [{
+                'title': 'running slots per site',
+                'xlabel': 'number of slots',
+                'ylabel': 'site',
+                'layers': layers,
+                # set ylimit so fix look of plots with few users
+                'ylim': (-0.5, max(len(sites), self.min_plotsize) - 0.5),
+                'xlim_scale': 1 + self.plot_right_margin,
+                'yticks': ind,
+                'yticklabels': '',
+                'legend': {'loc': 6, 'bbox_to_anchor': (0.8, 0.88), 'borderaxespad': 0.},
+            }],
+        }, hf.downloadService.getArchivePath(self.run, self.instance_name + "_sites.png"),
+            self, "filename_plot")
         temp = np.zeros(2)
         temp_2 = np.zeros(2)
         for avg in plot_avg_load_claimed:
@@ -345,12 +301,11 @@ class CMS6MachineStatus(hf.module.ModuleBase):
             unclaimed_avg = round(temp_2[0] / temp_2[1], 2)
         except ZeroDivisionError:
             claimed_avg = 0
-        data["filename_plot"] = self.instance_name + "_sites.png"
         data['claimed_slots'] = state_list.count("Claimed")
         data['unclaimed_slots'] = state_list.count("Unclaimed")
         data['weak_slots'] = sum(plot_weak)
         data['machines'] = len(machine_names)
-        data['slots'] = sum(machine_slots)
+        data['slots'] = sum(machine_slots.values())
         data['claimedslots_loadavg'] = claimed_avg
         data['unclaimedslots_loadavg'] = unclaimed_avg
         data['condor_load'] = round(
@@ -360,14 +315,13 @@ class CMS6MachineStatus(hf.module.ModuleBase):
         for i in xrange(len(sites)):
             for j in xrange(len(condor_versions)):
                 # dont save subtable if site offline
-                if sites[i] in condor_version_per_site.keys():
-                    if condor_version_per_site[sites[i]][condor_versions[j]] != 0:
-                        details_data = {
-                            'site': sites[i],
-                            'condor_version': condor_versions[j],
-                            'value': condor_version_per_site[sites[i]][condor_versions[j]]
-                        }
-                        self.condor_db_value_list.append(details_data)
+                if condor_version_per_site[(i, condor_versions[j])] != 0:
+                    details_data = {
+                        'site': sites[i],
+                        'condor_version': condor_versions[j],
+                        'value': condor_version_per_site[(i, condor_versions[j])]
+                    }
+                    self.condor_db_value_list.append(details_data)
         # Fill Subtable statistics
         # sorter is used to sort the details list in reserver order so all
         # slots of the same machine appear next to each other.
@@ -19,8 +19,7 @@ from lxml.html import parse
 import StringIO
 from sqlalchemy import TEXT, INT, FLOAT, Column
 import numpy as np 
-from datetime import datetime
-import pytz
+from job_timeseries import JobTimeSeries, local_time_converter, percent_of_total
 
 state_colors = {
     'submitted': '#5CADFF',
@@ -129,64 +128,36 @@ class CMSJobResults(hf.module.ModuleBase):
         tree = parse(StringIO.StringIO(strwebpage))
         rowlist = tree.findall(".//item")
 
-        StartDates = []
-        Jobs = [[0 for t in range(len(rowlist)-1)] for c in range(len(self.cat_names))]
-        for i in range(1,len(rowlist)):
-            ThisData = {key: 0 for key in self.tags}
-            for j in range(len(rowlist[i])):
-                if rowlist[i][j].tag == 's_date':
-                    StartDates.append(rowlist[i][j].text_content())
-                else:
-                    if rowlist[i][j].tag in self.tags:
-                        ThisData[rowlist[i][j].tag] = rowlist[i][j].text_content()
-            for key,value in ThisData.iteritems():
-                Jobs[self.tags.index(key)][i-1] = int(value)
+        # Job numbers per category and time bin, the total is the last row.
+        # The first item holds no time bin.
+        to_local = local_time_converter("%d-%b-%y %H:%M:%S", "%d-%b-%y %H:%M:%S")
+        series = JobTimeSeries.from_columns(rowlist[1:], self.tags, convert=to_local)
+        StartDates = series.time_points
+        Jobs = series.jobs
+        total = len(self.cat_names)-1
 
         # Calculate derived statistics
-        minJobs = [0 for c in range(len(self.cat_names))]
-        maxJobs = [0 for c in range(len(self.cat_names))]
-        avgJobs = [0 for c in range(len(self.cat_names))]
-        JobFractions = [[0 for t in range(len(StartDates))] for c in range(
-                len(self.cat_names))]
-        AggrJobsEval = 0
-        JobsEval = [0 for c in range(len(self.cat_names))]
-        JobFractionsEval = [0 for c in range(len(self.cat_names))]
+        minJobs = series.minimum()
+        maxJobs = series.maximum()
+        avgJobs = series.jobs.sum(axis=1) // max(1, len(StartDates))
+        JobsEval = series.window(self.eval_interval)
+        JobFractionsEval = percent_of_total(JobsEval)
         JobsEvalColor = ['' for c in range(len(self.cat_names))]
-        for t in range(len(StartDates)):
-            Jobs[len(self.cat_names)-1][t] = 0
-            for c in range(len(self.cat_names)-1):
-                Jobs[len(self.cat_names)-1][t] += Jobs[c][t]
-        for t in range(len(StartDates)-1, len(StartDates)-1-self.eval_interval, -1):
-            for c in range(len(self.cat_names)):
-                JobsEval[c] += Jobs[c][t]
-        for c in range(len(self.cat_names)):
-            minJobs[c] = min(Jobs[c])
-            maxJobs[c] = max(Jobs[c])
-            for t in range(len(StartDates)):
-                if Jobs[len(self.cat_names)-1][t] > 0:
-                    JobFractions[c][t] = 100.0 * Jobs[c][t] / float(Jobs[len(
-                            self.cat_names)-1][t])
-                else:
-                    JobFractions[c][t] = 0.0
-                avgJobs[c] += Jobs[c][t]
-            avgJobs[c] /= len(StartDates)
-            if JobsEval[len(self.cat_names)-1] > 0:
-                JobFractionsEval[c] = 100.0 * JobsEval[c] / float(JobsEval[len(
-                        self.cat_names)-1])
-            else:
-                JobFractionsEval[c] = 0.0
-        
+        JobsCurrentHour = series.column(-1)
+        JobFracsCurrentHour = percent_of_total(JobsCurrentHour)
+        JobsLastHour = series.column(-2)
+        JobFracsLastHour = percent_of_total(JobsLastHour)
+
         # Calculate evaluation statistic
-        for item in self.eval_categories:
-            AggrJobsEval += JobsEval[self.cat_names.index(item)]
-        if JobsEval[len(self.cat_names)-1] > 0:
-            EvalPercentage = 100.0 * AggrJobsEval / float(JobsEval[len(self.cat_names)-1])
+        AggrJobsEval = sum(JobsEval[self.cat_names.index(item)] for item in self.eval_categories)
+        if JobsEval[total] > 0:
+            EvalPercentage = 100.0 * AggrJobsEval / float(JobsEval[total])
         else:
             EvalPercentage = 0.0
 
         # Set module status according to evaluation statistic
         data['status'] = 1.0
-        if JobsEval[len(self.cat_names)-1] >= self.eval_job_threshold:
+        if JobsEval[total] >= self.eval_job_threshold:
             if self.eval_warn_threshold[0] == '<':
                 if EvalPercentage <= self.eval_warn_threshold[1]: data['status'] = 0.5
             elif self.eval_warn_threshold[0] == '>':
@@ -206,36 +177,24 @@ class CMSJobResults(hf.module.ModuleBase):
         # Save subtable data
         for c in range(len(self.cat_names)):
             self.statistics_db_value_list.append({'CatName': self.cat_names[c],
-                    'JobsEval': JobsEval[c], 'JobFracsEval': '%.1f' % JobFractionsEval[c],
+                    'JobsEval': int(JobsEval[c]), 'JobFracsEval': '%.1f' % JobFractionsEval[c],
                     'JobsEvalColor': JobsEvalColor[c],
-                    'JobsCurrentHour': Jobs[c][len(StartDates)-1],
-                    'JobFracsCurrentHour': '%.1f' % JobFractions[c][len(StartDates)-1],
-                    'JobsLastHour': Jobs[c][len(StartDates)-2],
-                    'JobFracsLastHour': '%.1f' % JobFractions[c][len(StartDates)-2],
-                    'MinJobs': minJobs[c], 'MaxJobs': maxJobs[c],
-                    'AvgJobs': avgJobs[c]})
-
-        # Function to convert raw time data given in UTC to local time zone
-        def ChangeTimeZone(TimeStringIn, InFormatString, OutFormatString):
-            Date = datetime.strptime(TimeStringIn, InFormatString).replace(
-                    tzinfo=pytz.utc).astimezone(pytz.timezone('Europe/Berlin'))
-            return(Date.strftime(OutFormatString))
-
-        # Change times from utc to local
-        for t in range(len(StartDates)):
-            StartDates[t] = ChangeTimeZone(StartDates[t], "%d-%b-%y %H:%M:%S",
-                    "%d-%b-%y %H:%M:%S")
+                    'JobsCurrentHour': int(JobsCurrentHour[c]),
+                    'JobFracsCurrentHour': '%.1f' % JobFracsCurrentHour[c],
+                    'JobsLastHour': int(JobsLastHour[c]),
+                    'JobFracsLastHour': '%.1f' % JobFracsLastHour[c],
+                    'MinJobs': int(minJobs[c]), 'MaxJobs': int(maxJobs[c]),
+                    'AvgJobs': int(avgJobs[c])})
 
+        to_local = local_time_converter("%Y-%m-%d %H:%M:%S", "%d-%b-%y %H:%M:%S")
         data['InstanceTitle'] = self.config['name']
-        data['IntervalStart'] = ChangeTimeZone(tree.find(".//start").text_content(
-                ).split(".")[0], "%Y-%m-%d %H:%M:%S", "%d-%b-%y %H:%M:%S")
-        data['IntervalEnd'] = ChangeTimeZone(tree.find(".//end").text_content(
-                ).split(".")[0], "%Y-%m-%d %H:%M:%S", "%d-%b-%y %H:%M:%S")
+        data['IntervalStart'] = to_local(tree.find(".//start").text_content().split(".")[0])
+        data['IntervalEnd'] = to_local(tree.find(".//end").text_content().split(".")[0])
         data['CurrentHourStart'] = StartDates[len(StartDates)-1].split(' ')[1]
         data['CurrentHourEnd'] = data['IntervalEnd'].split(' ')[1]
         data['LastHourStart'] = StartDates[len(StartDates)-2].split(' ')[1]
         data['LastHourEnd'] = StartDates[len(StartDates)-1].split(' ')[1]
-        data['EvaluationStart'] = StartDates[len(StartDates)-self.eval_interval].split(' ')[1]
+        data['EvaluationStart'] = StartDates[max(0, len(StartDates)-self.eval_interval)].split(' ')[1]
         data['EvaluationEnd'] = data['IntervalEnd'].split(' ')[1]
 
         ######################################################################
@@ -262,7 +221,7 @@ class CMSJobResults(hf.module.ModuleBase):
         else:
             ind = np.arange(nbins)   # the x locations for the groups
             width = 1.00   # the width of the bars: can also be len(x) sequence
-            max_val = maxJobs[len(self.cat_names)-1]
+            max_val = maxJobs[total]
             xlabels = [0]*nbins
             for i in range(0,nbins):
                 if i % 2 == 0:
@@ -274,12 +233,7 @@ class CMSJobResults(hf.module.ModuleBase):
                     xlabels[i] = ''
 
             # calculate bottom levels in order to enforce stacking
-            cat_bottoms = [[0 for t in range(len(StartDates))] for c in range(
-                    len(self.cat_names)-1)]
-            for cSet in range(1,len(self.cat_names)-1):
-                for cGet in range(0,cSet):
-                    for t in range(len(StartDates)):
-                        cat_bottoms[cSet][t] += Jobs[cGet][t]
+            cat_bottoms = series.stack_bottoms()
 
             # Create figure and plot job numbers of the different categories
             fig = self.plt.figure(figsize=(10,5.8))
@@ -313,6 +267,7 @@ class CMSJobResults(hf.module.ModuleBase):
 
             fig.savefig(hf.downloadService.getArchivePath(
                     self.run, self.instance_name + "_jobs_dist.png"), dpi=91)
+            self.plt.close(fig)
             data["filename_plot"] = self.instance_name + "_jobs_dist.png"
 
         return data
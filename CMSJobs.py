@@ -19,8 +19,7 @@ from  lxml.html import parse
 import StringIO
 from sqlalchemy import TEXT, INT, FLOAT, Column
 import numpy as np
-from datetime import datetime
-import pytz
+from job_timeseries import JobTimeSeries, local_time_converter, percent_of_total
 
 state_colors = {
     'cleanup': '#909090',
@@ -107,58 +106,43 @@ class CMSJobs(hf.module.ModuleBase):
         strwebpage = webpage.read()
         tree = parse(StringIO.StringIO(strwebpage))
 
-        # Function to convert raw time data given in UTC to local time zone
-        def ChangeTimeZone(TimeStringIn, InFormatString, OutFormatString):
-            Date = datetime.strptime(TimeStringIn, InFormatString).replace(
-                    tzinfo=pytz.utc).astimezone(pytz.timezone('Europe/Berlin'))
-            return(Date.strftime(OutFormatString))
+        # Get the job numbers per category and time point, categories not
+        # listed in the config file are appended to the category list
+        to_local = local_time_converter("%d-%b-%y %H:%M:%S", "%Y-%m-%d %H:%M:%S")
+        series = JobTimeSeries.from_rows(tree.findall('.//jobs/item'),
+                str(self.config['category_tag']), str(self.config['data_tag']),
+                self.cat_names, convert=to_local)
+        self.cat_names = series.categories
 
-        # Get lists for startdates, categories, data
-        timeseries = {}
-        for entry in tree.findall('.//jobs/item'):
-            start_date = entry.find('s_date').text_content()
-            cat = entry.find(str(self.config['category_tag'])).text_content()
-            value = entry.find(str(self.config['data_tag'])).text_content()
-            start_date = ChangeTimeZone(start_date, "%d-%b-%y %H:%M:%S", "%Y-%m-%d %H:%M:%S")
-            timeseries.setdefault(start_date, {})[cat] = int(value)
-            if cat not in self.cat_names:
-                self.cat_names.append(cat)
-
-        # Get categories and add them to the category list derived from
-        # the config file if they are not already listed there
-        category_overview = {}
-        for tp in timeseries:
-            timeseries[tp]['total'] = sum(timeseries[tp].values())
-            for cat in (self.cat_names + ['total']):
-                category_overview.setdefault(cat, {})[tp] = timeseries[tp].get(cat, 0)
-
-        time_points = sorted(timeseries)
+        time_points = series.time_points
         current_hour = '0 0'
         last_hour = '0 0'
+        jobs_current = jobs_last = np.zeros(len(series.jobs), dtype=int)
         if len(time_points) > 1:
             current_hour = time_points[-1]
             last_hour = time_points[-2]
-
-        for cat in self.cat_names:
-            jobs_current = timeseries[current_hour].get(cat, 0)
-            jobs_last = timeseries[last_hour].get(cat, 0)
-            frac_current = jobs_current / float(max(1, timeseries[current_hour].get('total', 0)))
-            frac_last = jobs_last / float(max(1, timeseries[last_hour].get('total', 0)))
-            job_list = category_overview.get(cat, {}).values()
+            jobs_current = series.column(-1)
+            jobs_last = series.column(-2)
+        frac_current = percent_of_total(jobs_current)
+        frac_last = percent_of_total(jobs_last)
+        min_jobs = series.minimum()
+        max_jobs = series.maximum()
+        avg_jobs = series.average()
+
+        for cat_idx, cat in enumerate(self.cat_names):
             cat_data = {'CatName': cat,
-                'JobsCurrentHour': jobs_current,
-                'JobFracsCurrentHour': '%.1f' % (100.0 * frac_current),
-                'JobsLastHour': jobs_last,
-                'JobFracsLastHour': '%.1f' % (100.0 * frac_last),
-                'MinJobs': min(job_list), 'MaxJobs': max(job_list),
-                'AvgJobs': sum(job_list) / float(max(1, len(timeseries)))}
+                'JobsCurrentHour': int(jobs_current[cat_idx]),
+                'JobFracsCurrentHour': '%.1f' % frac_current[cat_idx],
+                'JobsLastHour': int(jobs_last[cat_idx]),
+                'JobFracsLastHour': '%.1f' % frac_last[cat_idx],
+                'MinJobs': int(min_jobs[cat_idx]), 'MaxJobs': int(max_jobs[cat_idx]),
+                'AvgJobs': float(avg_jobs[cat_idx])}
             self.statistics_db_value_list.append(cat_data)
 
+        to_local = local_time_converter("%Y-%m-%d %H:%M:%S", "%d-%b-%y %H:%M:%S")
         data['InstanceTitle'] = self.config['name']
-        data['IntervalStart'] = ChangeTimeZone(tree.find(".//start").text_content(
-                ).split(".")[0], "%Y-%m-%d %H:%M:%S", "%d-%b-%y %H:%M:%S")
-        data['IntervalEnd'] = ChangeTimeZone(tree.find(".//end").text_content(
-                ).split(".")[0], "%Y-%m-%d %H:%M:%S", "%d-%b-%y %H:%M:%S")
+        data['IntervalStart'] = to_local(tree.find(".//start").text_content().split(".")[0])
+        data['IntervalEnd'] = to_local(tree.find(".//end").text_content().split(".")[0])
         data['CurrentHourStart'] = current_hour.split(' ')[1]
         data['CurrentHourEnd'] = data['IntervalEnd'].split(' ')[1]
         data['LastHourStart'] = last_hour.split(' ')[1]
@@ -184,7 +168,7 @@ class CMSJobs(hf.module.ModuleBase):
         else:
             ind = np.arange(nbins)   # the x locations for the groups
             width = 1.00   # the width of the bars: can also be len(x) sequence
-            max_val = max(category_overview['total'].values())
+            max_val = max_jobs[-1]
             xlabels = [0]*nbins
             for i in range(0, nbins):
                 if i % 2 == 0:
@@ -195,26 +179,15 @@ class CMSJobs(hf.module.ModuleBase):
                     xlabels[i] = ''
 
             # calculate bottom levels in order to enforce stacking
-            cat_bottoms = [[0] * len(time_points)] * len(self.cat_names)
-            for cat_idx, cat in enumerate(self.cat_names):
-                if cat_idx > 0:
-                    cat_bottoms[cat_idx] = list(cat_bottoms[cat_idx - 1])
-                for t_idx, tp in enumerate(time_points):
-                    cat_bottoms[cat_idx][t_idx] += category_overview.get(cat, {}).get(tp, 0)
+            cat_bottoms = series.stack_bottoms()
 
             # Create figure and plot job numbers of the different categories
             fig = self.plt.figure(figsize=(10,5.8))
             axis = fig.add_subplot(111)
             p = []
             for cat_idx, cat in enumerate(self.cat_names):
-                values = []
-                for tp in time_points:
-                    values.append(category_overview[cat][tp])
-                if cat_idx > 0:
-                    p.append(axis.bar(ind, values, width, color=getcolor(cat),
-                        bottom=cat_bottoms[cat_idx - 1]))
-                else:
-                    p.append(axis.bar(ind, values, width, color=getcolor(cat)))
+                p.append(axis.bar(ind, series.jobs[cat_idx], width, color=getcolor(cat),
+                    bottom=cat_bottoms[cat_idx]))
             if self.pledge_mode > 0:
                 l = axis.axhline(y=yhline, linewidth=3.0, color='Black')
             else:
@@ -249,6 +222,7 @@ class CMSJobs(hf.module.ModuleBase):
 
             fig.savefig(hf.downloadService.getArchivePath(self.run, 
                     self.instance_name + "_jobs_dist.png"), dpi=91)
+            self.plt.close(fig)
             data["filename_plot"] = self.instance_name + "_jobs_dist.png"
 
         return data
@@ -109,6 +109,7 @@ class CMSPhedexBlockReplicas(hf.module.ModuleBase):
         plot_fn = self.instance_name + '_history.svg'
         archive_path = hf.downloadService.getArchivePath(self.run, plot_fn)
         fig.savefig(archive_path)
+        plt.close(fig)
         # eventually copy to remote archive directory
         remote_archive_path = hf.downloadService.remote_archive_dir
         if remote_archive_path:
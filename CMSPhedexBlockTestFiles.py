@@ -17,9 +17,54 @@
 import hf
 from datetime import datetime
 import time
+import re
 from sqlalchemy import TEXT, INT, Column
 from lxml import etree
 
+
+def keyword_pattern(keywords):
+    """Compiled regex matching any of the non-empty keywords, None if there are none."""
+    keywords = [keyword for keyword in keywords if keyword != '']
+    if not keywords:
+        return None
+    return re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+
+
+class BlockTestReport(object):
+    """
+    Streaming reader of a PhEDEx block test report (root > node > block >
+    test > file). Only the attributes of the root are read on creation,
+    blocks() walks the rest of the file once with iterparse and drops every
+    block after it has been handed out, so the memory does not grow with
+    the size of the report.
+    """
+
+    def __init__(self, path):
+        self._context = etree.iterparse(path, events=('start', 'end'))
+        event, self.root = next(self._context)
+        self.request_date = self.root.get('request_date')
+        self.request_timestamp = int(float(self.root.get('request_timestamp')))
+
+    def blocks(self):
+        """
+        Generate (block name, tests) of the blocks of all nodes, tests is a
+        list of (time_reported, file names) of the tests of the block.
+        """
+        for event, element in self._context:
+            if event != 'end' or element.tag not in ('block', 'node'):
+                continue
+            parent = element.getparent()
+            if element.tag == 'block' and parent is not None and parent.tag == 'node' \
+                    and parent.getparent() is not None and parent.getparent().getparent() is None:
+                tests = [(int(float(test.get('time_reported'))),
+                          [sub_file.get('name') for sub_file in test.iterchildren('file')])
+                         for test in element.iterchildren('test')]
+                yield element.get('name'), tests
+            # drop the finished element and its finished siblings
+            element.clear()
+            while parent is not None and element.getprevious() is not None:
+                del parent[0]
+
 class CMSPhedexBlockTestFiles(hf.module.ModuleBase):
 
     config_keys = {
@@ -57,6 +102,8 @@ class CMSPhedexBlockTestFiles(hf.module.ModuleBase):
         self.warning_limit = float(self.config["input_xml_age_limit"])
         self.filters = self.config["filter"].strip().split(',')
         self.filters_exceptions = self.config['forced_pass'].strip().split(',')
+        self.reject_pattern = keyword_pattern(self.filters)
+        self.forced_pass_pattern = keyword_pattern(self.filters_exceptions)
 
         if 'blocktest_xml' not in self.config: raise hf.exceptions.ConfigError('blocktest_xml option not set')
         self.blocktest_xml = hf.downloadService.addDownload(self.config['blocktest_xml'])
@@ -67,222 +114,95 @@ class CMSPhedexBlockTestFiles(hf.module.ModuleBase):
         data = {'request_timestamp': 0}
         data['status'] = 1.0
 
-        source_tree = etree.parse(open(self.blocktest_xml.getTmpPath()))
-        root = source_tree.getroot()
-        data["request_date"] = root.get('request_date')
-        data["request_timestamp"] = int(float(root.get('request_timestamp')))
+        report = BlockTestReport(self.blocktest_xml.getTmpPath())
+        data["request_date"] = report.request_date
+        data["request_timestamp"] = report.request_timestamp
+        # The latest dataset of this instance, its data_id is either 'NULL' if
+        # it holds the details itself or the id of the dataset holding them.
+        # Datasets referring to another one carry a copy of its values.
         old_data = self.module_table.select().where(self.module_table.c.instance==self.instance_name).\
             order_by(self.module_table.c.id.desc()).execute().fetchone()
-        if old_data == None or old_data['data_id'] == None:
-            self.save_data = 'yes'
-            data['data_id'] = 'NULL'
-#No old data was found, parse the file and store all values in database:
-
-            num_blocks_raw =0 
-            num_files_raw = 0
-            num_blocks = 0
-            num_files = 0
-
-            for node in root:
-                if node.tag == 'node':
-                    for block in node:
-                        if block.tag == 'block':
-                            block_name = block.get('name')
-                            block_time_reported = 0
-                            akt_files_raw = 0
-                            akt_files = 0
-                            num_blocks_raw += 1
-                            for test in block:
-                                if test.tag == 'test':
-                                    block_time_reported = int(float(test.get('time_reported')))
-                                    for sub_file in test:
-                                        if sub_file.tag == 'file':
-                                            akt_files_raw +=1
-                                            num_files_raw +=1
-                                            file_name = sub_file.get('name')
-                                            filtered_out=0
-                                            for check_reject in self.filters:
-                                                if check_reject is not '' and check_reject in file_name:
-                                                    filtered_out=1
-                                            for check_exception in self.filters_exceptions:
-                                                if check_exception is not '' and check_exception in file_name: 
-                                                    filtered_out=0
-                                            num_files +=1-filtered_out
-                                            akt_files +=1-filtered_out
-                                            self.details_db_value_list.append({'block': file_name,
-                                                                    'isfile':  int(1),
-                                                                    'time_reported':  block_time_reported,
-                                                                    'fails': num_blocks,
-                                                                    'fails_raw': num_blocks_raw,
-                                                                    'filtered': filtered_out,
-                                                                    })
-                            block_filtered_out=1
-                            if akt_files>0:
-                                num_blocks += 1
-                                block_filtered_out=0
-                            self.details_db_value_list.append({'block': block_name,
-                                                    'isfile': int(0),
-                                                    'time_reported': block_time_reported,
-                                                    'fails': akt_files,
-                                                    'fails_raw': akt_files_raw,
-                                                    'filtered':  block_filtered_out,
-                                                    })
-
-            data["failed_blocks_raw"] = num_blocks_raw - num_blocks 
-            data["failed_blocks"] = num_blocks
-            data["failed_total_files_raw"] = num_files_raw - num_files
-            data["failed_total_files"] = num_files
-
+        if old_data is not None and old_data['data_id'] is not None \
+                and old_data['request_timestamp'] == data['request_timestamp']:
+            # we have old data, just copy them all over
+            data['data_id'] = old_data['id'] if old_data['data_id'] == 'NULL' else old_data['data_id']
+            data["failed_blocks_raw"] = old_data['failed_blocks_raw']
+            data["failed_blocks"] = old_data['failed_blocks']
+            data["failed_total_files_raw"] = old_data['failed_total_files_raw']
+            data["failed_total_files"] = old_data['failed_total_files']
+            data['request_date'] = old_data['request_date']
             if data["failed_total_files"] > 0 or data["failed_blocks"] > 0:
                 data['status'] = 0.0
-
         else:
-            if old_data['data_id'] != 'NULL':
-                old_data = self.module_table.select().where(self.module_table.c.id==old_data['data_id']).execute().fetchone()
-            elif old_data['data_id'] == 'NULL':
-                pass
-            else:
-                self.logger.error('Something went terrebly wrong. The dataset, loaded from db was coruppted, file parsed and stored in db')
-            if old_data['request_timestamp'] < data['request_timestamp']:
-                #The dataset in the db is older than the current, now there is work to do!
-                self.save_data = 'yes'
-                data['data_id'] = 'NULL'
-                num_blocks_raw =0 
-                num_files_raw = 0
-                num_blocks = 0
-                num_files = 0
-
-                for node in root:
-                    if node.tag == 'node':
-                        for block in node:
-                            if block.tag == 'block':
-                                block_name = block.get('name')
-                                block_time_reported = 0
-                                akt_files_raw = 0
-                                akt_files = 0
-                                num_blocks_raw += 1
-                                for test in block:
-                                    if test.tag == 'test':
-                                        block_time_reported = int(float(test.get('time_reported')))
-                                        for sub_file in test:
-                                            if sub_file.tag == 'file':
-                                                akt_files_raw +=1
-                                                num_files_raw +=1
-                                                file_name = sub_file.get('name')
-                                                filtered_out=0
-                                                for check_reject in self.filters:
-                                                    if check_reject is not '' and check_reject in file_name:
-                                                        filtered_out=1
-                                                for check_exception in self.filters_exceptions:
-                                                    if check_exception is not '' and check_exception in file_name: 
-                                                        filtered_out=0
-                                                num_files +=1-filtered_out
-                                                akt_files +=1-filtered_out
-                                                self.details_db_value_list.append({'block': file_name,
-                                                                        'isfile':  int(1),
-                                                                        'time_reported':  block_time_reported,
-                                                                        'fails': num_blocks,
-                                                                        'fails_raw': num_blocks_raw,
-                                                                        'filtered': filtered_out,
-                                                                        })
-                                block_filtered_out=1
-                                if akt_files>0:
-                                    num_blocks += 1
-                                    block_filtered_out=0
-                                self.details_db_value_list.append({'block': block_name,
-                                                            'isfile': int(0),
-                                                            'time_reported': block_time_reported,
-                                                            'fails': akt_files,
-                                                            'fails_raw': akt_files_raw,
-                                                            'filtered':  block_filtered_out,
-                                                        })
-
-                data["failed_blocks_raw"] = num_blocks_raw - num_blocks
-                data["failed_blocks"] = num_blocks
-                data["failed_total_files_raw"] = num_files_raw - num_files
-                data["failed_total_files"] = num_files
-
-                if data["failed_total_files"] > 0 or data["failed_blocks"] > 0:
-                    data['status'] = 0.0
-
-            elif old_data['request_timestamp'] == data['request_timestamp']:
-                # we have old data, just copy them all over
-                data['data_id'] = old_data['id']
-                data["failed_blocks_raw"] = old_data['failed_blocks_raw']
-                data["failed_blocks"] = old_data['failed_blocks']
-                data["failed_total_files_raw"] = old_data['failed_total_files_raw']
-                data["failed_total_files"] = old_data['failed_total_files']
-                data["request_timestamp"] = old_data['request_timestamp']
-                data['request_date'] = old_data['request_date']
-                if data["failed_total_files"] > 0 or data["failed_blocks"] > 0:
-                    data['status'] = 0.0
-
-            else:
+            if old_data is not None and old_data['data_id'] is not None \
+                    and old_data['request_timestamp'] > data['request_timestamp']:
                 self.logger.error('Something went terrebly wrong. the timestamp of the old dataset seems to be greater than the new one...')
                 data['status'] = -2
-                self.save_data = 'yes'
-                data['data_id'] = 'NULL'
-                num_blocks_raw =0 
-                num_files_raw = 0
-                num_blocks = 0
-                num_files = 0
-
-                for node in root:
-                    if node.tag == 'node':
-                        for block in node:
-                            if block.tag == 'block':
-                                block_name = block.get('name')
-                                block_time_reported = 0
-                                akt_files_raw = 0
-                                akt_files = 0
-                                num_blocks_raw += 1
-                                for test in block:
-                                    if test.tag == 'test':
-                                        block_time_reported = int(float(test.get('time_reported')))
-                                        for sub_file in test:
-                                            if sub_file.tag == 'file':
-                                                akt_files_raw +=1
-                                                num_files_raw +=1
-                                                file_name = sub_file.get('name')
-                                                filtered_out=0
-                                                for check_reject in self.filters:
-                                                    if check_reject is not '' and check_reject in file_name:
-                                                        filtered_out=1
-                                                for check_exception in self.filters_exceptions:
-                                                    if check_exception is not '' and check_exception in file_name: 
-                                                        filtered_out=0
-                                                num_files +=1-filtered_out
-                                                akt_files +=1-filtered_out
-                                                self.details_db_value_list.append({'block': file_name,
-                                                                        'isfile':  int(1),
-                                                                        'time_reported':  block_time_reported,
-                                                                        'fails': num_blocks,
-                                                                        'fails_raw': num_blocks_raw,
-                                                                        'filtered': filtered_out,
-                                                                        })
-                                block_filtered_out=1
-                                if akt_files>0:
-                                    num_blocks += 1
-                                    block_filtered_out=0
-                                self.details_db_value_list.append({'block': block_name,
-                                                            'isfile': int(0),
-                                                            'time_reported': block_time_reported,
-                                                            'fails': akt_files,
-                                                            'fails_raw': akt_files_raw,
-                                                            'filtered':  block_filtered_out,
-                                                        })
-
-                data["failed_blocks_raw"] = num_blocks_raw - num_blocks
-                data["failed_blocks"] = num_blocks
-                data["failed_total_files_raw"] = num_files_raw - num_files
-                data["failed_total_files"] = num_files
+            #No data of this request was found, parse the file and store all values in database:
+            self.save_data = 'yes'
+            data['data_id'] = 'NULL'
+            data.update(self.collectDetails(report))
+            if data['status'] == 1.0 and (data["failed_total_files"] > 0 or data["failed_blocks"] > 0):
+                data['status'] = 0.0
 
-            if data['status'] == 1.0 and data['request_timestamp'] + 3600 * 24 * self.warning_limit <= time.time():
-                data['status'] = 0.5
-            elif data['status'] == 0.0 and data['request_timestamp'] +3600 * 24 * self.warning_limit <= time.time():
-                data['status'] = 0.1
+        if data['status'] == 1.0 and data['request_timestamp'] + 3600 * 24 * self.warning_limit <= time.time():
+            data['status'] = 0.5
+        elif data['status'] == 0.0 and data['request_timestamp'] +3600 * 24 * self.warning_limit <= time.time():
+            data['status'] = 0.1
         return data
 
+    def collectDetails(self, report):
+        """
+        Fill the details of all blocks and files of report and return the
+        numbers of failed blocks and files.
+        """
+        num_blocks_raw = 0
+        num_files_raw = 0
+        num_blocks = 0
+        num_files = 0
+        for block_name, tests in report.blocks():
+            block_time_reported = 0
+            akt_files_raw = 0
+            akt_files = 0
+            num_blocks_raw += 1
+            for block_time_reported, file_names in tests:
+                for file_name in file_names:
+                    filtered_out = self.isFiltered(file_name)
+                    akt_files_raw += 1
+                    akt_files += 1-filtered_out
+                    self.details_db_value_list.append({'block': file_name,
+                                            'isfile':  int(1),
+                                            'time_reported':  block_time_reported,
+                                            'fails': num_blocks,
+                                            'fails_raw': num_blocks_raw,
+                                            'filtered': filtered_out,
+                                            })
+            num_files_raw += akt_files_raw
+            num_files += akt_files
+            block_filtered_out=1
+            if akt_files>0:
+                num_blocks += 1
+                block_filtered_out=0
+            self.details_db_value_list.append({'block': block_name,
+                                    'isfile': int(0),
+                                    'time_reported': block_time_reported,
+                                    'fails': akt_files,
+                                    'fails_raw': akt_files_raw,
+                                    'filtered':  block_filtered_out,
+                                    })
+        return {"failed_blocks_raw": num_blocks_raw - num_blocks,
+                "failed_blocks": num_blocks,
+                "failed_total_files_raw": num_files_raw - num_files,
+                "failed_total_files": num_files}
+
+    def isFiltered(self, file_name):
+        """1 if file_name contains a filter keyword but no forced_pass keyword, else 0."""
+        if self.reject_pattern is None or self.reject_pattern.search(file_name) is None:
+            return 0
+        if self.forced_pass_pattern is not None and self.forced_pass_pattern.search(file_name) is not None:
+            return 0
+        return 1
+
     def fillSubtables(self, parent_id):
         if self.save_data == 'yes':
             self.subtables['details'].insert().execute([dict(parent_id=parent_id, **row) for row in self.details_db_value_list])
@@ -5,6 +5,7 @@ import json
 from string import strip
 import time
 import sys
+from template_cache import cached_template_data
 
 class CMSPhedexDataExtract(hf.module.ModuleBase):
 
@@ -101,6 +102,7 @@ class CMSPhedexDataExtract(hf.module.ModuleBase):
         self.url1 = self.config['linktest_url']
         self.url1 += str(self.time-self.time_range*3600)
         self.source1 = hf.downloadService.addDownload(self.url1)
+        self.linktest_index = None
         self.critical_average_quality = float(self.config['critical_average_quality'])
 
         self.source = hf.downloadService.addDownload(self.url)
@@ -119,17 +121,35 @@ class CMSPhedexDataExtract(hf.module.ModuleBase):
             self.max_int_size = 24
         self.max_int_val = 1073741823
 
-    def confirmLinkStatus(self, link_name):
+    def buildLinktestIndex(self):
+        # parse the linktest file only once and sum up the qualities of
+        # the recent timebins for every prefix of the link names, so a
+        # link name is confirmed with a single lookup
         fobj1 = json.load(open(self.source1.getTmpPath(), 'r'))['phedex']['link']
 
-        i = 0
-        avg_quality = 0.0
+        self.linktest_index = {}
         for links in fobj1:
-            if links[self.parse_direction].startswith(link_name) and self.your_name not in links[self.link_direction]:
-                for transfer in links['transfer']:
-                    if transfer['quality'] != None and transfer['timebin'] >= self.quality_x_line:
-                        i += 1
-                        avg_quality += float(transfer['quality'])
+            if self.your_name in links[self.link_direction]:
+                continue
+            quality_sum = 0.0
+            count = 0
+            for transfer in links['transfer']:
+                if transfer['quality'] != None and transfer['timebin'] >= self.quality_x_line:
+                    quality_sum += float(transfer['quality'])
+                    count += 1
+            if count == 0:
+                continue
+            name = links[self.parse_direction]
+            for end in xrange(len(name) + 1):
+                quality = self.linktest_index.setdefault(name[:end], [0.0, 0])
+                quality[0] += quality_sum
+                quality[1] += count
+
+    def confirmLinkStatus(self, link_name):
+        if self.linktest_index is None:
+            self.buildLinktestIndex()
+
+        avg_quality, i = self.linktest_index.get(link_name, (0.0, 0))
         if i > 0:
             avg_quality = avg_quality/float(i)
             if avg_quality < self.critical_average_quality:
@@ -138,7 +158,6 @@ class CMSPhedexDataExtract(hf.module.ModuleBase):
                 link_status = 1
         else:
             link_status = 1
-
         return link_status
 
     def getPhedexConfigData(self):
@@ -291,6 +310,7 @@ class CMSPhedexDataExtract(hf.module.ModuleBase):
     def fillSubtables(self, parent_id):
         self.subtables['details'].insert().execute([dict(parent_id=parent_id, **row) for row in self.details_db_value_list])
 
+    @cached_template_data()
     def getTemplateData(self):
 
         self.getPhedexConfigData()
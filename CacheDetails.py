@@ -16,18 +16,19 @@
 
 import hf
 from sqlalchemy import TEXT, Column
-import json
 import time
-import socket
 import logging
-import urllib2
+from concurrent_fetch import FetchPool
+from json_stream import iter_object_items
+from streaming_histogram import StreamingHistogram, common_binning
 
 class CacheDetails(hf.module.ModuleBase):
     config_keys = {'source_url': ('Not used, but filled to avoid warnings', 'http://ekpsg01.ekp.kit.edu:8080/cache/content/'),
                    'plotsize_x': ('size of the plot in x', '10'),
                    'plotsize_y': ('size of plot in y', '5'),
                    'score_limit': ('maximum score', '1000'),
-                   'nbins': ('number of bins in histograms', '50')
+                   'nbins': ('number of bins in histograms', '50'),
+                   'fetch_timeout': ('timeout in seconds for reading from a cache machine', '2')
                    }
 
     table_columns = [
@@ -62,49 +63,27 @@ class CacheDetails(hf.module.ModuleBase):
 	
 	self.logger = logging.getLogger(__name__)
 	self.machines = ['ekpsg01', 'ekpsg02', 'ekpsg03', 'ekpsg04', 'ekpsm01']
-        self.machine_data = {}
 
 
     def extractData(self):
 	# read details for every file from filelist
         self.logger.info("Script to acquire details data form Cache.")
-        for machine in self.machines:
-            self.machine_data[machine] = {}
-            file_count = 0
-            status = ""
-            self.logger.info("Reading detailed data from " + machine  + '...')
-            url = "http://" + machine + ".ekp.kit.edu:8080/cache/content/*"
-            # html request + error handling
-            req = urllib2.Request(url)
-            try:
-                response = urllib2.urlopen(req, timeout=2)
-                html = response.read()
-                status = "Aquisition successful"
-                services = json.loads(html)
-                filenames = services.keys()
-                file_count = len(filenames)
-                for filename in filenames:
-                    self.machine_data[machine][filename] = {
-                        'size': services[filename]['size'],
-                        'allocated': services[filename]['allocated'],
-                        'score': services[filename]['score'],
-                        'maintained': services[filename]['maintained']
-                    }
-                self.logger.info("Sucessful")
-            except urllib2.URLError as e:
-                self.logger.error(str(e.reason) + " " + machine)
-                status = "Aquisition failed"
-            except socket.timeout, e:
-                self.logger.error(("There was an error while reading the file details: %r " % e) + machine)
-                status = "Aquisition failed"
-            except socket.timeout:
-                self.logger.error("socket timeout " + machine)
-                status = "Aquisition failed"
-            # load json file and dump data into lists
-            self.machine_data[machine]["status"] = status
-            self.machine_data[machine]["file_count"] = file_count
-            self.machine_data[machine]["error_count"] = 0		
-	
+        # the listings of all machines are read at the same time and folded
+        # into the histograms while they are parsed
+        urls = dict(("http://" + machine + ".ekp.kit.edu:8080/cache/content/*", machine) for machine in self.machines)
+        pool = FetchPool(workers=len(self.machines), per_host=1, timeout=self.config['fetch_timeout'])
+        with pool:
+            results = pool.fetch(urls.keys(), self.read_listing)
+        machine_stats = {}
+        for url, result in results.iteritems():
+            machine = urls[url]
+            if result.ok:
+                self.logger.info("Reading detailed data from " + machine + " sucessful")
+                machine_stats[machine] = result.data
+            else:
+                self.logger.error("There was an error while reading the file details: %s " % result.error + machine)
+                machine_stats[machine] = None
+
         data = {}
         data['filename_plot'] = ""
         data['error_msg'] = ""
@@ -112,65 +91,77 @@ class CacheDetails(hf.module.ModuleBase):
         self.plot_score = []
         self.plot_size = []
         self.plot_maint = []
-        machines = self.machine_data.keys()
-        for machine in machines:
-            filenames = self.machine_data[machine].keys()
-            filenames.remove('status')  # fix filenames list
-            filenames.remove('file_count')
-            filenames.remove('error_count')
-            allocated = list(self.machine_data[machine][id]['allocated'] for id in filenames)
-            allocated = filter(lambda x: x >= 0, allocated)
-            alloc = list(map(lambda x: round((time.time()-float(x))/(60*60), 2), allocated))
-            score = list(self.machine_data[machine][id]['score']for id in filenames)
-            for k in xrange(len(score)):
-                if score[k] is None:
-                    score[k] = 0
-            sizes = list(int(self.machine_data[machine][id]['size']) for id in filenames)
-            maintained = list(self.machine_data[machine][id]['maintained']for id in filenames)
-            maintained = filter(lambda x: x != 0, maintained)
-            maint = list(map(lambda x: round((time.time()-float(x))/(60*60*24), 2), maintained))
-            # find data with higher score than threshold in config and fill Subtable
-            for k, filename in enumerate(filenames):
-                if score[k] >= self.score_limit:
-                    overscore = {
-                        'filename': filename,
-                        'score': score[k],
-                        'machine': machine,
-                        'size': round(float(sizes[k]/(1024*1024)), 1)
-                    }
-                    self.overscore_db_value_list.append(overscore)
-            self.plot_size.append(list(map(lambda x: float(x)/(1024*1024), sizes)))
-            self.plot_alloc.append(alloc)
-            self.plot_score.append(score)
-            self.plot_maint.append(maint)
-
-        file_count = list(self.machine_data[id]['file_count']for id in machines)
-        status = list(self.machine_data[id]['status'] for id in machines)
-        error_count = list(self.machine_data[id]['error_count'] for id in machines)
+        failed = 0
+        file_count = 0
         #  Error handling for acquisition of data
-        for i, machine in enumerate(machines):
+        for machine in self.machines:
+            stats = machine_stats[machine]
             details_data = {'machine': machine}
-            details_data['files'] = file_count[i]
-            details_data['error_count'] = error_count[i]
-            failed = 0
-            if "failed" in status[i]:
+            details_data['error_count'] = 0
+            if stats is None:
+                details_data['files'] = 0
                 details_data['status'] = 'data aquisition failed'
                 data['status'] = 0.5
                 failed += 1
+                stats = self.new_listing_stats()
             else:
+                details_data['files'] = stats['file_count']
                 details_data['status'] = 'data aquisition successful'
+                file_count += stats['file_count']
+                for overscore in stats['overscore']:
+                    overscore['machine'] = machine
+                    self.overscore_db_value_list.append(overscore)
             self.statistics_db_value_list.append(details_data)
-        if failed == len(machines):
+            self.plot_size.append(stats['size'])
+            self.plot_alloc.append(stats['alloc'])
+            self.plot_score.append(stats['score'])
+            self.plot_maint.append(stats['maint'])
+        if failed == len(self.machines):
             data['status'] = 0
             data['error_msg'] = "No data to display!"
             return data
-        if sum(file_count) == 0:
+        if file_count == 0:
             data['status'] = 0.5
             data['error_msg'] = "No files on caches found"
             return data
         data["filename_plot"] = self.plot()
         return data
 
+    def new_listing_stats(self):
+        return {
+            'file_count': 0,
+            'size': StreamingHistogram(self.nbins),
+            'alloc': StreamingHistogram(self.nbins),
+            'score': StreamingHistogram(self.nbins),
+            'maint': StreamingHistogram(self.nbins),
+            'overscore': []
+        }
+
+    def read_listing(self, response):
+        """Histogram the file listing of one cache machine while it is read."""
+        stats = self.new_listing_stats()
+        now = time.time()
+        for filename, details in iter_object_items(response):
+            stats['file_count'] += 1
+            size = int(details['size'])
+            stats['size'].fill(float(size)/(1024*1024))
+            if details['allocated'] >= 0:
+                stats['alloc'].fill(round((now-float(details['allocated']))/(60*60), 2))
+            score = details['score']
+            if score is None:
+                score = 0
+            stats['score'].fill(score)
+            if details['maintained'] != 0:
+                stats['maint'].fill(round((now-float(details['maintained']))/(60*60*24), 2))
+            # find data with higher score than threshold in config and fill Subtable
+            if score >= self.score_limit:
+                stats['overscore'].append({
+                    'filename': filename,
+                    'score': score,
+                    'size': round(float(size/(1024*1024)), 1)
+                })
+        return stats
+
     def fillSubtables(self, parent_id):
         self.subtables['statistics'].insert().execute([dict(parent_id=parent_id, **row)
                                                        for row in self.statistics_db_value_list])
@@ -188,6 +179,15 @@ class CacheDetails(hf.module.ModuleBase):
         data["overscore"] = map(dict, details_list)
         return data
 
+    def hist_stacked(self, axis, histograms, log=False):
+        """Draw the histograms of all machines with entries stacked on shared bins, returns these machines."""
+        edges, counts = common_binning(histograms, self.nbins)
+        machines_fix = [machine for machine, histogram in zip(self.machines, histograms) if histogram.entries > 0]
+        counts = [content for content, histogram in zip(counts, histograms) if histogram.entries > 0]
+        if machines_fix:
+            axis.hist([edges[:-1]] * len(machines_fix), edges, weights=counts, histtype='bar', stacked=True, log=log)
+        return machines_fix
+
     def plot(self):
         import matplotlib.pyplot as plt
         from matplotlib.font_manager import FontProperties
@@ -195,17 +195,9 @@ class CacheDetails(hf.module.ModuleBase):
 	# Create File Size Distribution plot.
         fig_file_size = plt.figure(figsize=(self.plotsize_x, self.plotsize_y))
         axis_file_size = fig_file_size.add_subplot(111)
-        nbins = self.nbins
         fontLeg = FontProperties()
         fontLeg.set_size('small')
-        # fix arrays so matplotlib 1.3.1 can plot the histograms
-        machines_fix = []
-        plot_fix = []
-        for i in xrange(len(self.plot_size)):
-            if len(self.plot_size[i]) != 0:
-                plot_fix.append(self.plot_size[i])
-                machines_fix.append(self.machines[i])
-        axis_file_size.hist([plot_fix[i] for i in xrange(len(machines_fix))], nbins, histtype='bar', stacked=True)
+        machines_fix = self.hist_stacked(axis_file_size, self.plot_size)
         axis_file_size.legend(machines_fix, loc=6, bbox_to_anchor=(0.8, 0.88), borderaxespad=0., prop = fontLeg)
         axis_file_size.set_xlabel('FileSize in MiB')
         axis_file_size.set_ylabel('Number of Files')
@@ -213,14 +205,7 @@ class CacheDetails(hf.module.ModuleBase):
 	# Create Allocation Time Distribution plot.
 	fig_alloc = plt.figure(figsize=(self.plotsize_x, self.plotsize_y))
         axis_alloc = fig_alloc.add_subplot(111)
-        # fix arrays so matplotlib 1.3.1 can plot the histograms
-        machines_fix = []
-        plot_fix = []
-        for i in xrange(len(self.plot_alloc)):
-            if len(self.plot_alloc[i]) != 0:
-                plot_fix.append(self.plot_alloc[i])
-                machines_fix.append(self.machines[i])
-        axis_alloc.hist([plot_fix[i] for i in xrange(len(machines_fix))], nbins, histtype='bar', stacked=True, log=True)
+        machines_fix = self.hist_stacked(axis_alloc, self.plot_alloc, log=True)
         axis_alloc.legend(machines_fix, loc=6, bbox_to_anchor=(0.8, 0.88), borderaxespad=0., prop = fontLeg)
         axis_alloc.set_xlabel('Allocated since in hours')
         axis_alloc.set_ylabel('Number of Files')
@@ -228,14 +213,7 @@ class CacheDetails(hf.module.ModuleBase):
 	# Create Maintain Time Distribution.
 	fig_maintain = plt.figure(figsize=(self.plotsize_x, self.plotsize_y))
         axis_maintain = fig_maintain.add_subplot(111)
-        # fix arrays so matplotlib 1.3.1 can plot the histograms
-        machines_fix = []
-        plot_fix = []
-        for i in xrange(len(self.plot_maint)):
-            if len(self.plot_maint[i]) != 0:
-                plot_fix.append(self.plot_maint[i])
-                machines_fix.append(self.machines[i])
-        axis_maintain.hist([plot_fix[i] for i in xrange(len(machines_fix))], nbins, histtype='bar', stacked=True, log=True)
+        machines_fix = self.hist_stacked(axis_maintain, self.plot_maint, log=True)
         axis_maintain.legend(machines_fix, loc=6, bbox_to_anchor=(0.8, 0.88), borderaxespad=0., prop = fontLeg)
         axis_maintain.set_xlabel('Maintained since in days')
         axis_maintain.set_ylabel('Number of Files')
@@ -243,14 +221,7 @@ class CacheDetails(hf.module.ModuleBase):
 	# Create Score Distribution Plot.
 	fig_score = plt.figure(figsize=(self.plotsize_x, self.plotsize_y))
         axis_score = fig_score.add_subplot(111)
-        # fix arrays so matplotlib 1.3.1 can plot the histograms
-        machines_fix = []
-        plot_fix = []
-        for i in xrange(len(self.plot_score)):
-            if len(self.plot_score[i]) != 0:
-                plot_fix.append(self.plot_score[i])
-                machines_fix.append(self.machines[i])
-        axis_score.hist([plot_fix[i] for i in xrange(len(machines_fix))], nbins, histtype='bar', stacked=True, log=True)
+        machines_fix = self.hist_stacked(axis_score, self.plot_score, log=True)
         axis_score.legend(machines_fix, loc=6, bbox_to_anchor=(0.8, 0.88), borderaxespad=0., prop=fontLeg)
         axis_score.set_xlabel('Score')
         axis_score.set_ylabel('Number of Files')
@@ -259,9 +230,13 @@ class CacheDetails(hf.module.ModuleBase):
         #plt.tight_layout()
 	plotname = hf.downloadService.getArchivePath(self.run, self.instance_name)
         fig_file_size.savefig(plotname + "_filesize.png", dpi=91)
+        plt.close(fig_file_size)
         fig_alloc.savefig(plotname + "_allocation.png", dpi=91)
+        plt.close(fig_alloc)
         fig_maintain.savefig(plotname + "_maintain.png", dpi=91)
+        plt.close(fig_maintain)
         fig_score.savefig(plotname + "_score.png", dpi=91)
+        plt.close(fig_score)
 	
         return plotname 
 
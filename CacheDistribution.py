@@ -19,24 +19,13 @@ from sqlalchemy import TEXT, INT, Column
 import json
 import numpy as np
 
-import urllib2
 import urllib
 import itertools
-import socket
 import os
 #from counter import Counter # using a backport of collections.Counter for 2.6 
 from collections import Counter
 import logging
-
-class AutoVivification(dict):
-    """Implementation of perl's autovivification feature."""
-    def __getitem__(self, item):
-        try:
-            return dict.__getitem__(self, item)
-        except KeyError:
-            value = self[item] = type(self)()
-            return value
-
+from concurrent_fetch import FetchPool
 
 class CacheDistribution(hf.module.ModuleBase):
 
@@ -46,7 +35,11 @@ class CacheDistribution(hf.module.ModuleBase):
                    'x_min': ('minimum for x ', '1'),
                    'x_max': ('maximum for x', '10000'),
                    'nbinsx': ('number of bins in x', '10'),
-                   'nbinsy': ('number of bins in y', '10')
+                   'nbinsy': ('number of bins in y', '10'),
+                   'fetch_workers': ('number of parallel requests for dataset details', '32'),
+                   'fetch_connections_per_host': ('maximum number of connections to one cache machine', '8'),
+                   'fetch_timeout': ('timeout in seconds for a single request', '2'),
+                   'fetch_deadline': ('seconds after which no more dataset details are requested', '120')
                    }
     table_columns = [
         Column('filename_plot', TEXT),
@@ -63,6 +56,45 @@ class CacheDistribution(hf.module.ModuleBase):
             dist = 0.0
 	return dist
 
+    def build_dataset_matrix(self, machines):
+        """
+        Fill the dense datasets x machines matrices dataset_sizes and
+        dataset_files from in_data, dataset_names holds the row labels.
+        """
+        self.dataset_machines = list(machines)
+        rows = {}
+        entries = []
+        for column, machine in enumerate(self.dataset_machines):
+            for name, details in self.in_data[machine].iteritems():
+                if name in ('status', 'error_count', 'ds_count'):
+                    continue
+                row = rows.setdefault(name, len(rows))
+                entries.append((row, column, details['size'], details['file_count']))
+        self.dataset_names = [None] * len(rows)
+        for name, row in rows.iteritems():
+            self.dataset_names[row] = name
+        self.dataset_sizes = np.zeros((len(rows), len(self.dataset_machines)))
+        self.dataset_files = np.zeros((len(rows), len(self.dataset_machines)), dtype=int)
+        if entries:
+            row, column, size, files = (np.array(values) for values in zip(*entries))
+            self.dataset_sizes[row, column] = size
+            self.dataset_files[row, column] = files
+
+    def distribution_metric(self):
+        """
+        Normalized distance of every dataset from an even distribution over
+        all machines and its total number of files.
+        """
+        n_machines = self.dataset_sizes.shape[1]
+        total_size = self.dataset_sizes.sum(axis=1)
+        norm = np.sqrt(1-1.0/n_machines)
+        metric = np.zeros(len(total_size))
+        valid = total_size > 0
+        if norm > 0:
+            deviation = (total_size[valid, np.newaxis]/n_machines - self.dataset_sizes[valid])/total_size[valid, np.newaxis]
+            metric[valid] = np.round(np.sqrt((deviation**2).sum(axis=1))/norm, 3)
+        return metric, self.dataset_files.sum(axis=1)
+
     def prepareAcquisition(self):
         link = self.config['sourceurl']
         self.plotsize_x = float(self.config['plotsize_x'])
@@ -71,90 +103,74 @@ class CacheDistribution(hf.module.ModuleBase):
         self.nbinsy = int(self.config['nbinsy'])
         self.x_min = float(self.config['x_min'])
         self.x_max = float(self.config['x_max'])
-	
-	self.logger = logging.getLogger(__name__) 
-        self.machines = ['ekpsg01', 'ekpsg02', 'ekpsg03', 'ekpsg04', 'ekpsm01'] 
+
+        self.logger = logging.getLogger(__name__)
+        self.machines = ['ekpsg01', 'ekpsg02', 'ekpsg03', 'ekpsg04', 'ekpsm01']
         self.in_data = {}
-	
-	def load_dslist(url):
-            # to http requests
-            req = urllib2.Request(url)
-            try:
-                response = urllib2.urlopen(req, timeout=2)
-            # handle url error and timeout errors
-            except urllib2.URLError as e:
-                self.logger.error(str(e.reason) + " for " + url)
-                return None
-            except socket.timeout, e:
-                self.logger.error("There was an error while reading " + url + ": %r" % e)
-                return None
-            except socket.timeout:
-                self.logger.error("socket timeout for " + url)
-                return None
-            html = response.read()
+
+        def parse_dslist(html):
             services = json.loads(html)
             dslist = list(itertools.chain(*services.values()))
             for k, entry in enumerate(dslist):
                 dslist[k] = urllib.quote_plus(os.path.dirname(entry))
             # make list of unique datasets
-            dataset = Counter(dslist)
-            return dataset
-	
-	self.logger.info("Script to acquire datasets form Cache.")
+            return Counter(dslist)
+
+        self.logger.info("Script to acquire datasets form Cache.")
+        pool = FetchPool(workers=self.config['fetch_workers'],
+                         per_host=self.config['fetch_connections_per_host'],
+                         timeout=self.config['fetch_timeout'],
+                         deadline=self.config['fetch_deadline'])
+        urls = dict((machine, "http://" + machine + ".ekp.kit.edu:8080/cache/content/")
+                    for machine in self.machines)
+        # the dataset list is fetched once per machine, all machines at once
+        listings = pool.fetch(urls.values())
+        details = {}
         for machine in self.machines:
-	    url = "http://" + machine + ".ekp.kit.edu:8080/cache/content/"
-            error_count = 0
+            url = urls[machine]
             self.in_data[machine] = {}
-            self.logger.info("Reading detailed data from " + machine + '...')
-            try:
-                dslist = load_dslist(url).keys()
-                dssize = load_dslist(url).values()
-            except AttributeError:
-                dslist = load_dslist(url)
-                dssize = load_dslist(url)
+            result = listings[url]
+            dataset = None
+            if result.ok:
+                try:
+                    dataset = parse_dslist(result.data)
+                except ValueError, e:
+                    self.logger.error("Could not parse dataset list of " + url + ": %r" % e)
+            else:
+                self.logger.error(result.error + " for " + url)
             # handle error if dslist is empty
-            if dslist == None:
+            if dataset is None:
                 status = "Aquisition failed"
                 self.logger.error(status + " for " + machine)
-                dslist = []
-                set_count = 0
+                dataset = {}
             else:
-                set_count = len(dslist)
                 status = "Aquisition successful"
-            # loop over every element in dslist
-            for i, entry in enumerate(dslist):
-                url += entry 
-                # html request + error handling
-                dsname = urllib.unquote_plus(entry)
-                req = urllib2.Request(url)
+            self.in_data[machine]['status'] = status
+            self.in_data[machine]['ds_count'] = len(dataset)
+            self.in_data[machine]['error_count'] = 0
+            for entry, file_count in dataset.iteritems():
+                details[url + entry] = (machine, urllib.unquote_plus(entry), file_count)
+        # fan out the per-dataset requests of all machines over the pool
+        self.logger.info("Reading detailed data of %d datasets..." % len(details))
+        results = pool.fetch(details.keys())
+        pool.close()
+        for detail_url, result in results.iteritems():
+            machine, dsname, file_count = details[detail_url]
+            if result.ok:
                 try:
-                    response = urllib2.urlopen(req, timeout=1)
-                    html = response.read()
-                except urllib2.URLError as e:
-                    self.logger.error("URLError" + dsname)
-                    error_count += 1
-                    continue
-		except socket.timeout, e:
-                    self.logger.error(("There was an error while reading the dataset details: %r" % e) + ": " + dsname)
-                    error_count += 1
+                    services = json.loads(result.data)
+                    self.in_data[machine][dsname] = {
+                        'size': services['size'],
+                        'file_count': file_count,
+                        'score': services['score']}
                     continue
-                except socket.timeout:
-                    self.logger.error("socket timeout for " + dsname)
-                    error_count += 1
-                    continue
-                # load json file and dump data into lists
-                services = json.loads(html)
-                self.in_data[machine][dsname] = {
-                    'size': services['size'],
-                    'file_count': dssize[i],
-                    'score': services['score']}
-            self.logger.info("Dataset Details Completed")
-        # generate Output file
-            self.in_data[machine]['status'] = status
-            self.in_data[machine]['ds_count'] = set_count
-            self.in_data[machine]['error_count'] = error_count
-
-	
+                except (ValueError, KeyError), e:
+                    result.error = "invalid dataset details %r" % e
+            self.logger.error("There was an error while reading the dataset details: "
+                              + result.error + ": " + dsname)
+            self.in_data[machine]['error_count'] += 1
+        self.logger.info("Dataset Details Completed (%d requests over %d connections)"
+                         % (pool.requests, pool.connections))
 
     def extractData(self):
         import matplotlib.pyplot as plt
@@ -162,18 +178,7 @@ class CacheDistribution(hf.module.ModuleBase):
         data['filename_plot'] = ""
         data['error_msg'] = ""
         data['failed_machines'] = ""
-        dataset = AutoVivification()
         machines = self.in_data.keys()
-        for machine in machines:
-            dsnames = self.in_data[machine].keys()
-            dsnames.remove('status')
-            dsnames.remove('error_count')
-            dsnames.remove('ds_count')
-            for name in dsnames:
-                dataset[name][machine] = {
-                    'size': self.in_data[machine][name]['size'],
-                    'file_count': self.in_data[machine][name]['file_count']
-                }
         status = list(self.in_data[id]['status'] for id in machines)
         ds_count = list(int(self.in_data[id]['ds_count']) for id in machines)
         error_count = list(int(self.in_data[id]['error_count']) for id in machines)
@@ -186,39 +191,14 @@ class CacheDistribution(hf.module.ModuleBase):
                 data['failed_machines'] += machines[k] + " "
         for machine in removals:  # remove empty machines from dataset
             machines.remove(machine)
-        for i in xrange(len(machines)):
-            failed = 0
-            if "failed" in status[i]:
-                failed += 1
         if len(machines) == 0:
             data['status'] = 0
             data['error_msg'] = "No Cache available"
             return data
-        if failed == len(machines):
-            data['status'] = 0
-            data['error_msg'] = "No data to display!"
-            return data
+        self.build_dataset_matrix(machines)
         # calculate the metric of the Dataset
         # sum over all nodes - optimum minus real value, normed with 1-1/(number of nodes)
-        metric = []
-        file_count = []
-        norm = np.sqrt(1-1.0/len(machines))
-        for k in xrange(len(dataset.keys())):
-            ds = dataset.keys()[k]
-            temp = 0
-            temp_2 = 0
-            ds_total_size = sum(dataset[ds][id]['size'] for id in dataset[ds].keys())
-            for j in xrange(len(machines)):
-                try:
-                    machine = dataset[ds].keys()[j]
-                    size = dataset[ds][machine]['size']
-                    temp += dataset[ds][machine]['file_count']
-                except IndexError:
-                    size = 0
-                opt = (float(ds_total_size)*(1.0/(len(machines))))
-                temp_2 += pow((float(opt - size)/ds_total_size), 2)
-            metric.append(round((np.sqrt(temp_2)/norm), 3))
-            file_count.append(temp)
+        metric, file_count = self.distribution_metric()
         if sum(file_count) == 0:
             data['status'] = 0.5
             data['error_msg'] = "No files on caches found"
@@ -256,6 +236,7 @@ class CacheDistribution(hf.module.ModuleBase):
         plt.tight_layout()
         fig.savefig(hf.downloadService.getArchivePath(
             self.run, self.instance_name + "_filesize.png"), dpi=91)
+        plt.close(fig)
         data["filename_plot"] = self.instance_name + "_filesize.png"
         data['datasets'] = len(file_count)
         data['failed_datasets'] = sum(error_count)
@@ -16,20 +16,22 @@
 
 import hf
 from sqlalchemy import TEXT, Column
-import json
 import time
 
 import logging
-import socket
-import datetime
-import urllib2
+from bucket_store import BucketStore
+from coordinator_stats import fetch_new_records
+from plot_service import PlotService
+from plot_cache import plot_digest
 
 class CacheHitMiss(hf.module.ModuleBase):
     config_keys = {'source_url': ('Not used, but filled to avoid warnings', 'http://ekpsg03.ekp.kit.edu:8082/coordinator/stats/'),
                    'plotsize_x': ('size of the plot in x', '8.9'),
                    'plotsize_y': ('size of plot in y', '5'),
                    'time_limit': ('in days max 30 days', '7'),
-                   'nbins': ('number of bins in histograms', '5')
+                   'nbins': ('number of bins in histograms', '5'),
+                   'incremental_store': ('File keeping the histogram of the last time_limit days between runs, so only new jobs are read. Leave empty to read all jobs of the time limit every run', ''),
+                   'since_parameter': ('Query parameter of the coordinator selecting records from a minimum time on, leave empty if not supported', '')
                    }
     table_columns = [
         Column('filename_plot', TEXT),
@@ -38,58 +40,44 @@ class CacheHitMiss(hf.module.ModuleBase):
     
 
     def prepareAcquisition(self):
+        PlotService.instance()
 	# Setting defaults
 	self.source_url = self.config["source_url"]
         self.plotsize_x = float(self.config['plotsize_x'])
         self.plotsize_y = float(self.config['plotsize_y'])
         self.nbins = int(self.config['nbins'])
-        self.time_limit = int(self.config['time_limit'])
-        self.time_limits = time.time() - self.time_limit*24*60*60
+        self.time_limit = min(int(self.config['time_limit']), 30)
 
 	self.logger = logging.getLogger(__name__)
         self.inp_data = {}
 	self.inp_data['error'] = ""
-	self.date = time.time()-(2592000)  # tlimit = 2592000
-	jobs = {'creation_time': 0,
-                'locality_rate': 0,
-	        'node_id': 0,
-                'cachehit_rate': 0
-               }
-	# function to load the filelists from ekpsg-machines
+	# Hourly buckets of the jobs of the last time_limit days, the rates
+	# are kept as 2d histogram with a resolution of 0.01
+	self.store = BucketStore(self.config['incremental_store'], self.time_limit*24*60*60)
+	fields = ['locality_rate', 'node_id', 'creation_time', 'cachehit_rate']
         url = "http://ekpsg03.ekp.kit.edu:8082/coordinator/stats/"
-        # read data from every file in filelists
+        # read only the jobs that were created since the last run
         self.logger.info("Script to acquire job and life_time information from coordinator.")
-	urltotal = url + "jobs" + "?fields=" + \
-	    "&fields=".join(jobs.keys())  # build url for request
-	self.logger.info("url: " + urltotal)
-	req = urllib2.Request(urltotal)
+	now = time.time()
+	self.store.expire(now)
 	try:
-	    response = urllib2.urlopen(req, timeout=30)
-	    # handle url error and timeout errors
-	except urllib2.URLError as e:
-	    self.logger.error(e.reason)
+	    jobs = fetch_new_records(self.store, url, "jobs", fields, "creation_time",
+	                             self.config['since_parameter'], 30, now)
+	except IOError, e:
+	    self.logger.error(str(e))
 	    self.inp_data['error'] += " Connection problems"
-	except socket.timeout, e:
-	    self.logger.error("There was an error while reading " + url + ": %r" % e)
-	    self.inp_data['error'] += " Connection problems"
-	except socket.timeout:
-	    self.logger.error("socket timeout")
-	    self.inp_data['error'] += " Connection problems"
-	html = response.read()
-	services = json.loads(html)
-	self.inp_data["jobs"] = []
-	for service in services:
-	    if service[2] > int(self.date):
-		self.inp_data["jobs"].append(
-					    {'creation_time': service[2],
-					     'locality_rate': service[0],
-					     'cachehit_rate': service[3]
-					    }
-				   )
+	    return
+	for job in jobs:
+	    cell = "%d,%d" % (round(float(job[3])*100), round(float(job[0])*100))
+	    cells = self.store.bucket(job[2]).setdefault("rates", {})
+	    cells[cell] = cells.get(cell, 0) + 1
+	try:
+	    self.store.save()
+	except (IOError, OSError), e:
+	    self.logger.error("Failed to save the incremental store %s: %s" % (self.config['incremental_store'], e))
 
 
     def extractData(self):
-        import matplotlib.pyplot as plt
         import numpy as np
         data = {}
         data['filename_plot'] = ""
@@ -98,27 +86,42 @@ class CacheHitMiss(hf.module.ModuleBase):
             data['status'] = 0
             data['error_msg'] = "Connection to Coordinator failed"
             return data
+        # merge the 2d histograms of all buckets
+        cells = {}
+        for start, bucket in self.store.buckets():
+            for cell, count in bucket.get("rates", {}).iteritems():
+                cells[cell] = cells.get(cell, 0) + count
         hit_list = []
         local_list = []
-        for entry in self.inp_data['jobs']:
-            if entry['creation_time'] > self.time_limits:
-                hit_list.append(float(entry['cachehit_rate']))
-                local_list.append(float(entry['locality_rate']))
+        weights = []
+        for cell, count in cells.iteritems():
+            hit, local = cell.split(",")
+            hit_list.append(int(hit)/100.)
+            local_list.append(int(local)/100.)
+            weights.append(count)
         # generate 2d histogram
         nbins = 1.0/(self.nbins)
         bins = [np.arange(0.0, 1.1, nbins), np.arange(0.0, 1.1, nbins)]
-        H, xedges, yedges = np.histogram2d(hit_list, local_list, bins=bins)
-        fig = plt.figure(figsize=(self.plotsize_x, self.plotsize_y))
-        H = np.rot90(H)
-        H = np.flipud(H)
-        plt.pcolor(xedges, yedges, H, cmap='Blues')
-        cbar = plt.colorbar()
-        cbar.ax.set_ylabel('Jobs')
-        plt.ylabel('locality rate')
-        plt.xlabel('cachehit rate')
-        plt.title('Cache Hit Distribution for the last ' + str(self.time_limit) + " days")
-        plt.tight_layout()
-        fig.savefig(hf.downloadService.getArchivePath(
-            self.run, self.instance_name + "_filesize.png"), dpi=91)
+        H, xedges, yedges = np.histogram2d(hit_list, local_list, bins=bins, weights=weights)
+        # the histogram only changes when new jobs arrive
+        path = hf.downloadService.getArchivePath(self.run, self.instance_name + "_filesize.png")
+        cache = PlotService.instance().cache_for_run(self.run)
+        digest = plot_digest('CacheHitMiss', H, xedges, yedges, self.plotsize_x, self.plotsize_y, self.time_limit)
+        if not cache.fetch(digest, path):
+            start = time.time()
+            import matplotlib.pyplot as plt
+            fig = plt.figure(figsize=(self.plotsize_x, self.plotsize_y))
+            H = np.rot90(H)
+            H = np.flipud(H)
+            plt.pcolor(xedges, yedges, H, cmap='Blues')
+            cbar = plt.colorbar()
+            cbar.ax.set_ylabel('Jobs')
+            plt.ylabel('locality rate')
+            plt.xlabel('cachehit rate')
+            plt.title('Cache Hit Distribution for the last ' + str(self.time_limit) + " days")
+            plt.tight_layout()
+            fig.savefig(path, dpi=91)
+            plt.close(fig)
+            cache.store(digest, path, time.time() - start)
         data["filename_plot"] = self.instance_name + "_filesize.png"
         return data
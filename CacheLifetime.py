@@ -16,20 +16,21 @@
 
 import hf
 from sqlalchemy import TEXT, Column
-import json
 import time
 
-import datetime
 import logging
-import socket
-import urllib2
+from bucket_store import BucketStore
+from coordinator_stats import fetch_new_records
+from plot_service import PlotService
 
 class CacheLifetime(hf.module.ModuleBase):
     config_keys = {'source_url': ('Source Url', 'http://ekpsg03.ekp.kit.edu:8082/coordinator/stats/'),
                    'plotsize_x': ('size of the plot in x', '10'),
                    'plotsize_y': ('size of plot in y', '5'),
                    'time_limit': ('in days max 30 days', '7'),
-                   'nbins': ('number of bins in histograms', '200')
+                   'nbins': ('number of bins in histograms', '200'),
+                   'incremental_store': ('File keeping the lifetimes of the last time_limit days between runs, so only new records are read. Leave empty to read all records of the time limit every run', ''),
+                   'since_parameter': ('Query parameter of the coordinator selecting records from a minimum time on, leave empty if not supported', '')
                    }
     table_columns = [
         Column('filename_plot', TEXT),
@@ -37,56 +38,44 @@ class CacheLifetime(hf.module.ModuleBase):
     ], ['filename_plot']
 
     def prepareAcquisition(self):
+        PlotService.instance()
 	# Setting defaults
 	self.source_url = self.config["source_url"]
         self.plotsize_x = float(self.config['plotsize_x'])
         self.plotsize_y = float(self.config['plotsize_y'])
         self.nbins = float(self.config['nbins'])
-        self.time_limit = int(self.config['time_limit'])
+        self.time_limit = min(int(self.config['time_limit']), 30)
 
 	self.logger = logging.getLogger(__name__)
         self.inp_data = {}
         self.inp_data['error'] = ""
-        self.date = time.time()-(2592000)  # tlimit = 2592000
-        life_time = {'time': 0,
-		     'life_time':0
-		    }
-        # function to load the filelists from ekpsg-machines
+        # Hourly buckets of the removed files of the last time_limit days,
+        # the lifetimes are kept as histogram in full hours
+        self.store = BucketStore(self.config['incremental_store'], self.time_limit*24*60*60)
+        fields = ['life_time', 'time']
         url = "http://ekpsg03.ekp.kit.edu:8082/coordinator/stats/"
-        # read data from every file in filelists
+        # read only the records that were added since the last run
         self.logger.info("Script to acquire job and life_time information from coordinator.")
-        urltotal = url + "life_time" + "?fields=" + \
-            "&fields=".join(life_time.keys())  # build url for request
-        self.logger.info("url: " + urltotal)
-        req = urllib2.Request(urltotal)
+        now = time.time()
+        self.store.expire(now)
         try:
-            response = urllib2.urlopen(req, timeout=30)
-            # handle url error and timeout errors
-        except urllib2.URLError as e:
-            self.logger.error(e.reason)
+            records = fetch_new_records(self.store, url, "life_time", fields, "time",
+                                        self.config['since_parameter'], 30, now)
+        except IOError, e:
+            self.logger.error(str(e))
             self.inp_data['error'] += " Connection problems"
-        except socket.timeout, e:
-            self.logger.error("There was an error while reading " + url + ": %r" % e)
-            self.inp_data['error'] += " Connection problems"
-        except socket.timeout:
-            self.logger.error("socket timeout")
-            self.inp_data['error'] += " Connection problems"
-        html = response.read()
-        services = json.loads(html)
-	self.inp_data['life_time'] = [] 
-	for service in services:
-	    if service[1] > int(self.date):
-		self.inp_data[parameter].append(
-					{
-		    			 'time': service[1],
-		    			 'life_time': service[0]
-					}
-				       )
+            return
+        for record in records:
+            hours = str(int(record[0])/(60*60))
+            lifetimes = self.store.bucket(record[1]).setdefault("lifetimes", {})
+            lifetimes[hours] = lifetimes.get(hours, 0) + 1
+        try:
+            self.store.save()
+        except (IOError, OSError), e:
+            self.logger.error("Failed to save the incremental store %s: %s" % (self.config['incremental_store'], e))
 
 
     def extractData(self):
-        import matplotlib.pyplot as plt
-        from matplotlib.font_manager import FontProperties
         data = {}
         data['filename_plot'] = ""
         data['error_msg'] = ""
@@ -94,29 +83,25 @@ class CacheLifetime(hf.module.ModuleBase):
             data['status'] = 0
             data['error_msg'] = "Connection to Coordinator failed"
             return data
-        time_list = list(int(entry['time']) for entry in self.inp_data['life_time'])
-        lifetime_list = list(int(entry['life_time']) for entry in self.inp_data['life_time'])
-        lifetime_list = map(lambda x: x/(60*60), lifetime_list)
-        # TODO if data gets newer, constrain dataset von data from last 7 days etc.
-        plot_lifetime_list = []
-        for time in time_list:
-            if time > time.time() - (self.time_limit*60*60*24):
-                plot_lifetime_list.append(time)
-        if len(plot_lifetime_list) == 0:
+        # merge the lifetime histograms of all buckets
+        lifetimes = {}
+        for start, bucket in self.store.buckets():
+            for hours, count in bucket.get("lifetimes", {}).iteritems():
+                lifetimes[int(hours)] = lifetimes.get(int(hours), 0) + count
+        if len(lifetimes) == 0:
             data['status'] = 0.5
             data['error_msg'] = "No files removed in the last " + str(self.time_limit) + " days."
             return data
-        fig = plt.figure(figsize=(self.plotsize_x, self.plotsize_y))
-        axis = fig.add_subplot(111)
-        nbins = self.nbins
-        fontLeg = FontProperties()
-        fontLeg.set_size('small')
-        axis.hist(plot_lifetime_list, nbins, histtype='bar', log=True)
-        axis.set_xlabel('Lifetime in hours')
-        axis.set_ylabel('Number of Files')
-        axis.set_title('Lifetime of Files in Cache')
-        plt.tight_layout()
-        fig.savefig(hf.downloadService.getArchivePath(
-            self.run, self.instance_name + ".png"), dpi=91)
-        data["filename_plot"] = self.instance_name + ".png"
+        plot_lifetime_list = sorted(lifetimes)
+        PlotService.instance().submit({
+            'figsize': (self.plotsize_x, self.plotsize_y),
+            'axes': [{
+                'layers': [{'kind': 'hist', 'values': plot_lifetime_list, 'bins': int(self.nbins), 'log': True,
+                            'weights': [lifetimes[hours] for hours in plot_lifetime_list]}],
+                'xlabel': 'Lifetime in hours',
+                'ylabel': 'Number of Files',
+                'title': 'Lifetime of Files in Cache',
+            }],
+        }, hf.downloadService.getArchivePath(self.run, self.instance_name + ".png"),
+            self, "filename_plot")
         return data
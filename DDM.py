@@ -15,8 +15,10 @@
 
 import hf
 from sqlalchemy import TEXT, INT, FLOAT, Column
-from urllib2 import Request, urlopen, URLError
 import json
+import re
+from concurrent_fetch import FetchPool
+from json_stream import iter_object_items
 
 class DDM(hf.module.ModuleBase):
     config_keys = {
@@ -47,6 +49,10 @@ class DDM(hf.module.ModuleBase):
         'source_warning_threshold': ('Below this efficiency for destination transfers, the status of the module will be critical.', '0.8'),
         'destination_critical_threshold': ('Below this efficiency for source transfers, the status of the module will be warning (ok, if above).', '0.5'),
         'source_critical_threshold': ('Below this efficiency for source transfers, the status of the module will be critical.', '0.5'),
+        'fetch_workers': ('number of parallel requests for failed transfers', '8'),
+        'fetch_timeout': ('timeout in seconds for a single request', '30'),
+        'fetch_deadline': ('seconds after which no more failed transfers are requested', '120'),
+        'failed_transfers_max_pages': ('maximum number of pages (of limit entries) fetched per failed transfers query', '20'),
     }
 
     config_hint = 'Adjust the parameters site_name, cloud, and time_interval to your needs, as well as the thresholds for different statuses.'
@@ -123,13 +129,19 @@ class DDM(hf.module.ModuleBase):
         content_source_space_tokens = open(self.source_source_space_tokens.getTmpPath()).read()
 
         # parse the source; due to the fact that some download links are created from other downloaded files, some downloads still have to take place here
-        ddm_info = ddm_parser(
-            self.cloud,
-            self.site_name,
-            content_destination_space_tokens,
-            content_source_space_tokens,
-            self.url_destination_failed_transfers,
-            self.url_source_failed_transfers)
+        fetch_pool = FetchPool(workers=self.config['fetch_workers'],
+                               timeout=self.config['fetch_timeout'],
+                               deadline=self.config['fetch_deadline'])
+        with fetch_pool:
+            ddm_info = ddm_parser(
+                self.cloud,
+                self.site_name,
+                content_destination_space_tokens,
+                content_source_space_tokens,
+                self.url_destination_failed_transfers,
+                self.url_source_failed_transfers,
+                fetch_pool,
+                int(self.config['failed_transfers_max_pages']))
 
         data['destination_successful_transfers_total'] = ddm_info.destination_successful_transfers_total
         data['source_successful_transfers_total'] = ddm_info.source_successful_transfers_total
@@ -222,14 +234,53 @@ class DDM(hf.module.ModuleBase):
         return data
 
 
+def failed_transfers_page(link, offset):
+    """Link to the failed transfers starting at entry offset."""
+    return re.sub(r'(?<=[?&])offset=\d+', 'offset=%d' % offset, link)
+
+
+def failed_transfers_limit(link):
+    """Number of entries per page of a failed transfers link, None if it is not paged."""
+    match = re.search(r'(?<=[?&])limit=(\d+)', link)
+    if match is None or re.search(r'(?<=[?&])offset=\d+', link) is None:
+        return None
+    return int(match.group(1))
+
+
+def classify_failures(response):
+    """
+    Count the failed transfers of a details.json response by the side that
+    caused them. The response is read member by member, so only the details
+    of the page (at most limit rows) are decoded, never the whole text.
+    """
+    counts = {'DESTINATION': 0, 'SOURCE': 0, 'rows': 0}
+    details = None
+    for key, value in iter_object_items(response):
+        if key != 'details':
+            continue
+        details = value
+        for transfer_detail in details:
+            counts['rows'] += 1
+            transfer_error = unicode(transfer_detail['transfer_error'])
+            if "DESTINATION" in transfer_error:
+                counts['DESTINATION'] += 1
+            if "SOURCE" in transfer_error:
+                counts['SOURCE'] += 1
+    if details is None:
+        raise KeyError('details')
+    return counts
+
+
 class ddm_parser(object):
-    def __init__(self, cloud, site_name, content_destination, content_source, link_destination_failed_transfers, link_source_failed_transfers):
+    def __init__(self, cloud, site_name, content_destination, content_source, link_destination_failed_transfers, link_source_failed_transfers, fetch_pool, max_pages=20):
         self.cloud = cloud
         self.site_name = site_name
         self.content_destination = content_destination
         self.content_source = content_source
         self.link_destination_failed_transfers = link_destination_failed_transfers
         self.link_source_failed_transfers = link_source_failed_transfers
+        self.fetch_pool = fetch_pool
+        self.max_pages = max_pages
         self.destination_space_tokens = {}
         self.source_space_tokens = {}
         self.destination_successful_transfers_total = 0
@@ -240,8 +291,9 @@ class ddm_parser(object):
         self.source_failed_transfers_total = 0
         self.destination_failures_total = 0
         self.source_failures_total = 0
-        self.parse_destination()
-        self.parse_source()
+        destination_links = self.parse_destination()
+        source_links = self.parse_source()
+        self.count_failures(destination_links, source_links)
 
     def __get_times(self,json_content):
         from_time = "n/a"
@@ -260,196 +312,139 @@ class ddm_parser(object):
         to_time_dict['ss'] = to_time.split("T")[1].split(":")[2]
         return from_time_dict, to_time_dict
 
+    def __failure_link(self, link, from_time, to_time):
+        return link%(
+            self.cloud,
+            self.site_name,
+            from_time['date'],
+            from_time['hh'],
+            from_time['mm'],
+            from_time['ss'],
+            to_time['date'],
+            to_time['hh'],
+            to_time['mm'],
+            to_time['ss'])
+
+    def __efficiencies(self, space_tokens):
+        for token in space_tokens:
+            if (space_tokens[token])['successful'] + (space_tokens[token])['failed'] != 0:
+                (space_tokens[token])['efficiency'] = (space_tokens[token])['successful'] \
+                    / ((space_tokens[token])['successful'] + (space_tokens[token])['failed'])
+            else:
+                (space_tokens[token])['efficiency'] = 0
+
     def parse_destination(self):
+        """Parse the destination space tokens, returns the failed transfers links (token -> link, None for the site)."""
+        # matrix.json is aggregated per cloud, site and space token, so it
+        # has a row per token and not per transfer, and it is already read
+        # into memory by extractData; decoding it in one go is fine here
         content = self.content_destination
         json_content = json.loads(content)
         from_time, to_time = self.__get_times(json_content)
         if from_time == "n/a" or to_time == "n/a":
             print "No times defined, please check the __get_times() method"
-            return "n/a"
-        else:
-            for transfer in json_content['transfers']['rows']:
-                self.destination_successful_transfers_total += float(transfer[5])
-                self.destination_failed_transfers_total += float(transfer[6])
-                self.destination_throughput_total += float(transfer[4])
-                if transfer[2] == self.site_name and transfer[3] in self.destination_space_tokens:
-                    self.destination_space_tokens[transfer[3]] = {
-                        'successful': (self.destination_space_tokens[transfer[3]])['successful'] + float(transfer[5]),
-                        'failed': (self.destination_space_tokens[transfer[3]])['failed'] + float(transfer[6]),
-                        'failed_reason_destination': 0,
-                        'throughput': (self.destination_space_tokens[transfer[3]])['throughput'] + float(transfer[4])}
-                if  transfer[2] == self.site_name and transfer[3] not in self.destination_space_tokens:
-                    self.destination_space_tokens[transfer[3]] = {
-                        'successful': float(transfer[5]),
-                        'failed': float(transfer[6]),
-                        'failed_reason_destination': 0,
-                        'throughput': float(transfer[4])}
-                
-            destination_failure_info_link = self.link_destination_failed_transfers%(
-                self.cloud,
-                self.site_name,
-                from_time['date'],
-                from_time['hh'],
-                from_time['mm'],
-                from_time['ss'],
-                to_time['date'],
-                to_time['hh'],
-                to_time['mm'],
-                to_time['ss'])
-            req = Request(destination_failure_info_link)
-            try:
-                urlopen(req)
-            except URLError as e:
-                if hasattr(e,'reason'):
-                    print "Impossible to reach the server"
-                    print "Reason: ", e.reason
-                    return "n/a"
-                elif hasattr(e, 'code'):
-                    print "The server couldn't fulfill the request."
-                    print "Error Code: ", e.code
-                    return "n/a"
-            else:
-                destination_source = urlopen(destination_failure_info_link)
-                destination_failures_json_content = json.load(destination_source)
-                for transfer_detail in destination_failures_json_content['details']:
-                    if "DESTINATION" in str(transfer_detail['transfer_error']):
-                        self.destination_failures_total += 1
-                    else:
-                        continue
-
-            for token in self.destination_space_tokens:
-                if (self.destination_space_tokens[token])['successful'] + (self.destination_space_tokens[token])['failed'] != 0:
-                    (self.destination_space_tokens[token])['efficiency'] = (self.destination_space_tokens[token])['successful'] \
-                        / ((self.destination_space_tokens[token])['successful'] + (self.destination_space_tokens[token])['failed'])
-                else:
-                    (self.destination_space_tokens[token])['efficiency'] = 0
-                destination_failure_info_link_token = self.link_destination_failed_transfers%(
-                    self.cloud,
-                    self.site_name,
-                    from_time['date'],
-                    from_time['hh'],
-                    from_time['mm'],
-                    from_time['ss'],
-                    to_time['date'],
-                    to_time['hh'],
-                    to_time['mm'],
-                    to_time['ss'])
-                destination_failure_info_link_token += '&dst_token="'  + token + '"'
-                req = Request(destination_failure_info_link)
-                try:
-                    urlopen(req)
-                except URLError as e:
-                    if hasattr(e,'reason'):
-                        print "Impossible to reach the server"
-                        print "Reason: ", e.reason
-                        return "n/a"
-                    elif hasattr(e, 'code'):
-                        print "The server couldn't fulfill the request."
-                        print "Error Code: ", e.code
-                        return "n/a"
-                else:
-                    destination_source_token = urlopen(destination_failure_info_link_token)
-                    destination_failure_json_content_token = json.load(destination_source_token)
-                    for transfer_detail in destination_failure_json_content_token['details']:
-                        if "DESTINATION" in str(transfer_detail['transfer_error']):
-                            self.destination_space_tokens[token]['failed_reason_destination'] += 1
-                        else:
-                            continue
-
+            return {}
+        for transfer in json_content['transfers']['rows']:
+            self.destination_successful_transfers_total += float(transfer[5])
+            self.destination_failed_transfers_total += float(transfer[6])
+            self.destination_throughput_total += float(transfer[4])
+            if transfer[2] == self.site_name and transfer[3] in self.destination_space_tokens:
+                self.destination_space_tokens[transfer[3]] = {
+                    'successful': (self.destination_space_tokens[transfer[3]])['successful'] + float(transfer[5]),
+                    'failed': (self.destination_space_tokens[transfer[3]])['failed'] + float(transfer[6]),
+                    'failed_reason_destination': 0,
+                    'throughput': (self.destination_space_tokens[transfer[3]])['throughput'] + float(transfer[4])}
+            if  transfer[2] == self.site_name and transfer[3] not in self.destination_space_tokens:
+                self.destination_space_tokens[transfer[3]] = {
+                    'successful': float(transfer[5]),
+                    'failed': float(transfer[6]),
+                    'failed_reason_destination': 0,
+                    'throughput': float(transfer[4])}
+        self.__efficiencies(self.destination_space_tokens)
 
+        destination_failure_info_link = self.__failure_link(self.link_destination_failed_transfers, from_time, to_time)
+        links = {None: destination_failure_info_link}
+        for token in self.destination_space_tokens:
+            links[token] = destination_failure_info_link + '&dst_token="'  + token + '"'
+        return links
 
     def parse_source(self):
+        """Parse the source space tokens, returns the failed transfers links (token -> link, None for the site)."""
+        # aggregated per space token like the destination matrix
         content = self.content_source
         json_content = json.loads(content)
         from_time, to_time = self.__get_times(json_content)
         if from_time == "n/a" or to_time == "n/a":
             print "No times defined, please check the __get_times() method"
-            return "n/a"
-        else:
-            for transfer in json_content['transfers']['rows']:
-                self.source_successful_transfers_total += float(transfer[5])
-                self.source_failed_transfers_total += float(transfer[6])
-                self.source_throughput_total += float(transfer[4])
-                if transfer[1] == self.site_name and transfer[2] in self.source_space_tokens:
-                    self.source_space_tokens[transfer[2]] = {
-                        'successful': (self.source_space_tokens[transfer[2]])['successful'] + float(transfer[5]),
-                        'failed': (self.source_space_tokens[transfer[2]])['failed'] + float(transfer[6]), 
-                        'failed_reason_source': 0,
-                        'throughput': (self.source_space_tokens[transfer[2]])['throughput'] + float(transfer[4])}
-                if  transfer[1] == self.site_name and transfer[2] not in self.source_space_tokens:
-                    self.source_space_tokens[transfer[2]] = {
-                        'successful': float(transfer[5]),
-                        'failed': float(transfer[6]),
-                        'failed_reason_source': 0,
-                        'throughput': float(transfer[4])}
-
-            source_failure_info_link = self.link_source_failed_transfers%(
-                self.cloud,
-                self.site_name,
-                from_time['date'],
-                from_time['hh'],
-                from_time['mm'],
-                from_time['ss'],
-                to_time['date'],
-                to_time['hh'],
-                to_time['mm'],
-                to_time['ss'])
-            req = Request(source_failure_info_link)
-            try:
-                urlopen(req)
-            except URLError as e:
-                if hasattr(e,'reason'):
-                    print "Impossible to reach the server"
-                    print "Reason: ", e.reason
-                    return "n/a"
-                elif hasattr(e, 'code'):
-                    print "The server couldn't fulfill the request."
-                    print "Error Code: ", e.code
-                    return "n/a"
+            return {}
+        for transfer in json_content['transfers']['rows']:
+            self.source_successful_transfers_total += float(transfer[5])
+            self.source_failed_transfers_total += float(transfer[6])
+            self.source_throughput_total += float(transfer[4])
+            if transfer[1] == self.site_name and transfer[2] in self.source_space_tokens:
+                self.source_space_tokens[transfer[2]] = {
+                    'successful': (self.source_space_tokens[transfer[2]])['successful'] + float(transfer[5]),
+                    'failed': (self.source_space_tokens[transfer[2]])['failed'] + float(transfer[6]), 
+                    'failed_reason_source': 0,
+                    'throughput': (self.source_space_tokens[transfer[2]])['throughput'] + float(transfer[4])}
+            if  transfer[1] == self.site_name and transfer[2] not in self.source_space_tokens:
+                self.source_space_tokens[transfer[2]] = {
+                    'successful': float(transfer[5]),
+                    'failed': float(transfer[6]),
+                    'failed_reason_source': 0,
+                    'throughput': float(transfer[4])}
+        self.__efficiencies(self.source_space_tokens)
+
+        source_failure_info_link = self.__failure_link(self.link_source_failed_transfers, from_time, to_time)
+        links = {None: source_failure_info_link}
+        for token in self.source_space_tokens:
+            links[token] = source_failure_info_link + '&src_token="'  + token + '"'
+        return links
+
+    def fetch_failures(self, links):
+        """
+        Fetch all failed transfers links concurrently, page by page, and
+        return link -> counts of failures caused by DESTINATION and SOURCE.
+        Links that could not be fetched completely are left out.
+        """
+        counts = dict((link, {'DESTINATION': 0, 'SOURCE': 0}) for link in links)
+        pending = dict((link, 0) for link in counts)
+        for page in xrange(self.max_pages):
+            if not pending:
+                break
+            page_links = dict((failed_transfers_page(link, offset), link) for link, offset in pending.iteritems())
+            results = self.fetch_pool.fetch(page_links.keys(), classify_failures)
+            next_pending = {}
+            for url, result in results.iteritems():
+                link = page_links[url]
+                if not result.ok:
+                    print "Impossible to get the failed transfers from", url
+                    print "Reason: ", result.error
+                    del counts[link]
+                    continue
+                counts[link]['DESTINATION'] += result.data['DESTINATION']
+                counts[link]['SOURCE'] += result.data['SOURCE']
+                limit = failed_transfers_limit(link)
+                if limit and result.data['rows'] >= limit:
+                    next_pending[link] = pending[link] + limit
+            pending = next_pending
+        if pending:
+            print "Failed transfers truncated after %d pages for %d queries" % (self.max_pages, len(pending))
+        return counts
+
+    def count_failures(self, destination_links, source_links):
+        counts = self.fetch_failures(destination_links.values() + source_links.values())
+        for token, link in destination_links.iteritems():
+            if link not in counts:
+                continue
+            if token is None:
+                self.destination_failures_total = counts[link]['DESTINATION']
+            else:
+                self.destination_space_tokens[token]['failed_reason_destination'] = counts[link]['DESTINATION']
+        for token, link in source_links.iteritems():
+            if link not in counts:
+                continue
+            if token is None:
+                self.source_failures_total = counts[link]['SOURCE']
             else:
-                source_source = urlopen(source_failure_info_link)
-                source_failures_json_content = json.load(source_source)
-                for transfer_detail in source_failures_json_content['details']:
-                    if "SOURCE" in str(transfer_detail['transfer_error']):
-                        self.source_failures_total += 1
-                    else:
-                        continue
-
-            for token in self.source_space_tokens:
-                if (self.source_space_tokens[token])['successful'] + (self.source_space_tokens[token])['failed'] != 0:
-                    (self.source_space_tokens[token])['efficiency'] = (self.source_space_tokens[token])['successful'] \
-                        / ((self.source_space_tokens[token])['successful'] + (self.source_space_tokens[token])['failed'])
-                else:
-                    (self.source_space_tokens[token])['efficiency'] = 0
-                source_failure_info_link_token = self.link_source_failed_transfers%(
-                    self.cloud,
-                    self.site_name,
-                    from_time['date'],
-                    from_time['hh'],
-                    from_time['mm'],
-                    from_time['ss'],
-                    to_time['date'],
-                    to_time['hh'],
-                    to_time['mm'],
-                    to_time['ss'])
-                source_failure_info_link_token += '&src_token="'  + token + '"'
-                req = Request(source_failure_info_link)
-                try:
-                    urlopen(req)
-                except URLError as e:
-                    if hasattr(e,'reason'):
-                        print "Impossible to reach the server"
-                        print "Reason: ", e.reason
-                        return "n/a"
-                    elif hasattr(e, 'code'):
-                        print "The server couldn't fulfill the request."
-                        print "Error Code: ", e.code
-                        return "n/a"
-                else:
-                    source_source_token = urlopen(source_failure_info_link_token)
-                    source_failure_json_content_token = json.load(source_source_token)
-                    for transfer_detail in source_failure_json_content_token['details']:
-                        if "SOURCE" in str(transfer_detail['transfer_error']):
-                            self.source_space_tokens[token]['failed_reason_source'] += 1
-                        else:
-                            continue
+                self.source_space_tokens[token]['failed_reason_source'] = counts[link]['SOURCE']
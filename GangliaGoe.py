@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 import hf
 from sqlalchemy import TEXT, Column
-from lxml import etree
+from ganglia_xml import parse_ganglia
 
 class GangliaGoe(hf.module.ModuleBase):
     config_keys = {
         'source_url': ('Link to the Ganglia XML file', ''),
         'hosts': ('Comma-separated list of hosts to monitor', ''),
         'cluster': ('Name of the cluster to monitor', 'GoeGrid_Server'),
+        'metrics': ('Comma-separated list of metrics to show, empty for all', ''),
     }
 
     config_hint = ''
@@ -31,6 +32,9 @@ class GangliaGoe(hf.module.ModuleBase):
         self.hostlist = self.config['hosts'].split(',')
         for index, host in enumerate(self.hostlist):
             self.hostlist[index] = host.strip()
+        self.metrics = None
+        if self.config['metrics'].strip() != '':
+            self.metrics = [metric.strip() for metric in self.config['metrics'].split(',')]
         self.source = hf.downloadService.addDownload(self.config['source_url'])
 
     def extractData(self):
@@ -39,27 +43,15 @@ class GangliaGoe(hf.module.ModuleBase):
                 'status': 0,
                }
         
-        xmlroot = etree.fromstring(open(self.source.getTmpPath()).read())
+        with open(self.source.getTmpPath()) as f:
+            dump = parse_ganglia(f, self.hostlist, [self.config['cluster']], self.metrics)
 
-        cluster_found = False
-        for cluster in xmlroot.findall('CLUSTER'):
-            if cluster.get('NAME') != self.config['cluster']:
-                continue
-            else:
-                cluster_found = True
-                for host in cluster.findall('HOST'):
-                    if host.get('NAME') in self.hostlist:
-                        for metric in host.findall('METRIC'):
-                            info = ''
-                            for extradata in metric.findall('EXTRA_DATA'):
-                                for extraelement in extradata.findall('EXTRA_ELEMENT'):
-                                    if extraelement.get('NAME') == 'TITLE':
-                                        info = extraelement.get('VAL')
-                            self.details_db_value_list.append({'host': host.get('NAME'), \
-                                'variable': metric.get('NAME'), 'value': metric.get('VAL'), \
-                                 'unit': metric.get('UNITS'), 'info': info})
+        for metric in dump.metrics:
+            self.details_db_value_list.append({'host': metric['host'], \
+                'variable': metric['name'], 'value': metric['value'], \
+                 'unit': metric['units'], 'info': metric['title']})
 
-        if cluster_found == False:
+        if not dump.clusters:
             data['status'] = -1
 
         #print self.details_db_value_list
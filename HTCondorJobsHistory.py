@@ -22,12 +22,16 @@ import copy
 import time
 import numpy as np
 from datetime import timedelta, datetime
+from bucket_store import BucketStore
+from htcondor_acquisition import CondorAcquisition
 class HTCondorJobsHistory(hf.module.ModuleBase):
 
 	config_keys = {
 		'source_url' : ('Not used, but filled to avoid errors','http://google.com'),
 		'plotsize_x' : ('Size of the plot in x', '8.9'),
 		'plotsize_y' : ('Size of the plot in y', '5.8'),
+		'incremental_store' : ('File keeping the rolling 7 day aggregates between runs, so only new history is queried. Leave empty to query the whole week every run', ''),
+		'schedd_timeout' : ('Seconds after which schedds that did not answer are skipped', '120'),
 	}
 
 	table_columns = [Column('filename_plot', TEXT)], ['filename_plot']
@@ -69,7 +73,6 @@ class HTCondorJobsHistory(hf.module.ModuleBase):
 		}
 
 		self.quantities_list = [quantity for quantity in self.condor_projection if quantity != "GlobalJobId"]
-		self.condor_jobs_information = {}
 		self.jobs_history_statistics = {
 			"removed" : [],
 			"completed" : []
@@ -77,10 +80,16 @@ class HTCondorJobsHistory(hf.module.ModuleBase):
 		self.sites_statistics = {}
 		self.walltime_runtime_statistics = {}
 
-		# Prepare htcondor queries
-		self.collector = htcondor.Collector()
-		self.schedd_names = [classAd.get("Name") for classAd in self.collector.query(htcondor.AdTypes.Schedd)]
-		self.histories = []
+		# Rolling 7 day aggregates in hourly buckets, only kept in memory if
+		# no incremental store is configured
+		self.history_window = 604800
+		self.store = BucketStore(self.config["incremental_store"], self.history_window)
+
+		# Prepare htcondor queries, collector and schedds are shared with the
+		# other HTCondor modules of this run
+		self.acquisition = CondorAcquisition.for_run(self.run)
+		self.schedd_timeout = float(self.config["schedd_timeout"])
+		self.history_limit = 60000
 		# timeold = 86400
 
 	def extractData(self):
@@ -89,44 +98,123 @@ class HTCondorJobsHistory(hf.module.ModuleBase):
 			'filename_plot' : ''
 		}
 		
-		requirement = "RoutedToJobId =?= undefined && JobStartDate > 0 && (EnteredCurrentStatus >= {NOW} - 604800)".format(NOW = int(time.time()))
-		# Extract job information using htcondor python bindings
-		for classAd in self.collector.query(htcondor.AdTypes.Schedd):
-			ad_index = 0
-			job_id = "undefined"
-			try:
-				for ads in htcondor.Schedd(classAd).history(requirement, self.condor_projection, 60000):
-					job_id = ads.get("GlobalJobId")
-					self.condor_jobs_information[job_id] = {quantity : ads.get(quantity) for quantity in self.quantities_list}
-					ad_index += 1
-			except RuntimeError:
-				print "Failed to get ad for scheduler", "after Job ID", job_id,"number",ad_index," --> Aborting"
-
-		# Fill the main table and the user statistics information
-		for job in self.condor_jobs_information.itervalues():
-			# Determine user and set up user dependent statistics
-			user = job["User"]
-					# Summarize the status information
-			status = self.jobs_status_dict.get(job["JobStatus"])
-			if status == "completed":
-				# Determine the site where the job was completed
-				if job["MachineAttrCloudSite0"]:
-					self.sites_statistics.setdefault(job["MachineAttrCloudSite0"].lower(),0)
-					self.sites_statistics[job["MachineAttrCloudSite0"].lower()] += 1
-				# Determine the runtime and requested walltime of the completed job
-				if user not in self.walltime_runtime_statistics:
-					self.walltime_runtime_statistics[user] = {}
-				if job["CommittedTime"] - job["CommittedSuspensionTime"] >= 0 and job["ExitCode"] == 0 and job["RequestWalltime"]:
-					self.walltime_runtime_statistics[user].setdefault(job["RequestWalltime"], []).\
-						append(job["CommittedTime"] - job["CommittedSuspensionTime"])
-			if job["EnteredCurrentStatus"]:
-				self.jobs_history_statistics[status].append(job["EnteredCurrentStatus"])
+		now = int(time.time())
+		self.store.expire(now)
+		window_start = self.store.window_start(now)
+		# Extract job information using htcondor python bindings, per schedd
+		# only the history since the last seen EnteredCurrentStatus is queried
+		watermarks = {}
+		seen_ids = {}
+		new_jobs = {}
+		for classAd in self.acquisition.schedd_ads():
+			schedd_name = classAd.get("Name")
+			watermark = self.store.watermark(schedd_name, {"time" : window_start, "ids" : []})
+			if watermark["time"] < window_start:
+				watermark = {"time" : window_start, "ids" : []}
+			watermarks[schedd_name] = watermark
+			seen_ids[schedd_name] = set(watermark["ids"])
+			new_jobs[schedd_name] = []
+		# condor_history returns the newest jobs first and stops at the
+		# limit, so a time range of a schedd that yields limit jobs is split
+		# in halves and queried again until every range is complete. Ranges
+		# include their begin and exclude their end, None is open ended.
+		requirement = "RoutedToJobId =?= undefined && JobStartDate > 0 && (EnteredCurrentStatus >= {BEGIN})"
+		pending = dict((schedd_name, [(watermark["time"], None)]) for schedd_name, watermark in watermarks.iteritems())
+		errors = {}
+		while pending:
+			ranges = dict((schedd_name, windows.pop()) for schedd_name, windows in pending.iteritems())
+			def constraint(schedd_name):
+				begin, end = ranges[schedd_name]
+				if end is None:
+					return requirement.format(BEGIN = begin)
+				return requirement.format(BEGIN = begin) + " && (EnteredCurrentStatus < %d)" % end
+			history = self.acquisition.query_schedds("history", constraint, self.condor_projection,
+				self.history_limit, self.schedd_timeout, schedd_names = ranges.keys())
+			pages = dict((schedd_name, []) for schedd_name in ranges)
+			for schedd_name, ads in history:
+				job_id = ads.get("GlobalJobId")
+				pages[schedd_name].append((job_id, {quantity : ads.get(quantity) for quantity in self.quantities_list}))
+			for schedd_name, (begin, end) in ranges.iteritems():
+				page = pages[schedd_name]
+				if schedd_name in history.errors:
+					errors[schedd_name] = history.errors[schedd_name]
+					pending[schedd_name] = []
+				elif len(page) >= self.history_limit and (end is None or end - begin > 1):
+					middle = (begin + (end if end is not None else now + 1)) // 2
+					pending[schedd_name].extend([(begin, middle), (middle, end)])
+					continue
+				elif len(page) >= self.history_limit:
+					print "More than", self.history_limit, "jobs of scheduler", schedd_name, "entered their status at", begin, "only the newest are counted"
+				new_jobs[schedd_name].extend(job for job in page if job[0] not in seen_ids[schedd_name])
+			pending = dict((schedd_name, windows) for schedd_name, windows in pending.iteritems() if windows)
+		for schedd_name, jobs in new_jobs.iteritems():
+			# jobs of an incomplete query are fetched again next run
+			if schedd_name in errors:
+				print "Failed to get ads for scheduler", schedd_name, "after", len(jobs), "jobs:", errors[schedd_name]
+				if self.store.persistent:
+					continue
+			# Advance the watermark, jobs entering their status in the same
+			# second as the newest job are remembered to not count them twice
+			watermark = watermarks[schedd_name]
+			for job_id, job in jobs:
+				self.addJob(job)
+				entered = job["EnteredCurrentStatus"] or 0
+				if entered > watermark["time"]:
+					watermark = {"time" : entered, "ids" : []}
+				if entered == watermark["time"]:
+					watermark["ids"].append(job_id)
+			self.store.set_watermark(schedd_name, watermark)
+
+		# Merge the aggregates of all buckets within the window
+		for start, bucket in self.store.buckets():
+			for status, count in bucket.get("terminated", {}).iteritems():
+				self.jobs_history_statistics[status].append((start + self.store.bucket_width / 2, count))
+			for site, count in bucket.get("sites", {}).iteritems():
+				self.sites_statistics[site] = self.sites_statistics.get(site, 0) + count
+			for user, walltimes in bucket.get("runtimes", {}).iteritems():
+				user_statistics = self.walltime_runtime_statistics.setdefault(user, {})
+				for walltime, runtimes in walltimes.iteritems():
+					merged_runtimes = user_statistics.setdefault(float(walltime), {})
+					for minute, count in runtimes.iteritems():
+						merged_runtimes[int(minute)] = merged_runtimes.get(int(minute), 0) + count
+		# Expand the runtime histograms for the percentile computation
+		for user_statistics in self.walltime_runtime_statistics.itervalues():
+			for walltime, runtimes in user_statistics.items():
+				minutes = sorted(runtimes)
+				user_statistics[walltime] = np.repeat(np.array(minutes) * 60, [runtimes[minute] for minute in minutes])
+		try:
+			self.store.save()
+		except (IOError, OSError), e:
+			print "Failed to save the incremental store", self.config["incremental_store"], e
 
 		# Plot creation for user statistics
 		data["filename_plot"] = self.plot()
 
 		return data
 
+	def addJob(self, job):
+		# Add a terminated job to the aggregates of the bucket it terminated in
+		status = self.jobs_status_dict.get(job["JobStatus"])
+		if status not in self.jobs_history_statistics or not job["EnteredCurrentStatus"]:
+			return
+		bucket = self.store.bucket(job["EnteredCurrentStatus"])
+		terminated = bucket.setdefault("terminated", {})
+		terminated[status] = terminated.get(status, 0) + 1
+		if status == "completed":
+			# Determine the site where the job was completed
+			if job["MachineAttrCloudSite0"]:
+				sites = bucket.setdefault("sites", {})
+				site = job["MachineAttrCloudSite0"].lower()
+				sites[site] = sites.get(site, 0) + 1
+			# Determine the runtime and requested walltime of the completed
+			# job, runtimes are kept as histogram with one minute bins
+			user_runtimes = bucket.setdefault("runtimes", {}).setdefault(job["User"], {})
+			runtime = (job["CommittedTime"] or 0) - (job["CommittedSuspensionTime"] or 0)
+			if runtime >= 0 and job["ExitCode"] == 0 and job["RequestWalltime"]:
+				runtimes = user_runtimes.setdefault(str(job["RequestWalltime"]), {})
+				minute = str(int(runtime) // 60)
+				runtimes[minute] = runtimes.get(minute, 0) + 1
+
 	def plot(self):
 		import matplotlib.pyplot as plt
 		import matplotlib.patches as mpatches
@@ -135,10 +223,11 @@ class HTCondorJobsHistory(hf.module.ModuleBase):
 		# Create job history plot
 		fig_jobhistory = plt.figure(figsize=(float(self.config["plotsize_x"]), float(self.config["plotsize_y"])*1.15))
 		axis_jobhistory = fig_jobhistory.add_subplot(111)
-		data = [status_list for status_list in self.jobs_history_statistics.itervalues() if len(status_list) > 0]
 		labels = [status for status in self.jobs_history_statistics if len(self.jobs_history_statistics[status]) > 0]
+		data = [[bucket_time for bucket_time, count in self.jobs_history_statistics[status]] for status in labels]
+		weights = [[count for bucket_time, count in self.jobs_history_statistics[status]] for status in labels]
 		colors = [self.jobs_status_colors[status] for status in labels]
-		axis_jobhistory.hist(data, 30, stacked=True, histtype = 'bar', rwidth=1., fill=True, label=labels, color = colors)
+		axis_jobhistory.hist(data, 30, weights=weights, stacked=True, histtype = 'bar', rwidth=1., fill=True, label=labels, color = colors)
 
 		axis_jobhistory.legend()
 		axis_jobhistory.set_xlabel('date')
@@ -227,7 +316,10 @@ class HTCondorJobsHistory(hf.module.ModuleBase):
 		plotname = hf.downloadService.getArchivePath(self.run, self.instance_name) 
 		plt.tight_layout()
 		fig_jobhistory.savefig(plotname + "_jobs_terminated.png", dpi=91, bbox_inches="tight")
+		plt.close(fig_jobhistory)
 		fig_walltime_runtime.savefig(plotname + "_walltime_runtime.png", dpi=91, bbox_inches="tight")
+		plt.close(fig_walltime_runtime)
 		fig_completedjobs_site.savefig(plotname + "_jobs_site.png", dpi=91, bbox_inches="tight")
+		plt.close(fig_completedjobs_site)
 		
 		return plotname
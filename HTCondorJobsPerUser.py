@@ -18,11 +18,10 @@ import hf
 from sqlalchemy import TEXT, INT, FLOAT, BIGINT, Column
 import htcondor
 import re
-import copy
 import time
 import numpy as np
 from datetime import timedelta
-import types
+from htcondor_acquisition import CondorAcquisition
 class HTCondorJobsPerUser(hf.module.ModuleBase):
 
 	config_keys = {
@@ -34,7 +33,8 @@ class HTCondorJobsPerUser(hf.module.ModuleBase):
 		'efficiency_critical': ('Lower threshold for the averaged efficiencies, below which the status is critical', '0.5'),
 		'n_held_warning' : ('Upper threshold for the number of held jobs, above which which a warning is given', '10'),
 		'n_held_critical' : ('Upper threshold for the number of held jobs, above which which the status is critical', '20'),
-		'ram_requested_memory_ratio' : ('Upper threshold for the ratio between the ram and requested memory, above which a warning is given','1.2')
+		'ram_requested_memory_ratio' : ('Upper threshold for the ratio between the ram and requested memory, above which a warning is given','1.2'),
+		'schedd_timeout' : ('Seconds after which schedds that did not answer are skipped', '60')
 	}
 
 	table_columns = [
@@ -46,6 +46,7 @@ class HTCondorJobsPerUser(hf.module.ModuleBase):
 		Column('efficiency', FLOAT),
 		Column('qtime', TEXT),
 		Column('remote', INT),
+		Column('error_msg', TEXT),
 		Column('filename_plot', TEXT)
 	], ['filename_plot']
 
@@ -105,44 +106,17 @@ class HTCondorJobsPerUser(hf.module.ModuleBase):
 		self.jobs_status_colors = ["#56b4e9", "#009e73", "firebrick", "slateblue", "#d55e00", "slategrey", "#e69f00"]
 
 		self.quantities_list = [quantity for quantity in self.condor_projection if quantity != "GlobalJobId"]
-		self.condor_jobs_information = {}
-		self.user_statistics_dict = {
-			"removed" : 0,
-			"completed" : 0,
-			"transferred" : 0,
-			"suspended" : 0,
-			"held" : 0,
-			"idle": 0,
-			"running" : 0,
-			"cores" : 0,
-                        "efficiencies" : [],
-			"runtimes" : [],
-			"cputimes" : [],
-			"walltimes" : [],
-                        "sites" : [],
-			"ram" : 0,
-			"requested_memory" : 0,
-			"NetworkInputMb" : 0.,
-			"NetworkOutputMb" : 0.,
-			"transfer" : 0
-		}
+		# ClassAd attributes projected into numeric columns
+		self.numeric_quantities = [quantity for quantity in self.quantities_list if quantity not in ("User", "MachineAttrCloudSite0")]
 		self.user_statistics = {}
 
-		# Prepare htcondor queries
-		self.collector = htcondor.Collector()
-		self.schedds = [htcondor.Schedd(classAd) for classAd in self.collector.query(htcondor.AdTypes.Schedd)]
-		self.queries = []
-		for schedd in self.schedds:
-			self.queries.append(schedd.xquery(requirements = "RoutedToJobId =?= undefined && JobUniverse =!= 9", projection = self.condor_projection))
+		# Prepare htcondor queries, collector, schedds and negotiator are
+		# shared with the other HTCondor modules of this run
+		self.acquisition = CondorAcquisition.for_run(self.run)
+		self.schedd_timeout = float(self.config["schedd_timeout"])
 
 		# Prepare retrieval of user priority information from htcondor
-		self.negotiator = None
-		for negotiator_ad in self.collector.query(htcondor.AdTypes.Negotiator):
-			if negotiator_ad.get("Machine") == "ekpcondorcentral.ekp.kit.edu":
-				self.negotiator = htcondor.Negotiator(negotiator_ad)
-				break
-		if not self.negotiator:
-			self.negotiator = htcondor.Negotiator()
+		self.negotiator = self.acquisition.negotiator("ekpcondorcentral.ekp.kit.edu")
 		self.priorities = {}
 
 		# Prepare subtable list for database
@@ -159,6 +133,7 @@ class HTCondorJobsPerUser(hf.module.ModuleBase):
                 	'efficiency': 0,
                 	'qtime': [], # format changed to 'int' in the end
                 	'remote': 0,
+			'error_msg': '',
 			'filename_plot' : ''
 		}
 
@@ -168,96 +143,100 @@ class HTCondorJobsPerUser(hf.module.ModuleBase):
 			last_prio = self.priorities.setdefault(name,500.0)
 			self.priorities[name]= max(ad.get("Priority"),last_prio)
 
-		# Extract job information using htcondor python bindings
-		for query in htcondor.poll(self.queries):
-			for ads in query:
-				job_id = ads.get("GlobalJobId")
-				self.condor_jobs_information[job_id] = {quantity : ads.get(quantity) for quantity in self.quantities_list}
+		# Extract job information using htcondor python bindings, all schedds
+		# are queried at once and the jobs are processed as they arrive
+		jobs = self.acquisition.query_schedds("query", "RoutedToJobId =?= undefined && JobUniverse =!= 9", self.condor_projection, timeout = self.schedd_timeout)
 
-		# Fill the main table and the user statistics information
-		for jobid, job in self.condor_jobs_information.iteritems():
-			# Count remotable jobs
-			if job["RemoteJob"]:
-				data["remote"] += 1
-			# Determine user and set up user dependent statistics
-			user = job["User"]
-			if user not in self.user_statistics:
-				self.user_statistics[user] = copy.deepcopy(self.user_statistics_dict)
-			# Count used RAM in MiB
-			if job["ResidentSetSize"] is None:
-				pass
-			else:
-				self.user_statistics[user]["ram"] += job["ResidentSetSize"]/1024.
-				data["ram"] += job["ResidentSetSize"]/1024.
-			# Count requested RAM in MiB
-			self.user_statistics[user]["requested_memory"] += job["RequestMemory"]
-			data["requested_memory"] += job["RequestMemory"]
-			# Count used cores
-			self.user_statistics[user]["cores"] += job["RequestCpus"]
-			data["cores"] += job["RequestCpus"]
-			
-			# Get information on network traffic.
-			if type(job["NetworkInputMb"]) == types.NoneType:
-				pass
-			else:
-				self.user_statistics[user]["NetworkInputMb"] += job["NetworkInputMb"]
-			if type(job["NetworkOutputMb"]) == types.NoneType:
-				pass
-			else:
-				self.user_statistics[user]["NetworkOutputMb"] += job["NetworkOutputMb"]
-			# Get information on input files.
-			self.user_statistics[user]["transfer"] += job["TransferInputSizeMB"]
-			# Summarize the status information
-			status = self.jobs_status_dict.get(job["JobStatus"])
-			self.user_statistics[user][status] +=1
-			if status in data:
-				data[status] += 1
-			# Calculate the time in the queue for all jobs in seconds
-			if status == "running": 
-				try:
-					data["qtime"].append(max(0, job["JobStartDate"] - job["QDate"]))
-				except Exception:
-					pass
+		# Project the job ads into columns, users are mapped to integer codes
+		# and missing values become NaN
+		user_index = {}
+		users = []
+		user_sites = []
+		columns = dict((quantity, []) for quantity in self.numeric_quantities)
+		user_codes = []
+		for schedd_name, ads in jobs:
+			user = ads.get("User")
+			if user not in user_index:
+				user_index[user] = len(users)
+				users.append(user)
+				user_sites.append([])
+			user_codes.append(user_index[user])
+			for quantity in self.numeric_quantities:
+				value = ads.get(quantity)
+				columns[quantity].append(np.nan if value is None else value)
 			# Determine the sites the user is running his jobs on
-			job["MachineAttrCloudSite0"] = "Undefined" if job["MachineAttrCloudSite0"] is None else job["MachineAttrCloudSite0"]
-			if job["MachineAttrCloudSite0"].lower() not in self.user_statistics[user]["sites"] and status == "running":
-				self.user_statistics[user]["sites"].append(job["MachineAttrCloudSite0"].lower())
-			# Calculate runtimes, cputimes and efficiencies of each job of a user
-			if status == "running":
-				try:	
-					cputime = job["RemoteUserCpu"] + job["RemoteSysCpu"]
-					runtime = job["RequestCpus"] * (job["ServerTime"] - job["JobStartDate"])
-					efficiency = float(cputime)/float(runtime)
-					# Avoiding not up to date values of JobCurrentStartDate, that result in efficiencies bigger than 1
-					if efficiency <= 1.:
-						self.user_statistics[user]["efficiencies"].append(efficiency)
-				except Exception:
-					pass
+			if ads.get("JobStatus") == 2:
+				site = ads.get("MachineAttrCloudSite0")
+				site = "undefined" if site is None else site.lower()
+				if site not in user_sites[user_index[user]]:
+					user_sites[user_index[user]].append(site)
+		user_codes = np.array(user_codes, dtype=int)
+		columns = dict((quantity, np.array(values, dtype=float)) for quantity, values in columns.iteritems())
+		status_codes = np.nan_to_num(columns["JobStatus"]).astype(int)
+		n_users = max(1, len(users))
+
+		def per_user(weights=None, mask=None):
+			# grouped sum over all jobs (or the masked jobs) of each user
+			codes = user_codes if mask is None else user_codes[mask]
+			if weights is not None:
+				weights = np.nan_to_num(weights if mask is None else weights[mask])
+			return np.bincount(codes, weights=weights, minlength=n_users)
+
+		# Count remotable jobs
+		data["remote"] = int(np.count_nonzero(np.nan_to_num(columns["RemoteJob"])))
+		# Count used RAM and requested RAM in MiB and used cores
+		ram = per_user(columns["ResidentSetSize"] / 1024.)
+		requested_memory = per_user(columns["RequestMemory"])
+		cores = per_user(columns["RequestCpus"])
+		data["ram"] = ram.sum()
+		data["requested_memory"] = requested_memory.sum()
+		data["cores"] = int(cores.sum())
+		# Get information on network traffic
+		network_input = per_user(columns["NetworkInputMb"])
+		network_output = per_user(columns["NetworkOutputMb"])
+		# Summarize the status information
+		status_counts = {}
+		for code, status in self.jobs_status_dict.iteritems():
+			status_counts[status] = per_user(mask = status_codes == code)
+			if status in data:
+				data[status] = int(status_counts[status].sum())
+		running = status_codes == 2
+		# Calculate the time in the queue for all running jobs in seconds
+		qtime = columns["JobStartDate"] - columns["QDate"]
+		qtime = np.maximum(0, qtime[running & ~np.isnan(qtime)])
+		# Calculate the efficiencies of the running jobs of each user, avoiding
+		# not up to date values of JobCurrentStartDate, that result in
+		# efficiencies bigger than 1
+		cputime = columns["RemoteUserCpu"] + columns["RemoteSysCpu"]
+		runtime = columns["RequestCpus"] * (columns["ServerTime"] - columns["JobStartDate"])
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			efficiency = cputime / runtime
+			has_efficiency = running & (runtime != 0) & (efficiency <= 1.)
+		efficiency_sum = per_user(efficiency, has_efficiency)
+		efficiency_count = per_user(mask = has_efficiency)
 
-		all_efficiencies = []
-		for user in self.user_statistics:
+		for index, user in enumerate(users):
+			self.user_statistics[user] = dict((status, int(status_counts[status][index])) for status in self.jobs_status_dict.itervalues())
 			user_data = {"batchsystem_user": user}
-			for status in self.jobs_status_dict.itervalues():
-				user_data[status] = self.user_statistics[user][status]
-			user_data["cores"],user_data["ram"] = self.user_statistics[user]["cores"], self.determine_diskspace(self.user_statistics[user]["ram"], given_unit="MiB")
-			user_data["requested_memory"] = max(1,self.determine_diskspace(self.user_statistics[user]["requested_memory"], given_unit = "MiB"))
-			user_data["efficiency"] = round(np.mean(self.user_statistics[user]["efficiencies"]),2) \
-				if len(self.user_statistics[user]["efficiencies"]) > 0 else 1.0
-			all_efficiencies += self.user_statistics[user]["efficiencies"]
-			user_data["sites"] = ",\n".join(self.user_statistics[user]["sites"])
+			user_data.update(self.user_statistics[user])
+			user_data["cores"], user_data["ram"] = int(cores[index]), self.determine_diskspace(ram[index], given_unit="MiB")
+			user_data["requested_memory"] = max(1,self.determine_diskspace(requested_memory[index], given_unit = "MiB"))
+			user_data["efficiency"] = round(efficiency_sum[index] / efficiency_count[index], 2) \
+				if efficiency_count[index] > 0 else 1.0
+			user_data["sites"] = ",\n".join(user_sites[index])
 			user_data["priority"] = round(self.priorities[user],1)
-			user_data["NetworkInputMb"] = round(self.user_statistics[user]["NetworkInputMb"],2)
-			user_data["NetworkOutputMb"] = round(self.user_statistics[user]["NetworkOutputMb"],2)
-			user_data["transfer"] = self.user_statistics[user]["NetworkOutputMb"]
+			user_data["NetworkInputMb"] = round(network_input[index],2)
+			user_data["NetworkOutputMb"] = round(network_output[index],2)
+			user_data["transfer"] = network_output[index]
 			self.statistics_db_value_list.append(user_data)
 
-		data["efficiency"] = round(np.mean(all_efficiencies),2) if len(all_efficiencies)> 0 else 1.0
+		data["efficiency"] = round(efficiency[has_efficiency].mean(),2) if has_efficiency.any() else 1.0
 		data["ram"] = self.determine_diskspace(data["ram"], given_unit="MiB")
 		data["requested_memory"] = max(1,self.determine_diskspace(data["requested_memory"], given_unit = "MiB"))
-		if len(data["qtime"]) != 0:
-			data["qtime"] = str(timedelta(seconds=int(np.mean(data["qtime"]))))
+		if len(qtime) != 0:
+			data["qtime"] = str(timedelta(seconds=int(qtime.mean())))
 		else:
-			 data["qtime"] = str(0)		
+			data["qtime"] = str(0)
 
 		# Plot creation for user statistics
 		data["filename_plot"] = self.plot()
@@ -271,6 +250,10 @@ class HTCondorJobsPerUser(hf.module.ModuleBase):
 		ram_status = 0.5 if float(data["ram"])/float(data["cores"]) > float(self.config["ram_requested_memory_ratio"]) else 1.0
 		queue_time_status = 0.0 if "day" in data["qtime"] else 1.0
 		data["status"] = min(efficiency_status, ram_status, queue_time_status)
+		# Users of schedds that failed or did not finish are undercounted
+		if jobs.errors:
+			data["error_msg"] = "<br>".join("Schedd %s: %s" % (schedd_name, error) for schedd_name, error in sorted(jobs.errors.iteritems()))
+			data["status"] = min(data["status"], 0.5)
 		return data
 
 
@@ -329,4 +312,5 @@ class HTCondorJobsPerUser(hf.module.ModuleBase):
 		# save figure
 		plotname = hf.downloadService.getArchivePath( self.run, self.instance_name + "_userinfo.png")
 		fig.savefig(plotname, dpi=91, bbox_inches="tight")
+		plt.close(fig)
 		return plotname
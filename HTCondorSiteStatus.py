@@ -19,6 +19,8 @@ from sqlalchemy import TEXT, INT, FLOAT, Column
 import numpy as np
 import htcondor
 import copy
+from htcondor_acquisition import CondorAcquisition
+from plot_service import PlotService
 
 class HTCondorSiteStatus(hf.module.ModuleBase):
 
@@ -54,6 +56,7 @@ class HTCondorSiteStatus(hf.module.ModuleBase):
         }
 
         def prepareAcquisition(self):
+		PlotService.instance()
 
                 # Setting defaults
                 self.source_url = self.config["source_url"]
@@ -92,8 +95,9 @@ class HTCondorSiteStatus(hf.module.ModuleBase):
 			'retiring' : 'slateblue'
 		}
 
-		# Prepare htcondor queries
-		self.collector = htcondor.Collector()
+		# Prepare htcondor queries, the collector is shared with the other
+		# HTCondor modules of this run
+		self.acquisition = CondorAcquisition.for_run(self.run)
 
 		# Prepare subtable list for database
 		self.statistics_db_value_list = []
@@ -111,7 +115,7 @@ class HTCondorSiteStatus(hf.module.ModuleBase):
 		}
 
 		# Extract site information using htcondor python bindings
-		result = self.collector.query(ad_type = htcondor.AdTypes.Startd, constraint = "RoutedToJobId =?= undefined && Cpus > 0", projection = self.condor_projection)
+		result = self.acquisition.startd_ads("RoutedToJobId =?= undefined && Cpus > 0", self.condor_projection)
 
 		# Fill the main table and the cloud site statistics information
 		for slot in result:
@@ -153,7 +157,7 @@ class HTCondorSiteStatus(hf.module.ModuleBase):
 		data['average_load'] = round(np.mean(data['average_load']),3)*100 if len(data['average_load']) > 0 else 0.0
 
 		# Plot creation for cloud site statistics
-		data['filename_plot'] = self.plot()
+		self.plot()
 
 		return data
 
@@ -170,41 +174,34 @@ class HTCondorSiteStatus(hf.module.ModuleBase):
                 return data
 
 	def plot(self):
-		import matplotlib.pyplot as plt
-		import matplotlib.patches as mpatches
-		# initializing figure
-		fig = plt.figure(figsize=(float(self.config["plotsize_x"]), float(self.config["plotsize_y"])))
-		axis = fig.add_subplot(111)
 		# determining, whether log x-axis i needed
 		max_number = max([cloudsite_stats[activity] for cloudsite_stats in self.cloudsite_statistics.itervalues() for activity in self.cloudsite_activity_colordict])
 		log_needed = max_number > float(self.config["log_limit"])
-		# creating bar entries for each status and user
+		# creating stacked bars of all activities for each site
 		offset = 0.9 if log_needed else 0
-		for index,cloudsite in enumerate(self.cloudsite_statistics):
+		cloudsites = list(self.cloudsite_statistics)
+		layers = [{'kind': 'bar', 'horizontal': True, 'stacked': True, 'base': offset, 'width': 0.5, 'log': log_needed,
+			'series': [{'values': [self.cloudsite_statistics[cloudsite][activity] for cloudsite in cloudsites], 'color': color}
+				for activity,color in self.cloudsite_activity_colordict.iteritems()]}]
+		for index,cloudsite in enumerate(cloudsites):
 			cloudsite_info = cloudsite + " - " + str(sum([self.cloudsite_statistics[cloudsite][act] for act in self.cloudsite_activity_colordict])) + " Cores"
-			axis.text(offset+0.1, index+0.45, cloudsite_info, ha="left", va="center")
-			previous_status_value = offset
-			for activity,color in self.cloudsite_activity_colordict.iteritems():
-				if self.cloudsite_statistics[cloudsite][activity] != 0:
-					axis.barh(index,float(self.cloudsite_statistics[cloudsite][activity]),0.5,previous_status_value,color=color,align='center',log=log_needed)
-					if previous_status_value == offset:
-						previous_status_value = 0
-					previous_status_value += float(self.cloudsite_statistics[cloudsite][activity])
-		# Creating figure legend
-		activity_label_objects = []
-		x_max = axis.get_xlim()[1]
-		axis.set_ylim(-1,len(self.cloudsite_statistics))
-		for activity,color in self.cloudsite_activity_colordict.iteritems():
-			activity_label_objects.append(mpatches.Patch(facecolor=color, label=activity, edgecolor="black"))
-		axis.legend(activity_label_objects, [o.get_label() for o in activity_label_objects], loc="upper right")
-		# Optimizing figure
-		x_max *=30 if log_needed else 1.3
-		axis.set_xlim(offset, x_max)
-		axis.set_title("cores per site")
-		axis.set_xlabel("number of cores")
-		axis.set_ylabel("site")
-		axis.set_yticks([])
+			layers.append({'kind': 'text', 'x': offset+0.1, 'y': index+0.45, 'text': cloudsite_info})
 		# save figure
 		plotname = hf.downloadService.getArchivePath( self.run, self.instance_name + "_siteinfo.png")
-		fig.savefig(plotname, dpi=91, bbox_inches="tight")
-		return plotname
+		PlotService.instance().submit({
+			'figsize': (float(self.config["plotsize_x"]), float(self.config["plotsize_y"])),
+			'tight_layout': False,
+			'bbox_inches': "tight",
+			'axes': [{
+				'title': "cores per site",
+				'xlabel': "number of cores",
+				'ylabel': "site",
+				'layers': layers,
+				'ylim': (-1, len(cloudsites)),
+				'xlim': (offset, None),
+				'xlim_scale': 30 if log_needed else 1.3,
+				'yticks': [],
+				'legend': {'loc': "upper right", 'fontsize': 'medium',
+					'patches': list(self.cloudsite_activity_colordict.iteritems())},
+			}],
+		}, plotname, self, 'filename_plot', plotname)
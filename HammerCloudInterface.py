@@ -17,14 +17,38 @@
 import hf
 from sqlalchemy import TEXT, INT, FLOAT, Column
 import lxml.html as lh
-import urllib2 as ul
+import re
+from concurrent_fetch import FetchPool
+from parse_cache import ParseCache
+
+# status of a single job in the results_at_site json
+ganga_status_pattern = re.compile(r'"ganga_status": "([cskrf])"')
+
+def count_ganga_status(response, chunk_size=65536):
+	"""Count the jobs per ganga_status while reading the results_at_site json in chunks."""
+	counts = dict.fromkeys('cskrf', 0)
+	tail = ''
+	while True:
+		chunk = response.read(chunk_size)
+		if not chunk:
+			break
+		buf = tail + chunk
+		end = 0
+		for match in ganga_status_pattern.finditer(buf):
+			counts[match.group(1)] += 1
+			end = match.end()
+		# keep a possibly split match for the next chunk, never a complete one
+		tail = buf[max(end, len(buf) - len('"ganga_status": "c"') + 1):]
+	return counts
 
 class HammerCloudInterface(hf.module.ModuleBase):
 	config_keys = {
 		'source_url' : ('HammerCloud URL', 'http://hc-ai-core.cern.ch/hc/app/cms/'),
 		'sites_of_interest' : ('Names of the sites, for which you want to see currently running tests. Split the names by a semicolon','T1_DE_KIT'),
 		'warning_threshold' : ('Percentage of efficiency, at which the module should have a warning status', '0.98'),
-		'critical_threshold' : ('Percentage of efficiency, at which the module should have a critical status', '0.8')
+		'critical_threshold' : ('Percentage of efficiency, at which the module should have a critical status', '0.8'),
+		'fetch_workers' : ('Number of parallel requests for the test results', '8'),
+		'fetch_timeout' : ('Timeout in seconds for a single request of test results', '30')
 	}
 	table_columns = [], []
 	subtable_columns = {
@@ -43,14 +67,16 @@ class HammerCloudInterface(hf.module.ModuleBase):
 		}
 	def prepareAcquisition(self):
 		self.source_url = self.config['source_url']
+		self.source = hf.downloadService.addDownload(self.source_url)
 		self.site_names = self.config['sites_of_interest'].split(";")
 		self.running_tests_db_value_list = []
 	def extractData(self):
 		# parsing html page to find ID of tests on the site of interest
 		data = {}
-		hammercloud = lh.parse(self.source_url).getroot()
+		hammercloud = ParseCache.for_run(self.run).parse(self.source, lh.parse).getroot()
 		testtypelist = hammercloud.findall(".//div[@class='runningjobs']") # extracting test types
 		efficiency_status_list = []
+		tests = []
 		for site_name in self.site_names:
 			for testtype in testtypelist:
 				noentries = False
@@ -63,13 +89,6 @@ class HammerCloudInterface(hf.module.ModuleBase):
 				test_type_value = testtype.find(".//h3").text
 				for test in testtype.findall(".//tr[@onmouseover]"):
 					test_id_value = 'no information'
-					submitted_jobs_value = 'no information'
-					running_jobs_value = 'no information'
-					completed_jobs_value = 'no information'
-					failed_jobs_value = 'no information'
-					jobs_with_status_k_value = 'no information'
-					efficiency_value = 'no information'
-					jobs_in_total_value = 'no information'
 					for td in test.findall(".//td"):
 						site = "Anysite"
 						if td.text:
@@ -82,42 +101,53 @@ class HammerCloudInterface(hf.module.ModuleBase):
 								test_id_value = td.findall(".//a")[0].get("href").replace("/hc/app/cms/test/","").replace("/","")
 						if test_id_value != 'no information':
 							json_url = self.source_url + "xhr/json/?action=results_at_site&test={IDNUMBER}&site={SITE}".format(IDNUMBER = test_id_value, SITE = site) # building appropriate .json url to get detailed information on the test
-							readout = ul.urlopen(json_url).read()
-							# finding and calculating several detailed information on the jobs of the test
-							gsc = readout.count('"ganga_status": "c"')
-							gss = readout.count('"ganga_status": "s"')
-							gsk = readout.count('"ganga_status": "k"')
-							gsr = readout.count('"ganga_status": "r"')
-							gsf = readout.count('"ganga_status": "f"')
-							submitted_jobs_value = gss
-							running_jobs_value = gsr
-							completed_jobs_value = gsc
-							failed_jobs_value = gsf
-							jobs_with_status_k_value = gsk
-							efficiency_value = gsc/(1.*(gsf+gsc)) if gsf > 0 or gsc > 0 else 1
-							jobs_in_total_value = gsc+gss+gsk+gsr+gsf
+							tests.append((site_name, test_type_value, test_id_value, json_url))
+							break
 
-							if efficiency_value < float(self.config['critical_threshold']): efficiency_status_list.append(0.0)
-							elif efficiency_value >= float(self.config['critical_threshold']) and \
-								efficiency_value < float(self.config['warning_threshold']):
-								efficiency_status_list.append(0.5)
-							else: efficiency_status_list.append(1.0)
+		# retrieving the detailed information of all tests at once, tests
+		# shared by several sites are only requested once
+		with FetchPool(workers=self.config['fetch_workers'], timeout=self.config['fetch_timeout']) as pool:
+			results = pool.fetch([json_url for site_name, test_type_value, test_id_value, json_url in tests], count_ganga_status)
 
-							# passing the calculated values to the list used to fill the subtables
-							cat_data = {
-								'site_name' : site_name,
-								'test_type' : test_type_value,
-								'test_id' : test_id_value,
-								'submitted_jobs' : submitted_jobs_value,
-								'running_jobs' : running_jobs_value,
-								'completed_jobs' : completed_jobs_value,
-								'failed_jobs' : failed_jobs_value,
-								'jobs_with_status_k': jobs_with_status_k_value,
-								'efficiency' : round(efficiency_value,3),
-								'jobs_in_total' : jobs_in_total_value
-							}
-							self.running_tests_db_value_list.append(cat_data)
-							break
+		for site_name, test_type_value, test_id_value, json_url in tests:
+			result = results[json_url]
+			if not result.ok:
+				self.logger.warning("Could not retrieve %s: %s" % (json_url, result.error))
+				continue
+			# finding and calculating several detailed information on the jobs of the test
+			gsc = result.data['c']
+			gss = result.data['s']
+			gsk = result.data['k']
+			gsr = result.data['r']
+			gsf = result.data['f']
+			submitted_jobs_value = gss
+			running_jobs_value = gsr
+			completed_jobs_value = gsc
+			failed_jobs_value = gsf
+			jobs_with_status_k_value = gsk
+			efficiency_value = gsc/(1.*(gsf+gsc)) if gsf > 0 or gsc > 0 else 1
+			jobs_in_total_value = gsc+gss+gsk+gsr+gsf
+
+			if efficiency_value < float(self.config['critical_threshold']): efficiency_status_list.append(0.0)
+			elif efficiency_value >= float(self.config['critical_threshold']) and \
+				efficiency_value < float(self.config['warning_threshold']):
+				efficiency_status_list.append(0.5)
+			else: efficiency_status_list.append(1.0)
+
+			# passing the calculated values to the list used to fill the subtables
+			cat_data = {
+				'site_name' : site_name,
+				'test_type' : test_type_value,
+				'test_id' : test_id_value,
+				'submitted_jobs' : submitted_jobs_value,
+				'running_jobs' : running_jobs_value,
+				'completed_jobs' : completed_jobs_value,
+				'failed_jobs' : failed_jobs_value,
+				'jobs_with_status_k': jobs_with_status_k_value,
+				'efficiency' : round(efficiency_value,3),
+				'jobs_in_total' : jobs_in_total_value
+			}
+			self.running_tests_db_value_list.append(cat_data)
 		data['status'] = min(efficiency_status_list) if len(efficiency_status_list) > 0 else 1.0
 		return data
 	def fillSubtables(self, module_entry_id):
@@ -17,7 +17,9 @@
 import hf
 import numpy as np
 from sqlalchemy import TEXT, INT, Column
-from lxml import etree
+from parse_cache import ParseCache
+from qstat_summary import parse_qstat
+from plot_service import PlotService
 
 class JobsDist(hf.module.ModuleBase):
     config_keys = {
@@ -33,6 +35,7 @@ class JobsDist(hf.module.ModuleBase):
 
 
     def prepareAcquisition(self):
+        PlotService.instance()
         # read configuration
         self.variable = self.config['variable']
         group = self.config["groups"].strip()
@@ -52,55 +55,29 @@ class JobsDist(hf.module.ModuleBase):
 
 
     def extractData(self):
-        import matplotlib.pyplot as plt
-        self.plt = plt
         data = {}
         data["filename_eff_plot"] = ""
         data["result_timestamp"] = 0
         data['status'] = 1.0
 
-        source_tree = etree.parse(open(self.qstat_xml.getTmpPath()))
-        root = source_tree.getroot()
+        qstat = ParseCache.for_run(self.run).parse(self.qstat_xml, parse_qstat)
 
-        values = []
         variable = self.variable
         nbins = 20
 
-        hierarchy = self.getGroupHierarchy(root)
-
         # Check input file timestamp
-        date = 0
-        for element in root:
-            if element.tag == "header":
-                for child in element:
-                    if child.tag == "date" and child.text is not None:
-                        date = int(float(child.text.strip()))
-
-        data["result_timestamp"] = date
+        data["result_timestamp"] = qstat.date
         data['status'] = 1.0
 #        if self.timestamp - date > self.old_result_critical_limit*3600:
 #            self.status = 0.0
 #        elif self.timestamp - date > self.old_result_warning_limit*3600:
 #            self.status = 0.5
 
-        for element in root:
-            if element.tag == "jobs":
-                for child in element:
-                    group = job_state = variable_str = ''
-                    # Only count running jobs
-                    for subchild in child:
-                        if subchild.tag == 'group' and subchild.text is not None:
-                            group = subchild.text.strip()
-                        if subchild.tag == 'state' and subchild.text is not None:
-                            job_state = subchild.text.strip()
-                        if subchild.tag == variable and subchild.text is not None:
-                            variable_str = subchild.text.strip()
-
-                    # Check user
-                    if not self.checkGroups(group, self.groups, hierarchy) or job_state != 'running' or variable_str == '':
-                        continue
-
-                    values.append(float(variable_str))
+        # Only count running jobs of the selected groups
+        values = []
+        for (group, tag), group_values in qstat.running_values.iteritems():
+            if tag == variable and self.checkGroups(group, self.groups, qstat.hierarchy):
+                values.extend(group_values)
 ################################################################
         ### AT THE MOMENT: QUICK AND DIRTY
         ### inspired by: http://matplotlib.sourceforge.net/examples/pylab_examples/bar_stacked.html
@@ -160,40 +137,25 @@ class JobsDist(hf.module.ModuleBase):
             ind = np.arange(nbins)    # the x locations for the groups
             width = 1.00       # the width of the bars: can also be len(x) sequence
 
-            fig = self.plt.figure()
-
-            axis = fig.add_subplot(111)
-
-            axis.bar(ind, content, width, color='orange')
-
-            axis.set_position([0.10,0.2,0.85,0.75])
-            axis.set_xlabel(variable);
-            axis.set_ylabel('Number of Jobs')
-            axis.set_title(variable + ' distribution')
-            axis.set_xticks(ind + width / 2.0)
-            axis.set_xticklabels(xlabels, rotation='vertical')
-            axis.set_yticks(np.arange(0,max_bin_height + 5,scale_value))
-
-            fig.savefig(hf.downloadService.getArchivePath(self.run, self.instance_name + "_jobs_dist.png"), dpi=60)
-            data["filename_eff_plot"] = self.instance_name + "_jobs_dist.png"
+            PlotService.instance().submit({
+                'dpi': 60,
+                'tight_layout': False,
+                'axes': [{
+                    'layers': [{'kind': 'bar', 'x': ind, 'width': width, 'align': 'edge',
+                                'series': [{'values': content, 'color': 'orange'}]}],
+                    'position': [0.10,0.2,0.85,0.75],
+                    'xlabel': variable,
+                    'ylabel': 'Number of Jobs',
+                    'title': variable + ' distribution',
+                    'xticks': ind + width / 2.0,
+                    'xticklabels': xlabels,
+                    'xticklabels_rotation': 'vertical',
+                    'yticks': np.arange(0,max_bin_height + 5,scale_value),
+                }],
+            }, hf.downloadService.getArchivePath(self.run, self.instance_name + "_jobs_dist.png"),
+                self, "filename_eff_plot")
         return data
 
-    def getGroupHierarchy(self, root):
-        hierarchy = {}
-        for element in root:
-            if element.tag == "summaries":
-                for child in element:
-                    if child.tag == 'summary':
-                        group = 'all'
-                        if 'group' in child.attrib:
-                            group = child.attrib['group']
-
-                        if 'parent' in child.attrib:
-                            hierarchy[group] = child.attrib['parent']
-                        else:
-                            hierarchy[group] = None
-        return hierarchy
-
     def checkGroup(self, group_chk, group, hierarchy):
         try:
             while group_chk != group:
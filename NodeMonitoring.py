@@ -20,6 +20,7 @@ import numpy as np
 from datetime import datetime,timedelta
 import pytz
 import json
+from node_statistics import finished_since, count_jobs, top_nodes
 
 state_colors = {
         'submitted': '#5CADFF',
@@ -184,53 +185,30 @@ class NodeMonitoring(hf.module.ModuleBase):
         data['IntervalStart'] = IntervalStart.strftime("%d-%b-%y %H:%M:%S")
         
         #filter rawdata for jobs finished in eval_time or still running
+        jobs = rawdata['jobs']
         if self.eval_time != 24:
-            for item in rawdata['jobs']:
-                try:
-                    date = datetime.strptime(item['FinishedTimeStamp'], "%Y-%m-%dT%H:%M:%S").replace(
-                            tzinfo=pytz.utc).astimezone(pytz.timezone('Europe/Berlin'))
-                    if date < IntervalStart:
-                        rawdata['jobs'].remove(item)
-                except Exception:
-                    pass
+            # FinishedTimeStamp is an ISO timestamp in UTC, so comparing the
+            # strings is the same as comparing the dates
+            IntervalStartUTC = pytz.timezone('Europe/Berlin').localize(IntervalStart).\
+                    astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M:%S")
+            jobs = finished_since(jobs, IntervalStartUTC)
 
         # Prepare different attribute values (either use those indicated in
-        # config file or loop over data and get all different categories)
+        # config file or take all different categories in order of appearance)
         AttributeValues = []
         if self.eval_attribute_value <> '':
             AttributeValues.append(self.eval_attribute_value)
         if self.attribute_values <> '':
-            AddAttributeValues = self.attribute_values.split('|')
-            for i in range(len(AddAttributeValues)):
-                if AddAttributeValues[i] not in AttributeValues:
-                    AttributeValues.append(AddAttributeValues[i])
-        else:
-            for item in rawdata['jobs']:
-                if item[self.attribute] not in AttributeValues:
-                    AttributeValues.append(item[self.attribute])
-
-        # Get all different primary and secondary keys for the selected attribute values
-        PrimaryKeys = []
-        SecondaryKeys = []
-        for item in rawdata['jobs']:
-            if item[self.attribute] in AttributeValues:
-                if item[self.primary_key] not in PrimaryKeys:
-                    PrimaryKeys.append(item[self.primary_key])
-                    if self.use_secondary_key == True:
-                        SecondaryKeys.append(item[self.secondary_key])
-
-        # Get job numbers from raw data
-        Jobs = [[0 for k in range(len(PrimaryKeys))] for a in range(len(AttributeValues))]
-        for item in rawdata['jobs']:
-            if item[self.attribute] in AttributeValues:
-                Jobs[AttributeValues.index(item[self.attribute])][
-                        PrimaryKeys.index(item[self.primary_key])] += 1
-
-        # Get total number of jobs across all categories per node
-        TotalJobsPerNode = [0 for k in range(len(PrimaryKeys))]
-        for k in range(len(PrimaryKeys)):
-            for a in range(len(AttributeValues)):
-                TotalJobsPerNode[k] += Jobs[a][k]
+            for value in self.attribute_values.split('|'):
+                if value not in AttributeValues:
+                    AttributeValues.append(value)
+
+        # Get job numbers per attribute value and node and the total number
+        # of jobs across all categories per node
+        AttributeValues, PrimaryKeys, SecondaryKeys, Jobs, TotalJobsPerNode = count_jobs(
+                jobs, self.attribute, self.primary_key,
+                self.secondary_key if self.use_secondary_key else '',
+                AttributeValues, self.attribute_values <> '')
         
         # Calculate module status
         # a 'node' is the class of grouping, i.e. one line in the plot (a host, a workflow, ...)
@@ -307,28 +285,14 @@ class NodeMonitoring(hf.module.ModuleBase):
         ################################################################
         ### Plot data
 
-        # Get filtered subset of job numbers to plot
-        PlotIndices = []
+        # Get the plot_filter_node_number nodes with most jobs, nodes with
+        # equal counts stay in order of appearance
         if self.plot_filter_attribute_value in AttributeValues:
-            AttributeValueIndex = AttributeValues.index(
-                    self.plot_filter_attribute_value)
-            CountsSet = set(Jobs[AttributeValueIndex])
-            Counts = [c for c in CountsSet]
-            Counts.sort(reverse=True)
-            for c in range(len(Counts)):
-                for k in range(len(PrimaryKeys)):
-                    if Jobs[AttributeValueIndex][k] == Counts[c]:
-                        PlotIndices.append(k)
+            SortCounts = Jobs[AttributeValues.index(self.plot_filter_attribute_value)]
         else:
-            CountsSet = set(TotalJobsPerNode)
-            Counts = [c for c in CountsSet]
-            Counts.sort(reverse=True)
-            for c in range(len(Counts)):
-                for k in range(len(PrimaryKeys)):
-                    if TotalJobsPerNode[k] == Counts[c]:
-                        PlotIndices.append(k)
-        
-        nbins = min(self.plot_filter_node_number, len(PlotIndices))
+            SortCounts = TotalJobsPerNode
+        PlotIndices = top_nodes(SortCounts, self.plot_filter_node_number)
+        nbins = len(PlotIndices)
 
         # Sort counts and get self.plot_filter_node_number highest
         FilteredJobs = [[0 for k in range(nbins)] for a in AttributeValues]
@@ -438,6 +402,7 @@ class NodeMonitoring(hf.module.ModuleBase):
 
             fig.savefig(hf.downloadService.getArchivePath(self.run, 
                     self.instance_name + "_jobs_dist.png"), dpi=91)
+            self.plt.close(fig)
             data["filename_plot"] = self.instance_name + "_jobs_dist.png"
             data['PrimaryKey'] = self.primary_key
             data['SecondaryKey'] = self.secondary_key
@@ -17,6 +17,8 @@ import hf
 from sqlalchemy import TEXT, INT, FLOAT, Column
 from BeautifulSoup import BeautifulSoup
 import json
+from parse_cache import ParseCache
+from template_cache import cached_template_data
 
 class Panda(hf.module.ModuleBase):
 
@@ -172,11 +174,11 @@ class Panda(hf.module.ModuleBase):
         }
 
         # check for download errors
-        schedconfig_content = ''
+        schedconfig_index = {}
         if self.schedconfig_source.errorOccured():
             print('WARNING: The url '+self.schedconfig_source.getSourceUrl()+' could not be downloaded!')
         else:
-            schedconfig_content = open(self.schedconfig_source.getTmpPath()).read()
+            schedconfig_index = ParseCache.for_run(self.run).parse(self.schedconfig_source, index_schedconfig)
 
         for site in self.site_names:
             for source in (self.site_sources[site])['analysis']:
@@ -187,8 +189,8 @@ class Panda(hf.module.ModuleBase):
                     print('WARNING: The url '+source.getSourceUrl()+' could not be downloaded!')
 
         queue_details = {}
+        grid_site_info = cloud_class(schedconfig_index)
         for site in self.site_names:
-            grid_site_info = cloud_class(schedconfig_content)
             # parse information from the file for each analysis queue
             for source, queue in map(None, (self.site_sources[site])['analysis'], (self.queue_names[site])['analysis']):
                 queue_info = {}
@@ -200,18 +202,19 @@ class Panda(hf.module.ModuleBase):
                 queue_info['queue_link'] = self.panda_analysis_url.split('|')[2]+queue+'&hours='+self.panda_analysis_interval
                 queue_info['queue_type'] = 'analysis'
                 queue_info['status'] = analysis_info[1]
-                queue_info['active_jobs'] = grid_site_info.get_numberof_activated_jobs()
-                queue_info['running_jobs'] = grid_site_info.get_numberof_running_jobs()
-                queue_info['defined_jobs'] = grid_site_info.get_numberof_defined_jobs()
-                queue_info['holding_jobs'] = grid_site_info.get_numberof_holding_jobs()
-                queue_info['finished_jobs'] = grid_site_info.get_numberof_finished_jobs()
-                queue_info['failed_jobs'] = grid_site_info.get_numberof_failed_jobs()
+                job_counts = grid_site_info.get_numberof_jobs()
+                queue_info['active_jobs'] = job_counts['activated']
+                queue_info['running_jobs'] = job_counts['running']
+                queue_info['defined_jobs'] = job_counts['defined']
+                queue_info['holding_jobs'] = job_counts['holding']
+                queue_info['finished_jobs'] = job_counts['finished']
+                queue_info['failed_jobs'] = job_counts['failed']
                 #if int(queue_info['failed_jobs']) >= int(self.config['failed_warning']) and \
                     #int(queue_info['failed_jobs']) < int(self.config['failed_critical']):
                 #    data['status'] = min(data['status'],0.5)
                 #elif int(queue_info['failed_jobs']) >= int(self.config['failed_critical']):
                 #    data['status'] = min(data['status'],0.)
-                queue_info['cancelled_jobs'] = grid_site_info.get_numberof_cancelled_jobs()
+                queue_info['cancelled_jobs'] = job_counts['cancelled']
                 # calculate the efficiency
                 if (queue_info['finished_jobs'] + queue_info['failed_jobs']) != 0:
                     queue_info['efficiency'] = (queue_info['finished_jobs']*100)/(queue_info['finished_jobs'] + queue_info['failed_jobs'])
@@ -237,19 +240,20 @@ class Panda(hf.module.ModuleBase):
                 queue_info['queue_link'] = self.panda_production_url.split('|')[2]+queue+'&hours='+self.panda_production_interval
                 queue_info['queue_type'] = 'production'
                 queue_info['status'] = production_info[1]
+                job_counts = grid_site_info.get_numberof_jobs()
                 if queue_info['status'].lower() == 'online':
                     data['status'] = min(data['status'], 1)
                 elif (queue_info['status'].lower()) == 'offline' or (queue_info['status'].lower()) == 'brokeroff':
                     data['status'] = min(data['status'], 0.5)
                 else:
                     data['status'] = min(data['status'], 0)
-                queue_info['active_jobs'] = grid_site_info.get_numberof_activated_jobs()
-                queue_info['running_jobs'] = grid_site_info.get_numberof_running_jobs()
-                queue_info['defined_jobs'] = grid_site_info.get_numberof_defined_jobs()
-                queue_info['holding_jobs'] = grid_site_info.get_numberof_holding_jobs()
-                queue_info['finished_jobs'] = grid_site_info.get_numberof_finished_jobs()
-                queue_info['failed_jobs'] = grid_site_info.get_numberof_failed_jobs()
-                queue_info['cancelled_jobs'] = grid_site_info.get_numberof_cancelled_jobs()
+                queue_info['active_jobs'] = job_counts['activated']
+                queue_info['running_jobs'] = job_counts['running']
+                queue_info['defined_jobs'] = job_counts['defined']
+                queue_info['holding_jobs'] = job_counts['holding']
+                queue_info['finished_jobs'] = job_counts['finished']
+                queue_info['failed_jobs'] = job_counts['failed']
+                queue_info['cancelled_jobs'] = job_counts['cancelled']
                 # calculate the efficiency
                 if (queue_info['finished_jobs'] + queue_info['failed_jobs']) != 0:
                     queue_info['efficiency'] = (queue_info['finished_jobs']*100)/(queue_info['finished_jobs'] + queue_info['failed_jobs'])
@@ -278,6 +282,7 @@ class Panda(hf.module.ModuleBase):
     def fillSubtables(self, parent_id):
         self.subtables['site_details'].insert().execute([dict(parent_id=parent_id, **row) for row in self.details_db_value_list])
 
+    @cached_template_data()
     def getTemplateData(self):
         data = hf.module.ModuleBase.getTemplateData(self)
 
@@ -302,43 +307,30 @@ class Panda(hf.module.ModuleBase):
         return data
 
 
+def index_schedconfig(source):
+    """Read schedconfig.all.json from the file object source into a siteid -> [entries] index."""
+    index = {}
+    for entry in json.load(source, 'utf-8').itervalues():
+        index.setdefault(entry["siteid"], []).append(entry)
+    return index
+
+
 class cloud_class(object):
 
-    def __init__(self,schedconfig_content):
-        content = schedconfig_content
-        self.json_source=json.loads(content,'utf-8')
+    job_states = ("activated", "running", "defined", "holding", "finished", "failed", "cancelled")
+    listing_markers = ("Click job number to see details.", "Listing limited to search depth of")
+
+    def __init__(self,schedconfig_index):
+        self.schedconfig_index = schedconfig_index
         self.resource=[]
 
     def panda_info_preprocessing(self,html_content):
+        # only the part starting at the job listing is of interest
         src=html_content
-        l=True
-        while l:
-            n=len(src)
-            if ("Click job number to see details." in src[0:n/2] or \
-                "Listing limited to search depth of" in src[0:n/2]) and \
-                ("defined" in src[0:n/2] or "activated" in src[0:n/2] or \
-                "running" in src[0:n/2] or "holding" in src[0:n/2] or \
-                "transferring" in src[0:n/2] or "finished" in src[0:n/2] or \
-                "cancelled" in src[0:n/2]) and "Users" in src[0:n/2] and "Releases" in src[0:n/2]:
-                l=True
-                src=src[0:(n/2)+15]
-            elif ("Click job number to see details." in src[n/2:n] or \
-                "Listing limited to search depth of" in src[0:n/2]) and \
-                ("defined" in src[n/2:n] or "activated" in src[n/2:n] or \
-                "running" in src[n/2:n] or  "holding" in src[n/2:n] or \
-                "transferring" in src[n/2:n] or "finished" in src[n/2:n] or \
-                "cancelled" in src[n/2:n]) and "Users" in src[n/2:n] and "Releases" in src[n/2:n]:
-                l=True
-                src=src[(n/2)-15:n]
-            else:
-                l=False
-        i=0
-        while i<len(src)-len("Click job number to see details."):
-            if src[i:i+len("Click job number to see details.")]=="Click job number to see details." or \
-                src[i:i+len("Listing limited to search depth of")]=="Listing limited to search depth of":
-                src=src[i:len(src)]
-                break
-            i+=1
+        starts=[src.find(marker) for marker in self.listing_markers]
+        starts=[start for start in starts if start >= 0]
+        if starts:
+            src=src[min(starts):]
         soup = BeautifulSoup(src)
         src_text = soup.findAll(text=True)
         src_text = ''.join(src_text)
@@ -347,112 +339,34 @@ class cloud_class(object):
 
     def get_queue_status(self,queue):
         queue_status="unknown"
-        analysis_queues=[]
-        production_queues=[]
-        if "analy" in queue.lower():
-            for item in self.json_source:
-                if queue == self.json_source[item]["siteid"]:
-                    if str(self.json_source[item]["gatekeeper"])!="to.be.set":
-                        analysis_queues.append("%s %s"%(str(self.json_source[item]["gatekeeper"]),str(self.json_source[item]["status"])))
-                    else:
-                        analysis_queues.append("%s %s"%(str(self.json_source[item]["siteid"]),str(self.json_source[item]["status"])))
-                    if self.json_source[item]["status"]=="online":
-                        queue_status="online"
-                    elif queue_status!="online" and self.json_source[item]["status"]!="online":
-                        queue_status=self.json_source[item]["status"]
-                else:
-                    continue
-            return analysis_queues,queue_status
-        else:
-            for item in self.json_source:
-                if queue == self.json_source[item]["siteid"]:
-                    production_queues.append("%s %s"%(str(self.json_source[item]["gatekeeper"]),str(self.json_source[item]["status"])))
-                    if self.json_source[item]["status"]=="online":
-                        queue_status="online"
-                    elif queue_status!="online" and self.json_source[item]["status"]!="online":
-                        queue_status=self.json_source[item]["status"]
-                else:
-                    continue
-            return production_queues,queue_status
-        return queue_status
+        queues=[]
+        analysis = "analy" in queue.lower()
+        for entry in self.schedconfig_index.get(queue, []):
+            if analysis and str(entry["gatekeeper"])=="to.be.set":
+                queues.append("%s %s"%(str(entry["siteid"]),str(entry["status"])))
+            else:
+                queues.append("%s %s"%(str(entry["gatekeeper"]),str(entry["status"])))
+            if entry["status"]=="online":
+                queue_status="online"
+            elif queue_status!="online":
+                queue_status=entry["status"]
+        return queues,queue_status
 
     #def get_queue_gatekeeper_info(self,queue):
     #    return 0
 
-    def get_numberof_activated_jobs(self):
-        activated_jobs=0
+    def get_numberof_jobs(self):
+        """Number of jobs per state, taken from the first "<state>:<number>" token of each state."""
+        job_counts=dict((state, 0) for state in self.job_states)
+        missing=list(self.job_states)
         for item in self.resource:
-            if "activated" in item:
-                try:
-                    activated_jobs=int(item.split(":")[1])
-                    return activated_jobs
-                except ValueError:
-                    activated_jobs=0
-        return activated_jobs
-
-    def get_numberof_running_jobs(self):
-        running_jobs=0
-        for item in self.resource:
-            if "running" in item:
-                try:
-                    running_jobs=int(item.split(":")[1])
-                    return running_jobs
-                except ValueError:
-                    running_jobs=0
-        return running_jobs                
-
-    def get_numberof_defined_jobs(self):
-        defined_jobs=0
-        for item in self.resource:
-            if "defined" in item:
-                try:
-                    defined_jobs=int(item.split(":")[1])
-                    return defined_jobs
-                except ValueError:
-                    defined_jobs=0
-        return defined_jobs
-
-    def get_numberof_holding_jobs(self):
-        holding_jobs=0
-        for item in self.resource:
-            if "holding" in item:
-                try:
-                    holding_jobs=int(item.split(":")[1])
-                    return holding_jobs
-                except ValueError:
-                    holding_jobs=0
-        return holding_jobs
-
-    def get_numberof_finished_jobs(self):
-        finished_jobs=0
-        for item in self.resource:
-            if "finished" in item:
-                try:
-                    finished_jobs=int(item.split(":")[1])
-                    return finished_jobs
-                except ValueError:
-                    finished_jobs=0
-        return finished_jobs
-
-    def get_numberof_failed_jobs(self):
-        failed_jobs=0
-        for item in self.resource:
-            if "failed" in item:
-                try:
-                    failed_jobs=int(item.split(":")[1])
-                    return failed_jobs
-                except ValueError:
-                    failed_jobs=0
-        return failed_jobs
-
-    def get_numberof_cancelled_jobs(self):
-        cancelled_jobs=0
-        for item in self.resource:
-            if "cancelled" in item:
-                try:
-                    cancelled_jobs=int(item.split(":")[1])
-                    return cancelled_jobs
-                except ValueError:
-                    cancelled_jobs=0
-        return cancelled_jobs
-
+            if not missing:
+                break
+            for state in missing[:]:
+                if state in item:
+                    try:
+                        job_counts[state]=int(item.split(":")[1])
+                        missing.remove(state)
+                    except (ValueError, IndexError):
+                        pass
+        return job_counts
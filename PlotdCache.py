@@ -186,5 +186,7 @@ class PlotdCache(hf.module.ModuleBase):
         # save figure
         plotname = hf.downloadService.getArchivePath( self.run, self.instance_name + "_dcacheinfo.png")
         fig.savefig(plotname, dpi=91, bbox_inches="tight")
+        matplotlib.pyplot.close(fig)
         fig_diff.savefig(plotname.replace(".png", "_timedifferences.png"), dpi=91, bbox_inches="tight")
+        matplotlib.pyplot.close(fig_diff)
         return plotname
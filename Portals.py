@@ -16,17 +16,16 @@
 
 import hf
 from sqlalchemy import TEXT, Column
-import json
 import time
 import socket
 import logging
-import urllib2
-from ConfigParser import RawConfigParser
+from ganglia_client import GangliaClient, latest_value
 
 class Portals(hf.module.ModuleBase):
     config_keys = {'source_url': ('Not used, but filled to avoid warnings', 'http://monitor.ekp.kit.edu/ganglia/'),
 		   'use_perc_warning': ('Lower treshold for use percentage of the disk space above which a warning is given', '80'),
-		   'use_perc_critical': ('Lower treshold for use percentage of the disk space above which the status is critical', '90')
+		   'use_perc_critical': ('Lower treshold for use percentage of the disk space above which the status is critical', '90'),
+		   'ganglia_window': ('Seconds of the most recent Ganglia data to request', '900')
                   }
     table_columns = [], []
     subtable_columns = {
@@ -54,15 +53,8 @@ class Portals(hf.module.ModuleBase):
                        ]
         self.infos = ['mem', 'load']
         top_url = 'http://monitor.ekp.kit.edu/ganglia/'
-	cfg_parser = RawConfigParser()
-        cfg_parser.read('config/ganglia.cfg')
-        username = cfg_parser.get('login', 'username')
-        passwd = cfg_parser.get('login', 'passwd')
-        pass_mgr = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        pass_mgr.add_password(None, top_url, username, passwd)
-        authhandler = urllib2.HTTPBasicAuthHandler(pass_mgr)
-	opener = urllib2.build_opener(authhandler)
-	urllib2.install_opener(opener)
+        # Connections and fetched graphs are shared with the other Ganglia modules of this run
+        self.ganglia = GangliaClient.for_run(self.run, top_url, 'config/ganglia.cfg', self.config['ganglia_window'])
 	
 	# Prepare subtable list for database
         self.statistics_db_value_list = []
@@ -77,21 +69,20 @@ class Portals(hf.module.ModuleBase):
 		'CPUs ': 'CPUs',
 		'1-min': '1-min'
 		}
-        # Build url for all machines.
+        # Request the graphs of all machines at once.
+        requests = [[('h', portal), ('m', 'load_one'), ('s', 'by name'), ('hc', 4), ('mc', 2),
+                     ('g', info + '_report'), ('z', 'large'), ('c', 'Portals')]
+                    for portal in self.portals for info in self.infos]
+        graphs = iter(self.ganglia.graphs(requests))
         for portal in self.portals:
 	    portal_dict = {'Portal': portal}
             for info in self.infos:
-                url = 'http://monitor.ekp.kit.edu/ganglia/graph.php?h=' \
-                      + portal + '&m=load_one&r=hour&s=by%20name&hc=4&mc=2&g=' \
-                      + info + '_report&z=large&c=Portals&json=1'
-                handle = urllib2.urlopen(url)
-		html = handle.read()
-		in_file = json.loads(html)
+                in_file = graphs.next() or []
 		for entry in in_file:
-			if entry['metric_name'] in entry_dict.keys():
-				for datapoint in reversed(entry['datapoints']):
-					if datapoint[0] != 'NaN':
-						portal_dict[entry_dict[entry['metric_name']]] = datapoint[0]
+			if entry['metric_name'] in entry_dict:
+				value = latest_value(entry['datapoints'])
+				if value is not None:
+					portal_dict[entry_dict[entry['metric_name']]] = value
 	    # Add a zero by hand to the dictionary if all values in json file are 'Nan'.
 	    for value in entry_dict.itervalues():
 		if value in portal_dict.keys():
@@ -17,6 +17,7 @@
 import hf
 from sqlalchemy import TEXT, FLOAT, Column
 import json
+from parse_cache import ParseCache
 
 class Sam(hf.module.ModuleBase):
     config_keys = {
@@ -80,8 +81,7 @@ class Sam(hf.module.ModuleBase):
         # run the test
         data = {}
 
-        with open(self.source.getTmpPath(), 'r') as f:
-            data_object = json.loads(f.read())
+        data_object = ParseCache.for_run(self.run).parse(self.source, json.load)
 
         # parse the details and store it in a special database table
 
@@ -17,6 +17,7 @@
 import hf
 from sqlalchemy import TEXT, Column
 import json
+from parse_cache import ParseCache
 from string import strip
 
 
@@ -109,8 +110,7 @@ class Sam2(hf.module.ModuleBase):
         data = {}
         help_stati = []
         ##Use json to extract the file
-        with open(self.source.getTmpPath(), 'r') as f:
-            services = json.loads(f.read())
+        services = ParseCache.for_run(self.run).parse(self.source, json.load)
         ##use first group available, you may change  this if you want to parse more than one site in one module
         services = services['data']['results'][0]['flavours']
 
@@ -17,6 +17,7 @@ import hf
 from sqlalchemy import TEXT, TIMESTAMP, Column
 from datetime import datetime, timedelta
 import json
+from parse_cache import ParseCache
 
 class Sam_Goe(hf.module.ModuleBase):
     config_keys = {
@@ -84,8 +85,8 @@ class Sam_Goe(hf.module.ModuleBase):
         for vo_name in self.sam_sources:
             for profile_name in self.sam_sources[vo_name]:
                 for service_hostname in self.sam_sources[vo_name][profile_name]:
-                    content = open(self.sam_sources[vo_name][profile_name][service_hostname].getTmpPath()).read()
-                    json_content = json.loads(content)
+                    json_content = ParseCache.for_run(self.run).\
+                        parse(self.sam_sources[vo_name][profile_name][service_hostname], json.load)
                     type_list = []
                     if json_content:
                         if json_content[0]['services']:
@@ -16,17 +16,16 @@
 
 import hf
 from sqlalchemy import TEXT, Column
-import json
 import time
 import socket
 import logging
-import urllib2
-from ConfigParser import RawConfigParser
+from ganglia_client import GangliaClient, latest_value
 
 class Storages(hf.module.ModuleBase):
     config_keys = {'source_url': ('Source Url', 'http://monitor.ekp.kit.edu/ganglia/'),
 		   'use_perc_warning': ('Lower treshold for use percentage of the disk space above which a warning is given', '80'),
-                   'use_perc_critical': ('Lower treshold for use percentage of the disk space above which the status is critical', '90')
+                   'use_perc_critical': ('Lower treshold for use percentage of the disk space above which the status is critical', '90'),
+                   'ganglia_window': ('Seconds of the most recent Ganglia data to request', '900')
                   }
     table_columns = [], []
     subtable_columns = {
@@ -52,15 +51,8 @@ class Storages(hf.module.ModuleBase):
                        ]
         self.infos = ['disk_total', 'disk_free']
         top_url = 'http://monitor.ekp.kit.edu/ganglia/'
-	cfg_parser = RawConfigParser()
-	cfg_parser.read('config/ganglia.cfg')
-        username = cfg_parser.get('login', 'username')
-        passwd = cfg_parser.get('login', 'passwd')
-        pass_mgr = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        pass_mgr.add_password(None, top_url, username, passwd)
-        authhandler = urllib2.HTTPBasicAuthHandler(pass_mgr)
-	opener = urllib2.build_opener(authhandler)
-	urllib2.install_opener(opener)
+        # Connections and fetched graphs are shared with the other Ganglia modules of this run
+        self.ganglia = GangliaClient.for_run(self.run, top_url, 'config/ganglia.cfg', self.config['ganglia_window'])
 	
 	# Prepare subtable list for database
         self.statistics_db_value_list = []
@@ -73,18 +65,20 @@ class Storages(hf.module.ModuleBase):
 		'disk_total': 'total',
 		'disk_free': 'available'
 		}
-        # Build url for all machines.
+        # Request the graphs of all machines at once.
+        requests = [[('c', 'Storages'), ('h', storage + '.ekp.kit.edu'), ('m', info),
+                     ('vl', 'GB'), ('ti', 'Total Disk Space')]
+                    for storage in self.storages for info in self.infos]
+        graphs = iter(self.ganglia.graphs(requests))
         for storage in self.storages:
 	    storage_dict = {'Storage': storage}
             for info in self.infos:
-                url = 'http://monitor.ekp.kit.edu/ganglia/graph.php?c=Storages&h=' \
-                      + storage + '.ekp.kit.edu&m=' + info + '&vl=GB&ti=Total%20Disk%20Space&json=1'
-                handle = urllib2.urlopen(url)
-		html = handle.read()
-		in_file = json.loads(html)[0]
-		for datapoint in reversed(in_file['datapoints']):
-			if datapoint[0] != 'NaN':
-				storage_dict[entry_dict[info]] = datapoint[0] / 1024.
+                in_file = graphs.next()
+                if not in_file:
+                    continue
+                value = latest_value(in_file[0]['datapoints'])
+                if value is not None:
+                    storage_dict[entry_dict[info]] = value / 1024.
 	    # Add a zero by hand to the dictionary if all values in json file are 'NaN'.
 	    for value in entry_dict.itervalues():
 		if value in storage_dict.keys():
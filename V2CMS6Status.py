@@ -17,9 +17,22 @@
 import hf
 from sqlalchemy import *
 import json
-from operator import add
 import ast
 from math import ceil
+from itertools import izip
+
+
+# Function to convert seconds to readable time format
+def seconds_to_time(seconds):
+    try:
+        sec = int(seconds)
+        m, s = divmod(sec, 60)
+        h, m = divmod(m, 60)
+        return "%d:%02d:%02d" % (h, m, s)
+    except ValueError:
+        return "Undefined"
+    except OverflowError:
+        return "Undefined"
 
 
 class V2CMS6Status(hf.module.ModuleBase):
@@ -98,7 +111,7 @@ class V2CMS6Status(hf.module.ModuleBase):
         self.source_url = self.source.getSourceUrl()  # Get URL
         # Set up Container for subtable data
         self.statistics_db_value_list = []
-        self.jobs_db_value_list = []
+        self.jobs = ([], [], [], [], [], [], [])
 
     def extractData(self):
         import matplotlib.pyplot as plt
@@ -122,18 +135,6 @@ class V2CMS6Status(hf.module.ModuleBase):
             7   	Suspended
             '''
         status_codes = [2, 3, 4, 5, 6, 7]
-        # Function to convert seconds to readable time format
-
-        def seconds_to_time(seconds):
-            try:
-                sec = int(seconds)
-                m, s = divmod(sec, 60)
-                h, m = divmod(m, 60)
-                return "%d:%02d:%02d" % (h, m, s)
-            except ValueError:
-                return "Undefined"
-            except OverflowError:
-                return "Undefined"
         # open file
         with open(path, 'r') as f:
             content = f.read()
@@ -147,121 +148,114 @@ class V2CMS6Status(hf.module.ModuleBase):
         services = json.loads(content_fixed)  # load JSON
         job_id_list = list(services.keys())  # list of jobs
         current_time = int(services[job_id_list[0]]['time'])  # get time from condor
-        # create lists with all neeeded values
-        status_list = list(int(services[id]['Status'])for id in job_id_list)
-        ram_list = list(services[id]['RAM']for id in job_id_list)
-        cpu1_list = list(services[id]['Cpu_1']for id in job_id_list)
-        cpu2_list = list(services[id]['Cpu_2']for id in job_id_list)
-        core_list = list(int(services[id]["RequestedCPUs"])
-                         for id in job_id_list)
-        user_list = list(services[id]['User'] for id in job_id_list)
-        qdate_list = list(services[id]['QueueDate'] for id in job_id_list)
-        host_list = list(services[id]['HostName'] for id in job_id_list)
-        jobstart_list = list(services[id]['JobStartDate']for id in job_id_list)
-        current_jobstart_list = list(services[id]['JobCurrentStartDate']for id in job_id_list)
-        remote_list = list(services[id]['Remote_Job'] for id in job_id_list)
-        walltime_list_raw = list(
-            services[id]['RequestWalltime'] for id in job_id_list)
+        # walk once over all jobs, users and sites are mapped to integer codes
+        # and the numeric values are collected in columns, NaN if undefined
+        def number(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return np.nan
+
+        sites = self.sites
+        host_sites = {}
+
+        def site_of(host):
+            # shorten the host name to the first site it belongs to
+            if host not in host_sites:
+                host_sites[host] = host
+                if host != "undefined":
+                    for site in sites:
+                        if site in host:
+                            host_sites[host] = "ekpsg" if site == "ekpsm" else site
+                            break
+            return host_sites[host]
+
+        user_index = {}
+        plot_names = []
+        user_sites = []
+        user_codes = []
+        user_list = []
+        status_list = []
         last_status_list = []
-        walltime_list = []
-        for job in job_id_list:
+        ram_list = []
+        host_list = []
+        columns = dict((name, []) for name in (
+            'cpu', 'cores', 'ram', 'walltime', 'qdate', 'jobstart', 'current_jobstart'))
+        remote_count = 0
+        for id in job_id_list:
+            job = services[id]
+            user = job['User']
+            k = user_index.get(user)
+            if k is None:
+                k = user_index[user] = len(plot_names)
+                plot_names.append(user)
+                user_sites.append(set())
+            user_codes.append(k)
+            user_list.append(user)
+            status_list.append(int(job['Status']))
             try:
-                last_status_list.append(int(services[job]['LastJobStatus']))
+                last_status_list.append(int(job['LastJobStatus']))
             except KeyError:
                 last_status_list.append(0)
-            # convert walltime into readable time format
-            walltime_list.append(seconds_to_time(services[job]['RequestWalltime']))
-
-        # calculate runtime from cpu_1 and cpu_2
-        cpu_time_list = map(add, map(float, cpu1_list), map(
-            float, cpu2_list))  # total cpu_time is cpu1+cpu2
+            # total cpu_time is cpu1+cpu2
+            columns['cpu'].append(float(job['Cpu_1']) + float(job['Cpu_2']))
+            columns['cores'].append(int(job["RequestedCPUs"]))
+            ram = number(job['RAM']) / (1024 * 1024)
+            columns['ram'].append(ram)
+            ram_list.append(job['RAM'] if np.isnan(ram) else round(ram, 2))
+            columns['walltime'].append(number(job['RequestWalltime']))
+            columns['qdate'].append(number(job['QueueDate']))
+            columns['jobstart'].append(number(job['JobStartDate']))
+            columns['current_jobstart'].append(number(job['JobCurrentStartDate']))
+            site = site_of(job['HostName'])
+            host_list.append(site)
+            if site != 'undefined':
+                user_sites[k].add(site)
+            if job['Remote_Job'] == "true":
+                remote_count += 1
+        columns = dict((name, np.array(values, dtype=float)) for name, values in columns.iteritems())
+        user_codes = np.array(user_codes, dtype=int)
+        status = np.array(status_list, dtype=int)
+        last_status = np.array(last_status_list, dtype=int)
         job_count = len(job_id_list)
-        plot_names = list(set(user_list))  # Create Array with unique Usernames
-        # initiate arrays for plot and subtable
-        plot_status = {
-            "queued": np.zeros(len(plot_names)),
-            "idle": np.zeros(len(plot_names)),
-            2: np.zeros(len(plot_names)),
-            3: np.zeros(len(plot_names)),
-            4: np.zeros(len(plot_names)),
-            5: np.zeros(len(plot_names)),
-            6: np.zeros(len(plot_names)),
-            7: np.zeros(len(plot_names)),
-        }
-        plot_cores = np.zeros(len(plot_names))
-        plot_ram = np.zeros(len(plot_names))
-        plot_efficiency = np.zeros(len(plot_names))
-        plot_efficiency_count = np.zeros(len(plot_names))
-        plot_sites = [''] * len(plot_names)
-        plot_walltime = np.zeros(len(plot_names))
-        efficiency_list = []
-        qtime_list = []
-        sites = self.sites
+        running = status == 2
+
+        def per_user(weights=None, mask=None):
+            # grouped sum over all jobs (or the masked jobs) of each user
+            codes = user_codes if mask is None else user_codes[mask]
+            if weights is not None:
+                weights = np.nan_to_num(weights if mask is None else weights[mask])
+            return np.bincount(codes, weights=weights, minlength=len(plot_names))
+
         ###################
         #   Calculations  #
         ###################
-        # Calculation of the efficiency and time in Queue per job
-        for i in xrange(job_count):
-            # calculate how much cores are used by running jobs
-            if status_list[i] != 2:
-                core_list[i] = 0
-            # calculate the efficiency per job
-            try:
-                efficiency_list.append(
-                    round(float(cpu_time_list[i]) / float(current_time - int(current_jobstart_list[i])), 3))
-            except (ZeroDivisionError, ValueError):
-                efficiency_list.append("Undefined")
-            # calculate the qtime per job
-            try:
-                qtime_list.append(int(jobstart_list[i]) - int(qdate_list[i]))
-            except ValueError:
-                qtime_list.append("Undefined")
-        for k in xrange(len(host_list)):  # shorten host_list to site name only
-            if host_list[k] != "undefined":
-                for i in xrange(len(sites)):
-                    if sites[i] in host_list[k] and sites[i] != "ekpsm":
-                        host_list[k] = sites[i]
-                    elif "ekpsm" in host_list[k]:
-                        host_list[k] = "ekpsg"
-        sites.remove("ekpsm")
-        for i in xrange(job_count):
-            try:  # fix RAM - List so only values
-                ram_list[i] = round(float(ram_list[i]) / (1024 * 1024), 2)
-            except ValueError:
-                pass
-            # generate the array used in plot later to show data per user
-            for k in xrange(len(plot_names)):  # sort jobs via user to get data for plot
-                if user_list[i] == plot_names[k]:
-                    for status in status_codes:
-                        if status_list[i] == status:
-                            plot_status[status][k] += 1
-                    if status_list[i] == 1 and last_status_list[i] == 2:
-                        plot_status["idle"][k] += 1
-                    elif status_list[i] == 1 and last_status_list[i] == 0:
-                        plot_status["queued"][k] += 1
-                    plot_cores[k] += core_list[i]  # cores per user
-                    if ram_list[i] != 'undefined':  # ram per user
-                        plot_ram[k] += ram_list[i]
-                    if efficiency_list[i] != 'Undefined' and efficiency_list[i] < 2:  # eff per user
-                        # routed jobs are restarting, though it takes some time for condor to update the cpu time value. Therefore the efficiency could
-                        # be higher than 2, so these are excluded until thier efficiency is calculated correctly
-                        plot_efficiency[k] += efficiency_list[i]
-                        plot_efficiency_count[k] += 1
-                    if host_list[i] not in plot_sites[k] and host_list[i] != 'undefined':
-                        if plot_sites[k] == '':  # sites used per user
-                            plot_sites[k] = host_list[i]
-                        else:
-                            plot_sites[k] += ", " + host_list[i]
-                    try:
-                        plot_walltime[k] += int(walltime_list_raw[i])
-                    except ValueError:
-                        pass
-        for k in xrange(len(plot_names)):
-            if plot_sites[k] == "":
-                plot_sites[k] = "No running jobs"
-            avg = plot_walltime[k] / (plot_status["queued"][k] + plot_status["idle"][k] + plot_status[
-                                      2][k] + plot_status[3][k] + plot_status[4][k] + plot_status[5][k] + plot_status[7][k])
-            plot_walltime[k] = avg
+        # jobs per user and status, idle jobs were running before
+        plot_status = {
+            "queued": per_user(mask=(status == 1) & (last_status == 0)),
+            "idle": per_user(mask=(status == 1) & (last_status == 2)),
+        }
+        for code in status_codes:
+            plot_status[code] = per_user(mask=status == code)
+        # cores are only used by running jobs
+        plot_cores = per_user(columns['cores'], running)
+        plot_ram = per_user(columns['ram'])
+        # efficiency and time in queue per job
+        with np.errstate(divide='ignore', invalid='ignore'):
+            efficiency = np.round(columns['cpu'] / (current_time - columns['current_jobstart']), 3)
+        has_efficiency = np.isfinite(efficiency)
+        # routed jobs are restarting, though it takes some time for condor to update the cpu time value. Therefore the efficiency could
+        # be higher than 2, so these are excluded until thier efficiency is calculated correctly
+        user_efficiency = has_efficiency & (efficiency < 2)
+        plot_efficiency = per_user(efficiency, user_efficiency)
+        plot_efficiency_count = per_user(mask=user_efficiency)
+        qtime = columns['jobstart'] - columns['qdate']
+        qtime = qtime[np.isfinite(qtime)]
+        # average requested walltime of the jobs per user
+        walltime_jobs = plot_status["queued"] + plot_status["idle"] + plot_status[2] + plot_status[3] + \
+            plot_status[4] + plot_status[5] + plot_status[7]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            plot_walltime = per_user(columns['walltime']) / walltime_jobs
         # fill subtable statistics
         for i in xrange(len(plot_names)):
             if plot_walltime[i] == 0.0:
@@ -271,11 +265,7 @@ class V2CMS6Status(hf.module.ModuleBase):
             if plot_efficiency_count[i] == 0.0:  # Calculation of efficiency
                 eff = 0.0
             else:
-                try:
-                    eff = round(
-                        float(plot_efficiency[i]) / plot_efficiency_count[i], 2)
-                except (ZeroDivisionError, ValueError):
-                    eff = 0.0
+                eff = round(float(plot_efficiency[i]) / plot_efficiency_count[i], 2)
             details_data = {
                 'user':      plot_names[i],
                 'queued':    int(plot_status["queued"][i]),
@@ -286,22 +276,13 @@ class V2CMS6Status(hf.module.ModuleBase):
                 'held':      int(plot_status[5][i]),
                 'suspended': int(plot_status[7][i]),
                 'core':      int(plot_cores[i]),
-                'sites':     plot_sites[i],
+                'sites':     ", ".join(sorted(user_sites[i])) or "No running jobs",
                 'walltime':  walltime,
                 'ram':       round(plot_ram[i], 1),
                 'efficiency': eff}
             self.statistics_db_value_list.append(details_data)
-        # fill subtable jobs
-        for i in xrange(job_count):
-            details_data = {
-                'jobid':  job_id_list[i],
-                'cpu':    seconds_to_time(cpu_time_list[i]),
-                'ram':    ram_list[i],
-                'status': status_list[i],
-                'user':   user_list[i],
-                'requestwalltime': walltime_list[i],
-                'host':   host_list[i]}
-            self.jobs_db_value_list.append(details_data)
+        # the rows of subtable jobs are only generated in fillSubtables
+        self.jobs = (job_id_list, columns['cpu'], ram_list, status_list, user_list, columns['walltime'], host_list)
 
         ###############
         # Make   plot #
@@ -402,15 +383,12 @@ class V2CMS6Status(hf.module.ModuleBase):
             loc=6, bbox_to_anchor=(0.8, 0.88), borderaxespad=0., prop=fontLeg)
 
         # plot the walltime over requested walltime
-        runtime_list = []
-        walltime_list_2 = []
-        for i in xrange(job_count):
-            try:
-                runtime_list.append((current_time - int(current_jobstart_list[i]))/(60*60))
-                walltime_list_2.append(int(walltime_list_raw[i])/(60*60))
-            except (ZeroDivisionError, ValueError, TypeError):
-                pass
-        limit = ceil(max(max(walltime_list_2), max(runtime_list)))
+        runtime_hours = (current_time - columns['current_jobstart']) // (60*60)
+        walltime_hours = columns['walltime'] // (60*60)
+        has_runtime = np.isfinite(runtime_hours) & np.isfinite(walltime_hours)
+        runtime_list = runtime_hours[has_runtime]
+        walltime_list_2 = walltime_hours[has_runtime]
+        limit = ceil(max(walltime_list_2.max(), runtime_list.max())) if has_runtime.any() else 1
         bins = [np.arange(0.0, limit+0.1, 1), np.arange(0.0, limit+0.1, 1)]
         # axis_2.scatter(walltime_list_2, runtime_list)
         H, xedges, yedges = np.histogram2d(walltime_list_2, runtime_list, bins=bins)
@@ -433,37 +411,21 @@ class V2CMS6Status(hf.module.ModuleBase):
         # save data as Output
         fig.savefig(hf.downloadService.getArchivePath(
             self.run, self.instance_name + "_jobs2.png"), dpi=91)
+        plt.close(fig)
         data["filename_plot"] = self.instance_name + "_jobs2.png"
-        # remove Undefined efficiencys from list to calc mean efficiency
-        while "Undefined" in efficiency_list:
-            efficiency_list.remove("Undefined")
-        try:
-            eff_count = round(
-                float(sum(efficiency_list) / len(efficiency_list)), 2)
-        except ZeroDivisionError:
+        # mean efficiency of the jobs with a defined efficiency
+        if has_efficiency.any():
+            eff_count = round(float(efficiency[has_efficiency].mean()), 2)
+        else:
             eff_count = 0.0
         data['efficiency'] = eff_count
-        # fix RAM - List so only values
-        for ram in ram_list:
-            try:
-                ram = float(ram)
-            except ValueError:
-                ram = 0
-        data['ram'] = round(sum(ram_list), 2)
-        while "Undefined" in qtime_list:  # filter undefined qtime values from qtime list
-            qtime_list.remove("Undefined")
-        try:
-            qtime_count = int(
-                round(float(sum(qtime_list)) / len(qtime_list), 0))
-        except ZeroDivisionError:
-            qtime_count = 0
-        except ValueError:
-            qtime_count = 0
+        data['ram'] = round(float(np.nansum(columns['ram'])), 2)
+        qtime_count = int(round(qtime.mean(), 0)) if len(qtime) else 0
         data['qtime'] = seconds_to_time(qtime_count)
-        data['cores'] = sum(core_list)
-        data['running_jobs'] = sum(plot_status[2])
-        data['queued_jobs'] = sum(plot_status["queued"])
-        data['remote'] = remote_list.count("true")
+        data['cores'] = int(plot_cores.sum())
+        data['running_jobs'] = int(plot_status[2].sum())
+        data['queued_jobs'] = int(plot_status["queued"].sum())
+        data['remote'] = remote_count
         #########################
         # calculation of Status #
         #########################
@@ -471,10 +433,9 @@ class V2CMS6Status(hf.module.ModuleBase):
             data['status'] = 0.5
             data['error_msg'] = "Only " + str(job_count) + " jobs running."
         else:
-            temp = 0
-            for i in xrange(job_count):
-                if status_list[i] == 1 and int(current_time) - int(qdate_list[i]) > (self.qtime_max * 60 * 60):
-                    temp += 1
+            with np.errstate(invalid='ignore'):
+                temp = int(np.count_nonzero((status == 1) &
+                                            (current_time - columns['qdate'] > self.qtime_max * 60 * 60)))
             if temp > self.qtime_max_jobs:
                 data['status'] = 0.5
                 data['error_msg'] = data['error_msg'] + \
@@ -485,14 +446,12 @@ class V2CMS6Status(hf.module.ModuleBase):
                 data['error_msg'] = data['error_msg'] + \
                     " The efficiency is below " + \
                     str(self.min_efficiency) + ".<br>"
-            try:
-                if float(status_list.count(2)) / float(status_list.count(1)) < self.running_idle_ratio:
-                    data['status'] = 0.5
-                    data['error_msg'] = data['error_msg'] + \
-                        "The ratio between queued and running jobs is below " + \
-                        str(self.running_idle_ratio) + ". <br>"
-            except ZeroDivisionError:
-                pass
+            idle_count = np.count_nonzero(status == 1)
+            if idle_count and float(np.count_nonzero(running)) / idle_count < self.running_idle_ratio:
+                data['status'] = 0.5
+                data['error_msg'] = data['error_msg'] + \
+                    "The ratio between queued and running jobs is below " + \
+                    str(self.running_idle_ratio) + ". <br>"
         print data
         return data
 
@@ -500,8 +459,20 @@ class V2CMS6Status(hf.module.ModuleBase):
     def fillSubtables(self, parent_id):
         self.subtables['statistics'].insert().execute(
             [dict(parent_id=parent_id, **row) for row in self.statistics_db_value_list])
-        self.subtables['jobs'].insert().execute(
-            [dict(parent_id=parent_id, **row) for row in self.jobs_db_value_list])
+        self.subtables['jobs'].insert().execute(list(self.job_rows(parent_id)))
+
+    def job_rows(self, parent_id):
+        ''' generate the rows of subtable jobs from the job columns '''
+        for jobid, cpu, ram, status, user, walltime, host in izip(*self.jobs):
+            yield {
+                'parent_id': parent_id,
+                'jobid':  jobid,
+                'cpu':    seconds_to_time(cpu),
+                'ram':    ram,
+                'status': status,
+                'user':   user,
+                'requestwalltime': seconds_to_time(walltime),
+                'host':   host}
 
     # Making Subtable Data available to the html-output
     def getTemplateData(self):
@@ -135,6 +135,7 @@ class XRootD(hf.module.ModuleBase):
         ax2.set_ylabel('Average transfer rate per file (MB/s)', color='r')
         fig.savefig(hf.downloadService.getArchivePath(
             self.run, self.instance_name + '_xrootd.png'), dpi=60)
+        plt.close(fig)
         data['filename_plot'] = self.instance_name + '_xrootd.png'
         
         return data
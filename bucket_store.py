@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Small on-disk store for rolling aggregates of modules that only want to
+fetch the data that is new since their last run.
+
+The store keeps a watermark per source (e.g. per schedd) and a set of
+time buckets holding arbitrary JSON-serializable aggregates. Buckets that
+fall out of the evaluation window are dropped when the store is expired.
+Without a path the store only lives in memory, so a module can use the
+same code path with and without persistence.
+"""
+
+import os
+import json
+import time
+import logging
+
+
+class BucketStore(object):
+
+    def __init__(self, path, window, bucket_width=3600):
+        self.path = path
+        self.window = int(window)
+        self.bucket_width = int(bucket_width)
+        self.logger = logging.getLogger(__name__)
+        self.watermarks = {}
+        self._buckets = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    content = json.load(f)
+                if content.get('window') == self.window and content.get('bucket_width') == self.bucket_width:
+                    self.watermarks = content['watermarks']
+                    self._buckets = dict((int(start), bucket) for start, bucket in content['buckets'].iteritems())
+                else:
+                    self.logger.warning("Layout of %s changed, starting with an empty store" % path)
+            except (IOError, ValueError, KeyError), e:
+                self.logger.error("Could not read %s, starting with an empty store: %s" % (path, e))
+
+    @property
+    def persistent(self):
+        return bool(self.path)
+
+    def window_start(self, now=None):
+        return int(now if now is not None else time.time()) - self.window
+
+    def watermark(self, source, default=None):
+        return self.watermarks.get(source, default)
+
+    def set_watermark(self, source, value):
+        self.watermarks[source] = value
+
+    def bucket(self, timestamp):
+        """Aggregate dict of the bucket timestamp falls into, created on first use."""
+        start = int(timestamp) // self.bucket_width * self.bucket_width
+        return self._buckets.setdefault(start, {})
+
+    def buckets(self):
+        """List of (bucket start, aggregate dict) sorted by time."""
+        return sorted(self._buckets.iteritems())
+
+    def expire(self, now=None):
+        """Drop all buckets that ended before the evaluation window."""
+        window_start = self.window_start(now)
+        for start in [start for start in self._buckets if start + self.bucket_width <= window_start]:
+            del self._buckets[start]
+
+    def save(self):
+        if not self.persistent:
+            return
+        content = {
+            'window': self.window,
+            'bucket_width': self.bucket_width,
+            'watermarks': self.watermarks,
+            'buckets': dict((str(start), bucket) for start, bucket in self._buckets.iteritems())
+        }
+        # write to a temporary file first, so an interrupted run never
+        # leaves a truncated store behind
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f, separators=(',', ':'))
+        os.rename(tmp_path, self.path)
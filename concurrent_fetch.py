@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Bounded-concurrency HTTP fetching for modules that need many small
+requests per run (one request per dataset, per test, per metric, ...).
+
+A FetchPool distributes the requests over a fixed number of worker
+threads, limits the number of open connections per host, keeps the
+connections alive between requests to the same host and stops issuing
+new requests once the global deadline is reached. A run then takes
+roughly the time of the slowest requests instead of the sum of all.
+"""
+
+import httplib
+import urlparse
+import threading
+import Queue
+import socket
+import base64
+import time
+import logging
+
+
+class FetchResult(object):
+    """Outcome of a single request. Either data or error is set."""
+
+    def __init__(self, url, data=None, error=None, elapsed=0.0):
+        self.url = url
+        self.data = data
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<FetchResult %s %s>' % (self.url, 'ok' if self.ok else self.error)
+
+
+class FetchPool(object):
+    """
+    Fetch a list of URLs concurrently.
+
+    workers    number of worker threads
+    per_host   maximum number of simultaneous connections to one host
+    timeout    socket timeout of a single request in seconds
+    deadline   seconds after which no new request is started (None: no limit)
+    headers    extra headers sent with every request
+    auth       optional (username, password) tuple for HTTP basic auth
+    """
+
+    def __init__(self, workers=8, per_host=4, timeout=10, deadline=None, headers=None, auth=None):
+        self.workers = max(1, int(workers))
+        self.per_host = max(1, int(per_host))
+        self.timeout = float(timeout)
+        self.deadline = float(deadline) if deadline else None
+        self.headers = dict(headers or {})
+        if auth is not None:
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode('%s:%s' % auth)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self.requests = 0
+        self.connections = 0
+
+    def _host_key(self, url):
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        return (parts.scheme, parts.hostname, parts.port), path
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.per_host)
+                self._idle[key] = []
+            return self._slots[key]
+
+    def _checkout(self, key, timeout):
+        with self._lock:
+            idle = self._idle[key]
+            conn = idle.pop() if idle else None
+        if conn is None:
+            scheme, host, port = key
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+            else:
+                conn = httplib.HTTPConnection(host, port, timeout=timeout)
+            with self._lock:
+                self.connections += 1
+            return conn, False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            self._idle[key].append(conn)
+
+    def _request(self, url, handler, timeout):
+        key, path = self._host_key(url)
+        slot = self._slot(key)
+        slot.acquire()
+        try:
+            conn, reused = self._checkout(key, timeout)
+            try:
+                response = self._send(conn, path)
+            except socket.timeout:
+                # the server is slow, not gone, a retry would only double
+                # the time until the caller sees the timeout
+                conn.close()
+                raise
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+                # a kept-alive connection may have been closed by the server
+                # in the meantime, retry exactly once on a fresh one
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = self._checkout(key, timeout)
+                response = self._send(conn, path)
+            try:
+                if response.status >= 400:
+                    raise IOError('HTTP error %d %s' % (response.status, response.reason))
+                data = handler(response) if handler is not None else response.read()
+                # drain whatever the handler left so the connection can be reused
+                response.read()
+            except:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return data
+        finally:
+            slot.release()
+
+    def _send(self, conn, path):
+        conn.request('GET', path, headers=self.headers)
+        with self._lock:
+            self.requests += 1
+        return conn.getresponse()
+
+    def _worker(self, queue, results, stop_at):
+        while True:
+            try:
+                url, handler = queue.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            timeout = self.timeout
+            if stop_at is not None:
+                timeout = min(timeout, stop_at - start)
+            if timeout <= 0:
+                results[url] = FetchResult(url, error='deadline exceeded')
+                continue
+            try:
+                data = self._request(url, handler, timeout)
+                results[url] = FetchResult(url, data=data, elapsed=time.time() - start)
+            except socket.timeout:
+                results[url] = FetchResult(url, error='timeout', elapsed=time.time() - start)
+            except Exception, e:
+                results[url] = FetchResult(url, error='%s: %s' % (type(e).__name__, e),
+                                           elapsed=time.time() - start)
+
+    def fetch(self, urls, handler=None):
+        """
+        Fetch all urls and return a dict url -> FetchResult.
+
+        handler is called with the open response of every successful
+        request and its return value is stored as FetchResult.data; by
+        default the whole body is read. Duplicate urls are fetched once.
+        """
+        queue = Queue.Queue()
+        results = {}
+        for url in urls:
+            if url not in results:
+                results[url] = None
+                queue.put((url, handler))
+        stop_at = time.time() + self.deadline if self.deadline is not None else None
+        threads = []
+        for i in xrange(min(self.workers, queue.qsize())):
+            thread = threading.Thread(target=self._worker, args=(queue, results, stop_at))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.itervalues():
+                for conn in idle:
+                    conn.close()
+                del idle[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
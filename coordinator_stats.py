@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Incremental retrieval of the statistics collections of the cache
+coordinator (coordinator/stats/<collection>).
+
+Every collection has a watermark in a BucketStore: the time of the newest
+record seen so far and the number of records seen with exactly that time.
+A run only asks for records from the watermark on and hands the records
+that were not seen before to the caller, which folds them into the
+buckets of the store. Records older than the window of the store are
+never returned.
+"""
+
+import json
+import socket
+import urllib
+import urllib2
+
+
+def fetch_new_records(store, url, collection, fields, time_field, since_parameter='', timeout=30, now=None):
+    """
+    Records of collection that are newer than the watermark of the store,
+    as lists of values in the order of fields, sorted by time_field.
+
+    since_parameter is the query parameter of the coordinator restricting
+    the records to a minimum time; without it the whole collection is
+    downloaded and filtered locally. The watermark is advanced, saving the
+    store is left to the caller. Raises IOError if the coordinator cannot
+    be reached or answers with invalid data.
+    """
+    window_start = store.window_start(now)
+    watermark = store.watermark(collection, {"time": window_start, "seen": 0})
+    if watermark["time"] < window_start:
+        watermark = {"time": window_start, "seen": 0}
+
+    query = [("fields", field) for field in fields]
+    if since_parameter:
+        query.append((since_parameter, int(watermark["time"])))
+    try:
+        response = urllib2.urlopen(url + collection + "?" + urllib.urlencode(query), timeout=timeout)
+        records = json.load(response)
+    except (urllib2.URLError, socket.timeout, socket.error), e:
+        raise IOError("Could not read %s from the coordinator: %r" % (collection, e))
+    except ValueError, e:
+        raise IOError("Invalid %s data from the coordinator: %r" % (collection, e))
+
+    index = fields.index(time_field)
+    records = sorted((record for record in records if record[index] >= watermark["time"]),
+                     key=lambda record: record[index])
+    # records with exactly the watermark time were partly seen in the last run
+    skip = watermark["seen"]
+    new_records = []
+    for record in records:
+        if record[index] == watermark["time"] and skip > 0:
+            skip -= 1
+            continue
+        new_records.append(record)
+    if new_records:
+        newest = new_records[-1][index]
+        seen = sum(1 for record in records if record[index] == newest)
+        watermark = {"time": newest, "seen": seen}
+    store.set_watermark(collection, watermark)
+    return new_records
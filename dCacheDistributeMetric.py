@@ -17,6 +17,9 @@
 import hf
 from sqlalchemy import TEXT, INT, FLOAT, Column
 from lxml.html import parse
+import time
+from plot_service import PlotService
+from plot_cache import plot_digest
 
 class dCacheDistributeMetric(hf.module.ModuleBase):
     config_keys = {
@@ -67,6 +70,7 @@ class dCacheDistributeMetric(hf.module.ModuleBase):
         return ylist
 
     def prepareAcquisition(self):
+        PlotService.instance()
         self.lower_variance_limit = self.config['lower_variance_limit']
         self.upper_variance_limit = self.config['upper_variance_limit']
         self.pool_source_url = self.config['pool_source_xml']
@@ -117,25 +121,31 @@ class dCacheDistributeMetric(hf.module.ModuleBase):
                 single_xlist.append(float(number))
         srtd_xlist = sorted(single_xlist + [1e5])
 
-        #plotting
-        import matplotlib.pyplot as plt
-        self.plt = plt
-        fig = self.plt.figure()
-        axis = fig.add_subplot(111)
-        axis.fill_between(srtd_xlist, self.lowfunc(srtd_xlist, data['num_pools']), self.topfunc(srtd_xlist), alpha=0.2, color='green')
-        axis.plot(srtd_xlist, self.lowfunc(srtd_xlist, data['num_pools']), 'g-', label="optimal")
-        axis.plot(srtd_xlist, self.topfunc(srtd_xlist), '-', color='red', label="warning")
-        axis.axhline(0.997, color="DarkRed")  # 0.997 instead of 1.0 to make it visible below 1.0 axis limit
-        axis.plot(xlist, ylist, 'bx')
-        axis.set_ylabel('Imbalance Metric $m$')
-        axis.set_xlabel('Number of Files')
-        axis.set_title('Distribute Imbalance Metric')
-        axis.set_xscale('log')
-        axis.set_ylim(0, 1.0)
-        axis.text(25, 0.9, r"$m(ds) = \sqrt{\sum_{p=0..N_\mathrm{pools}} "\
-            r"\left( \frac{size(ds,p)}{size(ds)} - \frac{size(p)}{size(all\, pools)} \right)^2 }$")
-        fig.savefig(hf.downloadService.getArchivePath(
-            self.run, self.instance_name + '_dist_metric.png'), dpi=100)
+        #plotting, the plot only changes with the distribution file
+        path = hf.downloadService.getArchivePath(self.run, self.instance_name + '_dist_metric.png')
+        cache = PlotService.instance().cache_for_run(self.run)
+        digest = plot_digest('dCacheDistributeMetric', xlist, ylist, data['num_pools'])
+        if not cache.fetch(digest, path):
+            start = time.time()
+            import matplotlib.pyplot as plt
+            self.plt = plt
+            fig = self.plt.figure()
+            axis = fig.add_subplot(111)
+            axis.fill_between(srtd_xlist, self.lowfunc(srtd_xlist, data['num_pools']), self.topfunc(srtd_xlist), alpha=0.2, color='green')
+            axis.plot(srtd_xlist, self.lowfunc(srtd_xlist, data['num_pools']), 'g-', label="optimal")
+            axis.plot(srtd_xlist, self.topfunc(srtd_xlist), '-', color='red', label="warning")
+            axis.axhline(0.997, color="DarkRed")  # 0.997 instead of 1.0 to make it visible below 1.0 axis limit
+            axis.plot(xlist, ylist, 'bx')
+            axis.set_ylabel('Imbalance Metric $m$')
+            axis.set_xlabel('Number of Files')
+            axis.set_title('Distribute Imbalance Metric')
+            axis.set_xscale('log')
+            axis.set_ylim(0, 1.0)
+            axis.text(25, 0.9, r"$m(ds) = \sqrt{\sum_{p=0..N_\mathrm{pools}} "\
+                r"\left( \frac{size(ds,p)}{size(ds)} - \frac{size(p)}{size(all\, pools)} \right)^2 }$")
+            fig.savefig(path, dpi=100)
+            self.plt.close(fig)
+            cache.store(digest, path, time.time() - start)
         data['filename_plot'] = self.instance_name + '_dist_metric.png'
 
         return data
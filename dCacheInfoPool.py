@@ -17,9 +17,12 @@
 import hf
 from sqlalchemy import TEXT, INT, FLOAT, Column
 from lxml.html import parse
+from parse_cache import ParseCache
 from string import strip
 from string import replace
-import parser
+from dcache_special import parse_specials, compile_specials, evaluate_specials, join_values, \
+    column_expression
+from template_cache import cached_template_data
 
 class dCacheInfoPool(hf.module.ModuleBase):
     config_keys = {
@@ -52,6 +55,7 @@ class dCacheInfoPool(hf.module.ModuleBase):
         Column('removable', INT),
         Column('special_overview', TEXT),
         Column('special_details', TEXT),
+        Column('special_overview_values', TEXT),
         Column('unit', TEXT),
     ], []
 
@@ -63,6 +67,7 @@ class dCacheInfoPool(hf.module.ModuleBase):
             Column('precious', FLOAT),
             Column('removable', FLOAT),
             Column('status', FLOAT),
+            Column('special_values', TEXT),
         ], []),
     }
 
@@ -105,7 +110,7 @@ class dCacheInfoPool(hf.module.ModuleBase):
         data['special_overview'] = self.special_overview
         data['special_details'] = self.special_details
 
-        source_tree = parse(open(self.source_xml.getTmpPath()))
+        source_tree = ParseCache.for_run(self.run).parse(self.source_xml, parse)
         root = source_tree.getroot()
         #take first tbody as table body with the information
         root = root.findall('.//tbody')[0]
@@ -151,6 +156,15 @@ class dCacheInfoPool(hf.module.ModuleBase):
             else:
                 pool['status'] = 1.0
 
+        # evaluate the special lines and columns once, pages only show them
+        special_overview = compile_specials(parse_specials(self.special_overview) or [])
+        special_details = compile_specials(parse_specials(self.special_details) or [])
+        data['special_overview_values'] = join_values(evaluate_specials(special_overview, \
+            data['total'], data['free'], data['precious'], data['removable'], value_error='matherror'))
+        for pool in self.details_db_value_list:
+            pool['special_values'] = join_values(evaluate_specials(special_details, \
+                pool['total'], pool['free'], pool['precious'], pool['removable'], '%0.2f', 'valueerror'))
+
         if (data['free'] + data['removable']) / data['total'] <= self.global_critical_ratio or \
             data['crit_pools'] > self.global_critical_poolcriticals or \
             data['warn_pools'] > self.global_critical_poolwarnings:
@@ -165,34 +179,19 @@ class dCacheInfoPool(hf.module.ModuleBase):
     def fillSubtables(self, parent_id):
         self.subtables['details'].insert().execute([dict(parent_id=parent_id, **row) for row in self.details_db_value_list])
 
+    @cached_template_data()
     def getTemplateData(self):
         data = hf.module.ModuleBase.getTemplateData(self)
+        data['overview'], data['details'] = self.renderModel()
+        return data
 
+    def renderModel(self):
+        """Overview and details table of the current dataset."""
         details_list = self.subtables['details'].select().where(self.subtables['details'].c.parent_id==self.dataset['id']).execute().fetchall()
         details_list = map(dict, details_list)
 
-        try:
-            special_overview = self.dataset['special_overview'].split(',')
-        except AttributeError:
-            special_overview = []
-        try:
-            special_details = self.dataset['special_details'].split(',')
-        except AttributeError:
-            special_details = []
-
-        for i,special in enumerate(special_overview):
-            if '=' in special:
-                special_overview[i] = special.split('=')
-                special_overview[i][1] = parser.expr(special_overview[i][1]).compile()
-            else:
-                special_overview = None
-
-        for i,special in enumerate(special_details):
-            if '=' in special:
-                special_details[i] = special.split('=')
-                special_details[i].append(parser.expr(special_details[i][1]).compile())
-            else:
-                special_details = None
+        special_overview = parse_specials(self.dataset['special_overview'])
+        special_details = parse_specials(self.dataset['special_details'])
 
         overview_list = []
         t = self.dataset['total']
@@ -211,13 +210,14 @@ class dCacheInfoPool(hf.module.ModuleBase):
         overview_list.append(['Removable Space [' + self.dataset['unit'] + ']', '%.2f' % r])
 
         if special_overview is not None:
-            for i,special in enumerate(special_overview):
-                try:
-                    overview_list.append([special[0], eval(special[1])])
-                except ValueError:
-                    overview_list.append([special[0], 'matherror'])
-                except TypeError:
-                    overview_list.append([special[0], 'typeerror'])
+            values = self.dataset['special_overview_values']
+            if values is not None:
+                values = values.split(',')
+            else:
+                # datasets stored before the values were evaluated in extractData
+                values = evaluate_specials(compile_specials(special_overview), t, f, p, r, value_error='matherror')
+            for special, value in zip(special_overview, values):
+                overview_list.append([special[0], value])
         details_finished_list = []
         help_appending = []
         help_appending.append('none')
@@ -235,11 +235,7 @@ class dCacheInfoPool(hf.module.ModuleBase):
 
         if special_details is not None:
             for i,special in enumerate(special_details):
-                helpstring = str(special[1])
-                helpstring = helpstring.replace('r', 'removable')
-                helpstring = helpstring.replace('t', 'total')
-                helpstring = helpstring.replace('f', 'free')
-                helpstring = helpstring.replace('p', 'precious')
+                helpstring = column_expression(str(special[1]))
                 help_appending.append(str("<input type='checkbox' id='" +self.dataset['instance'] + \
                     "_variable_%i' value="%int(i + 5)) + str(helpstring) + " checked='checked' />" + str(special[0]))
 
@@ -263,15 +259,13 @@ class dCacheInfoPool(hf.module.ModuleBase):
 
         if special_details is not None:
             for i,special in enumerate(special_details):
-                helpstring = special[1]
-                helpstring = helpstring.replace('r', 'removable')
-                helpstring = helpstring.replace('t', 'total')
-                helpstring = helpstring.replace('f', 'free')
-                helpstring = helpstring.replace('p', 'precious')
+                helpstring = column_expression(special[1])
                 help_appending.append(str("<button onfocus='this.blur()' onclick=" +self.dataset['instance'] + \
                     "_col_button('" + helpstring + "')>Plot Col</button>"))
         details_finished_list.append(help_appending)
 
+        # only needed for datasets stored before the values were evaluated in extractData
+        compiled_details = compile_specials(special_details or [])
         for i,pool in enumerate(sorted(details_list, key = lambda p: p['poolname'])):
             help_appending= []
             if pool['status'] == 1.0:
@@ -299,18 +293,12 @@ class dCacheInfoPool(hf.module.ModuleBase):
             help_appending.append(str('%0.2f' % perc))
             help_appending.append(str('%0.2f' % p))
             help_appending.append(str('%0.2f' % r))
-            if special_details is not None:
-                for i,special in enumerate(special_details):
-                    try:
-                        help_appending.append(str('%0.2f' % eval(special[2])))
-                    except ValueError:
-                        help_appending.append('valueerror')
-                    except TypeError:
-                        help_appending.append('typeerror')
+            if special_details:
+                if pool['special_values'] is not None:
+                    help_appending.extend(pool['special_values'].split(','))
+                else:
+                    help_appending.extend(evaluate_specials(compiled_details, t, f, p, r, '%0.2f', 'valueerror'))
 
             details_finished_list.append(help_appending)
 
-        data['details'] = details_finished_list
-        data['overview'] = overview_list
-
-        return data
+        return overview_list, details_finished_list
@@ -17,8 +17,11 @@
 import hf
 from sqlalchemy import TEXT, INT, FLOAT, Column
 from xml.dom import minidom
+from parse_cache import ParseCache
 from string import strip
-import parser
+from dcache_special import parse_specials, compile_specials, evaluate_specials, join_values, \
+    column_expression
+from template_cache import cached_template_data
 
 class dCacheInfoPoolGoe(hf.module.ModuleBase):
     config_keys = {
@@ -51,6 +54,7 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
         Column('removable', INT),
         Column('special_overview', TEXT),
         Column('special_details', TEXT),
+        Column('special_overview_values', TEXT),
         Column('unit', TEXT),
     ], []
 
@@ -62,6 +66,7 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
             Column('precious', FLOAT),
             Column('removable', FLOAT),
             Column('status', FLOAT),
+            Column('special_values', TEXT),
         ], []),
     }
 
@@ -106,7 +111,7 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
         data['special_details'] = self.special_details
 
         # parse xml (old dCache versions, e.g. 1.9)
-        xmldoc = minidom.parse(open(self.source_xml.getTmpPath()))
+        xmldoc = ParseCache.for_run(self.run).parse(self.source_xml, minidom.parse)
         for pool in xmldoc.getElementsByTagName('pool'):
             groups = pool.getElementsByTagName('poolgroups')
             for group in groups:
@@ -162,6 +167,15 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
             else:
                 pool['status'] = 1.0
 
+        # evaluate the special lines and columns once, pages only show them
+        special_overview = compile_specials(parse_specials(self.special_overview) or [])
+        special_details = compile_specials(parse_specials(self.special_details) or [])
+        data['special_overview_values'] = join_values(evaluate_specials(special_overview, \
+            data['total'], data['free'], data['precious'], data['removable'], value_error='matherror'))
+        for pool in self.details_db_value_list:
+            pool['special_values'] = join_values(evaluate_specials(special_details, \
+                pool['total'], pool['free'], pool['precious'], pool['removable'], '%0.2f', 'matherror'))
+
         if (data['free'] + data['removable']) / data['total'] <= self.global_critical_ratio or \
             data['crit_pools'] > self.global_critical_poolcriticals or \
             data['warn_pools'] > self.global_critical_poolwarnings:
@@ -176,34 +190,19 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
     def fillSubtables(self, parent_id):
         self.subtables['details'].insert().execute([dict(parent_id=parent_id, **row) for row in self.details_db_value_list])
 
+    @cached_template_data()
     def getTemplateData(self):
         data = hf.module.ModuleBase.getTemplateData(self)
+        data['overview'], data['details'] = self.renderModel()
+        return data
 
+    def renderModel(self):
+        """Overview and details table of the current dataset."""
         details_list = self.subtables['details'].select().where(self.subtables['details'].c.parent_id==self.dataset['id']).execute().fetchall()
         details_list = map(dict, details_list)
-        
-        try:
-            special_overview = self.dataset['special_overview'].split(',')
-        except AttributeError:
-            special_overview = []
-        try:
-            special_details = self.dataset['special_details'].split(',')
-        except AttributeError:
-            special_details = []
-            
-        for i,special in enumerate(special_overview):
-            if '=' in special:
-                special_overview[i] = special.split('=')
-                special_overview[i][1] = parser.expr(special_overview[i][1]).compile()
-            else:
-                special_overview = None
 
-        for i,special in enumerate(special_details):
-            if '=' in special:
-                special_details[i] = special.split('=')
-                special_details[i].append(parser.expr(special_details[i][1]).compile())
-            else:
-                special_details = None
+        special_overview = parse_specials(self.dataset['special_overview'])
+        special_details = parse_specials(self.dataset['special_details'])
 
         overview_list = []
         t = self.dataset['total']
@@ -222,13 +221,14 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
         overview_list.append(['Removable Space [' + self.dataset['unit'] + ']', '%.2f' %r])
 
         if special_overview is not None:
-            for i,special in enumerate(special_overview):
-                try:
-                    overview_list.append([special[0], eval(special[1])])
-                except ValueError:
-                    overview_list.append([special[0], 'matherror'])
-                except TypeError:
-                    overview_list.append([special[0], 'typeerror'])
+            values = self.dataset['special_overview_values']
+            if values is not None:
+                values = values.split(',')
+            else:
+                # datasets stored before the values were evaluated in extractData
+                values = evaluate_specials(compile_specials(special_overview), t, f, p, r, value_error='matherror')
+            for special, value in zip(special_overview, values):
+                overview_list.append([special[0], value])
         details_finished_list = []
         help_appending = []
         help_appending.append('none')
@@ -246,11 +246,7 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
 
         if special_details is not None:
             for i,special in enumerate(special_details):
-                helpstring = str(special[1])
-                helpstring = helpstring.replace('r', 'removable')
-                helpstring = helpstring.replace('t', 'total')
-                helpstring = helpstring.replace('f', 'free')
-                helpstring = helpstring.replace('p', 'precious')
+                helpstring = column_expression(str(special[1]))
                 help_appending.append(str("<input type='checkbox' id='" +self.dataset['instance'] + \
                     "_variable_%i' value="%int(i + 5)) + str(helpstring) + " checked='checked' />" + str(special[0]))
 
@@ -274,15 +270,13 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
 
         if special_details is not None:
             for i,special in enumerate(special_details):
-                helpstring = special[1]
-                helpstring = helpstring.replace('r', 'removable')
-                helpstring = helpstring.replace('t', 'total')
-                helpstring = helpstring.replace('f', 'free')
-                helpstring = helpstring.replace('p', 'precious')
+                helpstring = column_expression(special[1])
                 help_appending.append(str("<button onfocus='this.blur()' onclick=" +self.dataset['instance'] + \
                     "_col_button('" + helpstring + "')>Plot Col</button>"))
         details_finished_list.append(help_appending)
 
+        # only needed for datasets stored before the values were evaluated in extractData
+        compiled_details = compile_specials(special_details or [])
         for i,pool in enumerate(details_list):
             help_appending= []
             if pool['status'] == 1.0:
@@ -303,18 +297,12 @@ class dCacheInfoPoolGoe(hf.module.ModuleBase):
             help_appending.append(str('%0.2f' % float(t-f)))
             help_appending.append(str('%0.2f' % p))
             help_appending.append(str('%0.2f' % r))
-            if special_details is not None:
-                for i,special in enumerate(special_details):
-                    try:
-                        help_appending.append(str('%0.2f' % eval(special[2])))
-                    except ValueError:
-                        help_appending.append('matherror')
-                    except TypeError:
-                        help_appending.append('typeerror')
+            if special_details:
+                if pool['special_values'] is not None:
+                    help_appending.extend(pool['special_values'].split(','))
+                else:
+                    help_appending.extend(evaluate_specials(compiled_details, t, f, p, r, '%0.2f', 'matherror'))
 
             details_finished_list.append(help_appending)
 
-        data['details'] = details_finished_list
-        data['overview'] = overview_list
-
-        return data
+        return overview_list, details_finished_list
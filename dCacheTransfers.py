@@ -17,6 +17,7 @@
 import hf
 from sqlalchemy import Column, TEXT, INT, FLOAT
 from lxml.html import parse
+from parse_cache import ParseCache
 from string import strip
 import math
 class dCacheTransfers(hf.module.ModuleBase):
@@ -81,7 +82,7 @@ class dCacheTransfers(hf.module.ModuleBase):
         data['total_transfers'] = 0
         data['warning_transfers'] = 0
         data['critical_transfers'] = 0
-        root = parse(self.source.getTmpPath()).getroot()
+        root = ParseCache.for_run(self.run).parse(self.source, parse).getroot()
         root = root.findall('.//tbody')[0]
         speed_sum = 0
         for line in root.findall('.//tr'):
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Special columns of dCacheInfoPool and dCacheInfoPoolGoe.
+
+special_overview and special_details are comma-separated lists of
+label=expression, the expressions use the variables t(otal), f(ree),
+p(recious) and r(emovable). They are evaluated once in extractData and
+the results are stored as comma-separated text with the dataset and the
+pool rows, so rendering a page neither compiles nor evaluates anything.
+"""
+
+import parser
+
+
+def parse_specials(config):
+    """
+    List of (label, expression) of a special_overview/special_details
+    value, None if one of the entries has no '='.
+    """
+    if config is None:
+        return []
+    specials = []
+    for special in config.split(','):
+        if '=' not in special:
+            return None
+        special = special.split('=')
+        specials.append((special[0], special[1]))
+    return specials
+
+
+def compile_specials(specials):
+    """List of (label, expression, code) of specials, code is None for invalid expressions."""
+    compiled = []
+    for label, expression in specials:
+        try:
+            code = parser.expr(expression).compile()
+        except SyntaxError:
+            code = None
+        compiled.append((label, expression, code))
+    return compiled
+
+
+def evaluate_specials(specials, t, f, p, r, number_format=None, value_error='valueerror'):
+    """
+    Values of the compiled specials for the given space values, formatted
+    with number_format if set. Failing expressions give an error word
+    instead of a value.
+    """
+    values = []
+    for label, expression, code in specials:
+        if code is None:
+            values.append('syntaxerror')
+            continue
+        try:
+            value = eval(code, {}, {'t': t, 'f': f, 'p': p, 'r': r})
+            if number_format is not None:
+                value = number_format % value
+        except (ValueError, ZeroDivisionError):
+            value = value_error
+        except TypeError:
+            value = 'typeerror'
+        values.append(value)
+    return values
+
+
+def join_values(values):
+    return ','.join(str(value) for value in values)
+
+
+def column_expression(expression):
+    """Expression with the full column names of the details subtable."""
+    expression = expression.replace('r', 'removable')
+    expression = expression.replace('t', 'total')
+    expression = expression.replace('f', 'free')
+    expression = expression.replace('p', 'precious')
+    return expression
+
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Client for the JSON export of the Ganglia web frontend (graph.php?...&json=1).
+
+One client per Ganglia instance, time window and HappyFace run keeps an
+authenticated pool of keep-alive connections, requests all graphs of a
+module at once and only asks for the most recent time window. Fetched
+graphs are kept per (host, metric or report, window), so a graph that
+more than one module of the run requests (e.g. Storages and Portals) is
+fetched once, no matter in which order or with which presentation
+parameters (cluster, title, size, ...) the modules ask for it.
+"""
+
+import json
+import time
+import urllib
+import logging
+import threading
+from ConfigParser import RawConfigParser
+from concurrent_fetch import FetchPool
+
+
+def latest_value(datapoints):
+    """Most recent value of a Ganglia datapoint series that is not NaN, None if there is none."""
+    for datapoint in reversed(datapoints):
+        if datapoint[0] != 'NaN':
+            return datapoint[0]
+    return None
+
+
+class GangliaClient(object):
+    """
+    Per-run client of one Ganglia web frontend, obtained with for_run().
+
+    base_url     URL of the Ganglia frontend, graph.php is relative to it
+    credentials  optional path of a config file with a [login] section
+                 holding username and passwd for HTTP basic auth
+    window       seconds of data requested per graph
+    """
+
+    _lock = threading.Lock()
+    _clients = {}
+    _run_key = None
+
+    @classmethod
+    def for_run(cls, run, base_url, credentials=None, window=900, workers=8, timeout=30):
+        try:
+            run_key = run["id"]
+        except (TypeError, KeyError):
+            run_key = id(run)
+        with cls._lock:
+            if cls._run_key != run_key:
+                for client in cls._clients.itervalues():
+                    client.close()
+                cls._clients = {}
+                cls._run_key = run_key
+            key = (base_url, credentials, int(window))
+            if key not in cls._clients:
+                cls._clients[key] = cls(base_url, credentials, window, workers, timeout)
+            return cls._clients[key]
+
+    def __init__(self, base_url, credentials=None, window=900, workers=8, timeout=30):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.window = int(window)
+        self.logger = logging.getLogger(__name__)
+        auth = None
+        if credentials is not None:
+            cfg_parser = RawConfigParser()
+            cfg_parser.read(credentials)
+            auth = (cfg_parser.get('login', 'username'), cfg_parser.get('login', 'passwd'))
+        self.pool = FetchPool(workers=workers, timeout=timeout, auth=auth)
+        self._lock = threading.Lock()
+        self._graphs = {}
+
+    def graph_url(self, params):
+        """URL of the JSON export of the graph described by the list of (key, value) pairs params."""
+        now = int(time.time())
+        params = list(params) + [('cs', now - self.window), ('ce', now), ('json', 1)]
+        return self.base_url + 'graph.php?' + urllib.urlencode(params)
+
+    def graph_key(self, params):
+        """
+        (host, metric or report, window) identifying the data of the graph
+        described by params, the other parameters only affect how Ganglia
+        would draw it. The metric is ignored by Ganglia for report graphs.
+        """
+        params = dict(params)
+        if 'g' in params:
+            graph = ('g', params['g'])
+        else:
+            graph = ('m', params.get('m'))
+        return (params.get('h'), graph, self.window)
+
+    def graphs(self, requests):
+        """
+        Fetch the graphs described by the list of parameter lists requests
+        concurrently. Returns the decoded JSON of every graph in the same
+        order, None for graphs that could not be fetched.
+        """
+        keys = [self.graph_key(params) for params in requests]
+        with self._lock:
+            missing = {}
+            for key, params in zip(keys, requests):
+                if key not in self._graphs and key not in missing:
+                    missing[key] = self.graph_url(params)
+        if missing:
+            results = self.pool.fetch(missing.values(), json.load)
+            with self._lock:
+                for key, url in missing.iteritems():
+                    result = results[url]
+                    if not result.ok:
+                        self.logger.warning("Could not fetch %s: %s" % (url, result.error))
+                    self._graphs[key] = result.data
+        with self._lock:
+            return [self._graphs[key] for key in keys]
+
+    def close(self):
+        self.pool.close()
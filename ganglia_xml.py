@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Streaming reader for the XML dump of gmond/gmetad (GRID/CLUSTER/HOST/METRIC).
+
+A dump of a whole grid is hundreds of megabytes, while a module only
+watches a handful of hosts. The file is read with lxml.etree.iterparse:
+clusters and hosts that are not watched are dropped as soon as they are
+closed, only the requested METRIC elements of the watched hosts are kept
+and reading stops once all watched hosts have been seen.
+"""
+
+from lxml import etree
+
+
+class GangliaDump(object):
+    """
+    Requested content of a Ganglia XML dump.
+
+    localtime  LOCALTIME of the first GRID element, None without GRID
+    clusters   names of the watched clusters found in the dump
+    hosts      names of the watched hosts found in the dump
+    metrics    list of dicts with cluster, host, name, value, units and
+               title (the TITLE extra element, empty if not set)
+    """
+
+    def __init__(self):
+        self.localtime = None
+        self.clusters = set()
+        self.hosts = set()
+        self.metrics = []
+
+    def host_metrics(self, host):
+        """Metric name -> metric dict of host."""
+        return dict((metric['name'], metric) for metric in self.metrics if metric['host'] == host)
+
+
+def _metric(cluster, host, element):
+    title = ''
+    for extra in element.iterfind('EXTRA_DATA/EXTRA_ELEMENT'):
+        if extra.get('NAME') == 'TITLE':
+            title = extra.get('VAL')
+    return {'cluster': cluster, 'host': host, 'name': element.get('NAME'),
+            'value': element.get('VAL'), 'units': element.get('UNITS'), 'title': title}
+
+
+def parse_ganglia(source, hosts, clusters=None, metrics=None):
+    """
+    Read the metrics of hosts from the Ganglia XML file object source.
+
+    clusters restricts the hosts to these clusters, metrics to these
+    metric names; None means all of them. Returns a GangliaDump.
+    """
+    hosts = set(hosts)
+    clusters = set(clusters) if clusters is not None else None
+    metrics = set(metrics) if metrics is not None else None
+    remaining = set(hosts)
+    dump = GangliaDump()
+    cluster = None if clusters is not None else ''
+    host = None
+    context = etree.iterparse(source, events=('start', 'end'), tag=('GRID', 'CLUSTER', 'HOST', 'METRIC'))
+    for event, element in context:
+        tag = element.tag
+        if event == 'start':
+            if tag == 'HOST':
+                name = element.get('NAME')
+                if cluster is not None and name in hosts:
+                    host = name
+                    dump.hosts.add(name)
+            elif tag == 'CLUSTER':
+                name = element.get('NAME')
+                if clusters is None or name in clusters:
+                    cluster = name
+                    dump.clusters.add(name)
+            elif tag == 'GRID' and dump.localtime is None:
+                dump.localtime = int(element.get('LOCALTIME'))
+            continue
+        if tag == 'METRIC':
+            if host is not None and (metrics is None or element.get('NAME') in metrics):
+                dump.metrics.append(_metric(cluster, host, element))
+            # cleared together with its host
+            continue
+        if tag == 'HOST':
+            remaining.discard(host)
+            host = None
+        elif tag == 'CLUSTER':
+            cluster = None if clusters is not None else ''
+        # drop the closed element and everything before it, so only the
+        # path to the current element is kept in memory
+        element.clear()
+        parent = element.getparent()
+        while parent is not None and element.getprevious() is not None:
+            del parent[0]
+        if tag == 'HOST' and not remaining:
+            break
+    del context
+    return dump
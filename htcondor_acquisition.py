@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Shared HTCondor acquisition layer for the HTCondor modules.
+
+The collector, the negotiator and the list of schedds are located once
+per HappyFace run and shared by all module instances of that run. Job
+queries run against all schedds concurrently, the ads are streamed to
+the caller as they arrive and a schedd that does not answer within its
+deadline is skipped instead of stalling the whole category. The deadline
+of a schedd runs from the start of its query until its last ad, the time
+a slow caller spends on the ads does not count.
+"""
+
+import threading
+import Queue
+import time
+import logging
+import htcondor
+
+_DONE = object()
+
+
+class ScheddTimeout(Exception):
+    """A schedd did not finish its answer within the timeout."""
+
+
+class ScheddQuery(object):
+    """
+    Iterable over (schedd name, ad) of a query against all schedds.
+
+    method is "query" for the job queue or "history" for the job history.
+    requirements is either a constraint string or a callable returning
+    the constraint for a given schedd name. After the iteration errors
+    maps every schedd that failed or timed out to a message and completed
+    holds the names of all schedds that answered completely.
+    """
+
+    def __init__(self, schedd_ads, method, requirements, projection, limit=-1, timeout=60):
+        self.schedd_ads = schedd_ads
+        self.method = method
+        self.requirements = requirements
+        self.projection = projection
+        self.limit = limit
+        self.timeout = float(timeout)
+        self.errors = {}
+        self.completed = set()
+        self.logger = logging.getLogger(__name__)
+
+    def _constraint(self, schedd_name):
+        if callable(self.requirements):
+            return self.requirements(schedd_name)
+        return self.requirements
+
+    def _worker(self, schedd_name, schedd_ad, queue, stop, deadlines):
+        def put(item):
+            try:
+                queue.put_nowait(item)
+                return True
+            except Queue.Full:
+                pass
+            # waiting for the consumer to take ads from the full queue does
+            # not count against the deadline of the schedd
+            deadline, deadlines[schedd_name] = deadlines[schedd_name], None
+            blocked = time.time()
+            try:
+                while not stop.is_set():
+                    try:
+                        queue.put(item, timeout=1)
+                        return True
+                    except Queue.Full:
+                        pass
+                return False
+            finally:
+                deadlines[schedd_name] = deadline + time.time() - blocked
+        try:
+            schedd = htcondor.Schedd(schedd_ad)
+            constraint = self._constraint(schedd_name)
+            if self.method == "history":
+                ads = schedd.history(constraint, self.projection, self.limit)
+            else:
+                ads = schedd.xquery(requirements=constraint, projection=self.projection, limit=self.limit)
+            for ad in ads:
+                if time.time() > deadlines[schedd_name]:
+                    put((schedd_name, ScheddTimeout("not finished within %d seconds" % self.timeout)))
+                    return
+                if not put((schedd_name, ad)):
+                    return
+            put((schedd_name, _DONE))
+        except Exception, e:
+            put((schedd_name, e))
+
+    def _fail(self, schedd_name, message):
+        self.errors[schedd_name] = message
+        self.logger.error("Skipping schedd %s: %s" % (schedd_name, message))
+
+    def __iter__(self):
+        queue = Queue.Queue(maxsize=10000)
+        stop = threading.Event()
+        running = set()
+        # deadline per schedd, measured from the start of its query; None
+        # while its worker waits for the consumer
+        deadlines = {}
+        for schedd_ad in self.schedd_ads:
+            schedd_name = schedd_ad.get("Name")
+            running.add(schedd_name)
+            deadlines[schedd_name] = time.time() + self.timeout
+            thread = threading.Thread(target=self._worker, args=(schedd_name, schedd_ad, queue, stop, deadlines))
+            thread.daemon = True
+            thread.start()
+        try:
+            while running:
+                now = time.time()
+                waiting = [deadlines[schedd_name] for schedd_name in running if deadlines[schedd_name] is not None]
+                try:
+                    schedd_name, item = queue.get(timeout=max(0.01, min(waiting) - now) if waiting else 1.0)
+                except Queue.Empty:
+                    # schedds that stopped sending before their deadline
+                    now = time.time()
+                    for schedd_name in list(running):
+                        if deadlines[schedd_name] is not None and deadlines[schedd_name] <= now:
+                            running.discard(schedd_name)
+                            self._fail(schedd_name, "no answer within %d seconds" % self.timeout)
+                    continue
+                if schedd_name not in running:
+                    continue
+                if item is _DONE:
+                    running.discard(schedd_name)
+                    self.completed.add(schedd_name)
+                elif isinstance(item, ScheddTimeout):
+                    running.discard(schedd_name)
+                    self._fail(schedd_name, str(item))
+                elif isinstance(item, Exception):
+                    running.discard(schedd_name)
+                    self.errors[schedd_name] = "%s: %s" % (type(item).__name__, item)
+                    self.logger.error("Query of schedd %s failed: %s" % (schedd_name, self.errors[schedd_name]))
+                else:
+                    yield schedd_name, item
+        finally:
+            stop.set()
+
+
+class CondorAcquisition(object):
+    """
+    Per-run memo of the HTCondor discovery, obtained with for_run(run).
+    """
+
+    _lock = threading.Lock()
+    _current = None
+
+    @classmethod
+    def for_run(cls, run):
+        try:
+            key = run["id"]
+        except (TypeError, KeyError):
+            key = id(run)
+        with cls._lock:
+            if cls._current is None or cls._current.run_key != key:
+                cls._current = cls(key)
+            return cls._current
+
+    def __init__(self, run_key):
+        self.run_key = run_key
+        self._lock = threading.Lock()
+        self._collector = None
+        self._schedd_ads = None
+        self._negotiator_ads = None
+        self._negotiators = {}
+        self._startd_ads = {}
+
+    @property
+    def collector(self):
+        with self._lock:
+            if self._collector is None:
+                self._collector = htcondor.Collector()
+            return self._collector
+
+    def schedd_ads(self):
+        collector = self.collector
+        with self._lock:
+            if self._schedd_ads is None:
+                self._schedd_ads = collector.query(htcondor.AdTypes.Schedd)
+            return self._schedd_ads
+
+    def negotiator(self, machine=None):
+        """Negotiator running on machine, the default negotiator if it is not found."""
+        collector = self.collector
+        with self._lock:
+            if machine not in self._negotiators:
+                if self._negotiator_ads is None:
+                    self._negotiator_ads = collector.query(htcondor.AdTypes.Negotiator)
+                negotiator = None
+                for negotiator_ad in self._negotiator_ads:
+                    if machine is not None and negotiator_ad.get("Machine") == machine:
+                        negotiator = htcondor.Negotiator(negotiator_ad)
+                        break
+                self._negotiators[machine] = negotiator or htcondor.Negotiator()
+            return self._negotiators[machine]
+
+    def startd_ads(self, constraint, projection):
+        """Startd ads of the pool, identical queries of one run are answered once."""
+        collector = self.collector
+        key = (constraint, tuple(projection))
+        with self._lock:
+            if key not in self._startd_ads:
+                self._startd_ads[key] = collector.query(ad_type=htcondor.AdTypes.Startd,
+                                                        constraint=constraint, projection=list(projection))
+            return self._startd_ads[key]
+
+    def query_schedds(self, method, requirements, projection, limit=-1, timeout=60, schedd_names=None):
+        """ScheddQuery against all schedds, or only those in schedd_names."""
+        schedd_ads = self.schedd_ads()
+        if schedd_names is not None:
+            schedd_ads = [schedd_ad for schedd_ad in schedd_ads if schedd_ad.get("Name") in schedd_names]
+        return ScheddQuery(schedd_ads, method, requirements, projection, limit, timeout)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Job numbers per category and time bin from the CMS dashboard XML.
+
+The dashboard items are read once into a categories x time bins matrix
+with the total of each time bin as last row. Minimum, maximum, average,
+fractions of the total and sums over the most recent bins are array
+operations on that matrix, so long lookback windows with many categories
+stay cheap.
+
+The dashboard gives its times in UTC. The same few time stamps occur for
+every category, so local_time_converter converts every distinct string
+only once.
+"""
+
+from datetime import datetime
+import numpy as np
+import pytz
+
+
+def local_time_converter(in_format, out_format, zone='Europe/Berlin'):
+    """
+    Function converting UTC time strings in in_format to time strings of
+    the time zone zone in out_format, memoized per string.
+    """
+    local_zone = pytz.timezone(zone)
+    converted = {}
+
+    def convert(text):
+        try:
+            return converted[text]
+        except KeyError:
+            date = datetime.strptime(text, in_format).replace(tzinfo=pytz.utc).astimezone(local_zone)
+            converted[text] = date.strftime(out_format)
+            return converted[text]
+    return convert
+
+
+def percent_of_total(jobs):
+    """
+    Percentage of the total of jobs, a matrix or a single column of a
+    JobTimeSeries with the total last, 0.0 where the total is 0.
+    """
+    jobs = np.asarray(jobs, dtype=float)
+    total = jobs[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, 100.0 * jobs / total, 0.0)
+
+
+class JobTimeSeries(object):
+    """
+    Job numbers of categories over time_points.
+
+    jobs is an integer matrix with a row per category and the total of
+    all categories as last row, and a column per time point.
+    """
+
+    def __init__(self, categories, time_points, jobs):
+        self.categories = list(categories)
+        self.time_points = list(time_points)
+        jobs = np.asarray(jobs, dtype=int).reshape(len(self.categories), len(self.time_points))
+        self.jobs = np.vstack([jobs, jobs.sum(axis=0)])
+
+    @classmethod
+    def from_columns(cls, items, tags, convert=None, date_tag='s_date'):
+        """
+        Series of dashboard items with one child element per category, the
+        tag names of the categories are tags. Time points are kept in the
+        order of the items and converted with convert if given.
+        """
+        tag_index = dict((tag, k) for k, tag in enumerate(tags))
+        time_points = []
+        columns = []
+        for item in items:
+            column = [0] * len(tags)
+            for element in item:
+                if element.tag == date_tag:
+                    date = element.text_content()
+                    time_points.append(convert(date) if convert is not None else date)
+                elif element.tag in tag_index:
+                    column[tag_index[element.tag]] = int(element.text_content())
+            columns.append(column)
+        jobs = np.array(columns, dtype=int).reshape(len(columns), len(tags)).T
+        return cls(tags, time_points, jobs)
+
+    @classmethod
+    def from_rows(cls, items, category_tag, data_tag, categories=(), convert=None, date_tag='s_date'):
+        """
+        Series of dashboard items with one value per item, its category is
+        the text of category_tag and its value the text of data_tag.
+        Categories not in categories are appended in the order they
+        appear. Time points are converted with convert if given and sorted.
+        """
+        categories = list(categories)
+        category_index = dict((category, k) for k, category in enumerate(categories))
+        cells = {}
+        for item in items:
+            date = item.find(date_tag).text_content()
+            if convert is not None:
+                date = convert(date)
+            category = item.find(category_tag).text_content()
+            value = int(item.find(data_tag).text_content())
+            if category not in category_index:
+                category_index[category] = len(categories)
+                categories.append(category)
+            cells[(category_index[category], date)] = value
+        time_points = sorted(set(date for k, date in cells))
+        time_index = dict((date, t) for t, date in enumerate(time_points))
+        jobs = np.zeros((len(categories), len(time_points)), dtype=int)
+        for (k, date), value in cells.iteritems():
+            jobs[k, time_index[date]] = value
+        return cls(categories, time_points, jobs)
+
+    def __len__(self):
+        return len(self.time_points)
+
+    def column(self, index):
+        """Jobs of all categories in time bin index, zeros if there is no such bin."""
+        if -len(self) <= index < len(self):
+            return self.jobs[:, index]
+        return np.zeros(len(self.jobs), dtype=int)
+
+    def window(self, count):
+        """Jobs of all categories summed over the count most recent time bins."""
+        if count <= 0:
+            return np.zeros(len(self.jobs), dtype=int)
+        return self.jobs[:, -count:].sum(axis=1)
+
+    def minimum(self):
+        if not len(self):
+            return np.zeros(len(self.jobs), dtype=int)
+        return self.jobs.min(axis=1)
+
+    def maximum(self):
+        if not len(self):
+            return np.zeros(len(self.jobs), dtype=int)
+        return self.jobs.max(axis=1)
+
+    def average(self):
+        return self.jobs.sum(axis=1) / float(max(1, len(self)))
+
+    def stack_bottoms(self):
+        """Bottom of the bars of each category (without the total) in a stacked plot."""
+        bottoms = np.zeros((len(self.categories), len(self)), dtype=int)
+        np.cumsum(self.jobs[:-2], axis=0, out=bottoms[1:])
+        return bottoms
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Incremental reading of large JSON objects.
+
+iter_object_items yields the (key, value) pairs of a top-level JSON
+object while it is read from a file-like object, so only the current
+chunk and the current member have to be kept in memory. This is meant
+for listings like {"file": {...}, "file2": {...}, ...} with millions of
+members.
+"""
+
+import json
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = _whitespace + ',:]}'
+
+
+class _Reader(object):
+    """Sliding buffer over a stream, holding only data that is not consumed yet."""
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """Read the next chunk, False at the end of the stream."""
+        chunk = '' if self.eof else self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Next character that is not whitespace, '' at the end of the stream."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char not in chars or char == '':
+            raise ValueError('Expected one of %r at %r' % (chars, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next JSON value."""
+        self.next_char()
+        while True:
+            try:
+                item, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                item = end = None
+            # a number cut by the end of the buffer decodes as a shorter
+            # one ('3.' as 3), so a value is only taken if a delimiter
+            # follows or the stream has ended
+            if end is not None and (self.eof or end < len(self.buf) and self.buf[end] in _delimiters):
+                self.pos = end
+                return item
+            if not self.more():
+                if end is not None:
+                    self.pos = end
+                    return item
+                raise ValueError('Invalid JSON at %r' % self.buf[self.pos:self.pos + 20])
+
+
+def iter_object_items(stream, chunk_size=65536):
+    """Yield the (key, value) pairs of the JSON object read from stream."""
+    reader = _Reader(stream, chunk_size)
+    reader.expect('{')
+    if reader.next_char() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        yield key, reader.value()
+        if reader.expect(',}') == '}':
+            return
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Job numbers per attribute value and node for NodeMonitoring.
+
+The jobs of the dashboard JSON are mapped to integer codes for their
+attribute value and node in one pass and counted with numpy.bincount, so
+the work grows linearly with the number of jobs instead of with jobs times
+nodes. tools/replay_node_monitoring.py compares the results with the
+list based counting NodeMonitoring used before on a recorded JSON file.
+"""
+
+import heapq
+import numpy as np
+
+
+def finished_since(jobs, start):
+    """
+    Jobs still running or finished at start or later. start is an ISO time
+    stamp in UTC like the FinishedTimeStamp of the jobs, so comparing the
+    strings is the same as comparing the dates. Jobs without a complete
+    time stamp are kept.
+    """
+    return [item for item in jobs
+            if not isinstance(item.get('FinishedTimeStamp'), basestring)
+            or len(item['FinishedTimeStamp']) != 19
+            or item['FinishedTimeStamp'] >= start]
+
+
+def count_jobs(jobs, attribute, primary_key, secondary_key='', attribute_values=(), fixed=False):
+    """
+    Count jobs per attribute value and node.
+
+    attribute_values are the values to start with. If fixed is set, jobs
+    with other values are skipped, otherwise those values are appended in
+    order of appearance. Nodes are the values of primary_key in order of
+    appearance, the secondary key of a node is taken from its first job.
+
+    Returns (AttributeValues, PrimaryKeys, SecondaryKeys, Jobs,
+    TotalJobsPerNode) with Jobs as nested lists indexed [value][node].
+    """
+    AttributeValues = list(attribute_values)
+    AttributeIndex = dict((value, a) for a, value in enumerate(AttributeValues))
+    PrimaryKeys = []
+    SecondaryKeys = []
+    PrimaryKeyIndex = {}
+    AttributeCodes = []
+    PrimaryKeyCodes = []
+    for item in jobs:
+        a = AttributeIndex.get(item[attribute])
+        if a is None:
+            if fixed:
+                continue
+            a = AttributeIndex[item[attribute]] = len(AttributeValues)
+            AttributeValues.append(item[attribute])
+        k = PrimaryKeyIndex.get(item[primary_key])
+        if k is None:
+            k = PrimaryKeyIndex[item[primary_key]] = len(PrimaryKeys)
+            PrimaryKeys.append(item[primary_key])
+            if secondary_key <> '':
+                SecondaryKeys.append(item[secondary_key])
+        AttributeCodes.append(a)
+        PrimaryKeyCodes.append(k)
+
+    nCells = len(AttributeValues) * len(PrimaryKeys)
+    Jobs = np.bincount(
+            np.array(AttributeCodes, dtype=int) * len(PrimaryKeys) + np.array(PrimaryKeyCodes, dtype=int),
+            minlength=max(nCells, 1))[:nCells].reshape(len(AttributeValues), len(PrimaryKeys))
+    TotalJobsPerNode = Jobs.sum(axis=0).tolist()
+    return AttributeValues, PrimaryKeys, SecondaryKeys, Jobs.tolist(), TotalJobsPerNode
+
+
+def top_nodes(counts, number):
+    """
+    Indices of the number nodes with the highest counts, highest first,
+    nodes with equal counts stay in order of appearance.
+    """
+    number = max(0, min(number, len(counts)))
+    return heapq.nsmallest(number, xrange(len(counts)), key=lambda k: (-counts[k], k))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Per-run cache of parsed downloads.
+
+Several module instances often download the same source in one run (the
+same qstat XML, the same dCache web page, the same dashboard JSON). The
+first instance parses the file, every further instance of the run gets
+the already parsed tree or object back. Entries are keyed by the source
+URL, a hash of the downloaded content and the parser, so a changed file
+or a different parser never returns a stale result.
+
+The downloads are hashed in chunks and the parsers read from the file
+itself, so streaming parsers keep their bounded memory. The parsed
+results are shared between modules and must be treated as read-only.
+The savings of a run are logged once the next run starts or the process
+exits.
+"""
+
+import atexit
+import hashlib
+import threading
+import time
+import logging
+
+_CHUNK_SIZE = 1 << 20
+
+
+class ParseCache(object):
+    """
+    Per-run memo of parsed downloads, obtained with for_run(run).
+
+    hits, misses, bytes_saved and seconds_saved count how much reading
+    and parsing was avoided in the current run.
+    """
+
+    _lock = threading.Lock()
+    _current = None
+
+    @classmethod
+    def for_run(cls, run):
+        try:
+            key = run["id"]
+        except (TypeError, KeyError):
+            key = id(run)
+        with cls._lock:
+            if cls._current is None or cls._current.run_key != key:
+                if cls._current is None:
+                    atexit.register(cls._log_current)
+                else:
+                    cls._current.log_stats()
+                cls._current = cls(key)
+            return cls._current
+
+    @classmethod
+    def _log_current(cls):
+        with cls._lock:
+            if cls._current is not None:
+                cls._current.log_stats()
+
+    def __init__(self, run_key):
+        self.run_key = run_key
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+
+    def parse(self, download, parser):
+        """
+        Result of parser(file object) for the content of download.
+
+        download is a file object returned by hf.downloadService.addDownload,
+        parser any callable reading a file object, e.g. etree.parse,
+        lxml.html.parse, minidom.parse or json.load.
+        """
+        with open(download.getTmpPath(), 'rb') as f:
+            digest = hashlib.sha1()
+            size = 0
+            chunk = f.read(_CHUNK_SIZE)
+            while chunk:
+                digest.update(chunk)
+                size += len(chunk)
+                chunk = f.read(_CHUNK_SIZE)
+            key = (download.getSourceUrl(), digest.hexdigest(), parser)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    result, parse_time = entry
+                    self.hits += 1
+                    self.bytes_saved += size
+                    self.seconds_saved += parse_time
+                    self.logger.debug("Reusing parsed %s, saved %d bytes and %.2f s in this run so far"
+                                      % (key[0], self.bytes_saved, self.seconds_saved))
+                    return result
+            f.seek(0)
+            start = time.time()
+            result = parser(f)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (result, time.time() - start)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_saved': self.bytes_saved,
+                'seconds_saved': self.seconds_saved,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        if stats['hits'] or stats['misses']:
+            self.logger.info("Parsed downloads of run %s: %d parsed, %d reused, saved %d bytes and %.2f s"
+                             % (self.run_key, stats['misses'], stats['hits'],
+                                stats['bytes_saved'], stats['seconds_saved']))
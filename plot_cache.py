@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Content addressed cache of rendered plots.
+
+Many plots only change every few runs. A plot is identified by a digest
+of everything it is drawn from (the input arrays, configuration, sizes
+and labels). The first rendering is kept in the cache directory, later
+runs with the same digest hard link (or copy, across file systems) the
+cached image to their archive path instead of rendering it again:
+
+    cache = PlotService.instance().cache_for_run(self.run)
+    digest = plot_digest(H, xedges, yedges, self.plotsize_x, self.plotsize_y, title)
+    if not cache.fetch(digest, path):
+        start = time.time()
+        ... render and save to path ...
+        cache.store(digest, path, time.time() - start)
+
+Plots rendered from specs by the PlotService are cached automatically.
+Cached images not used for max_age seconds are removed.
+
+The cached images are linked into the archive as they are, so the cache
+directory is created readable for its owner only and a directory owned
+by another user or a symbolic link is not used at all.
+"""
+
+import os
+import stat
+import time
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+
+def _update_digest(digest, value):
+    if isinstance(value, dict):
+        digest.update('{')
+        for key in sorted(value):
+            _update_digest(digest, key)
+            _update_digest(digest, value[key])
+        digest.update('}')
+    elif isinstance(value, (list, tuple)):
+        digest.update('[')
+        for item in value:
+            _update_digest(digest, item)
+        digest.update(']')
+    elif hasattr(value, 'tostring') and hasattr(value, 'dtype'):
+        # numpy arrays, the raw data with type and shape
+        digest.update('%s%r' % (value.dtype.str, value.shape))
+        digest.update(value.tostring())
+    elif isinstance(value, float):
+        digest.update(repr(value))
+    elif isinstance(value, unicode):
+        digest.update(value.encode('utf-8'))
+    else:
+        digest.update('%s:%r' % (type(value).__name__, value))
+
+
+def plot_digest(*inputs):
+    """Hex digest of the nested dicts, lists, numpy arrays and scalars inputs."""
+    digest = hashlib.sha1()
+    for value in inputs:
+        _update_digest(digest, value)
+    return digest.hexdigest()
+
+
+class PlotCache(object):
+    """
+    Cache of rendered plots in directory, nothing is cached if directory
+    is None or cannot be used.
+
+    hits, misses and seconds_saved (rendering time of the reused images)
+    count the effect in the current run, see log_stats().
+    """
+
+    def __init__(self, directory, max_age=7*24*3600):
+        self.directory = None
+        self.max_age = max_age
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        if directory is None:
+            return
+        try:
+            os.makedirs(directory, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                self.logger.warning("Could not create plot cache %s: %s" % (directory, e))
+                return
+        try:
+            info = os.lstat(directory)
+            if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+                self.logger.warning("Not using plot cache %s, it is not a directory owned by this user"
+                                    % directory)
+                return
+            if stat.S_IMODE(info.st_mode) != 0700:
+                os.chmod(directory, 0700)
+        except OSError, e:
+            self.logger.warning("Could not use plot cache %s: %s" % (directory, e))
+            return
+        self.directory = directory
+        self.expire()
+
+    def _image(self, digest):
+        return os.path.join(self.directory, digest)
+
+    def _link(self, source, target):
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    def fetch(self, digest, path):
+        """Put the cached image of digest at path, False if it is not cached."""
+        if self.directory is None:
+            return False
+        image = self._image(digest)
+        try:
+            with open(image + '.seconds') as f:
+                seconds = float(f.read())
+            self._link(image, path)
+            os.utime(image, None)
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+            self.seconds_saved += seconds
+        return True
+
+    def store(self, digest, path, seconds):
+        """Keep the image at path, rendered in seconds, as cached image of digest."""
+        if self.directory is None:
+            return
+        image = self._image(digest)
+        try:
+            # a copy, so the cached image does not share its inode with
+            # the archive of this run
+            handle, temp = tempfile.mkstemp(dir=self.directory)
+            os.close(handle)
+            shutil.copyfile(path, temp)
+            os.rename(temp, image)
+            # written last, an image without it is not used
+            with open(image + '.seconds', 'w') as f:
+                f.write(repr(seconds))
+        except (IOError, OSError), e:
+            self.logger.warning("Could not cache plot %s: %s" % (path, e))
+
+    def expire(self):
+        """Remove the images not used within max_age."""
+        if self.directory is None:
+            return
+        limit = time.time() - self.max_age
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.seconds'):
+                continue
+            image = self._image(name)
+            try:
+                if os.path.getmtime(image) < limit:
+                    os.remove(image + '.seconds')
+                    os.remove(image)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'seconds_saved': self.seconds_saved,
+            }
+
+    def log_stats(self, run_key):
+        """Log the counters of the run run_key and start counting anew."""
+        with self._lock:
+            hits, misses, seconds_saved = self.hits, self.misses, self.seconds_saved
+            self.hits = self.misses = 0
+            self.seconds_saved = 0.0
+        if hits or misses:
+            self.logger.info("Plots of run %s: %d not cached, %d reused, saved %.2f s"
+                             % (run_key, misses, hits, seconds_saved))
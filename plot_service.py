@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Plot rendering outside the HappyFace process.
+
+Modules describe a plot as a declarative spec of plain dicts, lists and
+numpy arrays and hand it to the PlotService together with the archive
+path of the PNG, the module and the column of its dataset that takes the
+file name:
+
+    PlotService.instance().submit({
+        'figsize': (10, 5),
+        'axes': [{
+            'title': 'running slots per site',
+            'layers': [{'kind': 'bar', 'horizontal': True, 'stacked': True,
+                        'series': [{'label': 'idle', 'values': idle, 'color': '#56b4e9'},
+                                   {'label': 'busy', 'values': busy, 'color': '#009e73'}]}],
+            'legend': {'loc': 6, 'bbox_to_anchor': (0.8, 0.88)},
+        }],
+    }, hf.downloadService.getArchivePath(self.run, self.instance_name + "_sites.png"),
+        self, 'filename_plot')
+
+The specs are rendered by a pool of worker processes that import
+matplotlib once with the Agg backend, so neither pyplot nor any figure
+lives in the HappyFace process, and every figure is closed after it has
+been saved. submit returns right away, so extractData returns as soon as
+the data is stored. The file name column stays empty in extractData and
+is written once the renders of the run are collected and the PNG exists.
+
+A spec that was rendered before is not rendered again, the image is taken
+from the PlotCache in plot_cache_dir of the paths section of the
+HappyFace config, plot_cache in its tmp_dir by default.
+
+Spec reference (all keys but 'axes' and 'layers' are optional):
+
+figure   figsize, dpi (91), tight_layout (True), bbox_inches and axes,
+         a list of axes specs drawn in one column
+axes     title, xlabel, ylabel, xscale, yscale, position, xlim, ylim
+         (pairs, None keeps the automatic limit), xlim_scale, ylim_scale
+         (factor for the automatic upper limit), xticks, xticklabels,
+         xticklabels_rotation, yticks, yticklabels, legend and layers
+legend   loc, bbox_to_anchor, ncol, borderaxespad, fontsize ('small'),
+         reverse (list the entries in reverse order) and patches, a list
+         of (label, color) used instead of the labels of the layers
+layers   dicts with a 'kind':
+         bar       series (dicts with values, color and label), x (0..n-1),
+                   width (0.8), horizontal, stacked, base (start value of
+                   the stack), log, align ('center'), edgecolor and
+                   value_labels (format of a label on top of every bar)
+         hist      values (array or list of arrays), bins, weights, range,
+                   stacked, log, histtype ('bar'), colors and labels
+         errorbar  x, y, xerr, yerr, fmt, color and label
+         line      x, y, fmt, color, linestyle and label
+         vline     x, color and linewidth
+         text      x, y, text, ha, va, fontsize, fontweight and axes_x (x
+                   is a fraction of the axes width instead of data)
+"""
+
+import os
+import imp
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+import ConfigParser
+import hf
+from sqlalchemy import and_
+from plot_cache import PlotCache, plot_digest
+
+_WORKER_MATPLOTLIB = None
+
+
+def _init_worker():
+    global _WORKER_MATPLOTLIB
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    _WORKER_MATPLOTLIB = matplotlib
+
+
+def _draw_bars(axis, layer):
+    import numpy as np
+    series = layer['series']
+    count = len(series[0]['values']) if series else 0
+    x = np.asarray(layer['x']) if 'x' in layer else np.arange(count)
+    width = layer.get('width', 0.8)
+    horizontal = layer.get('horizontal', False)
+    stacked = layer.get('stacked', False)
+    base = np.zeros(len(x)) + layer.get('base', 0)
+    bars = []
+    for entry in series:
+        values = np.asarray(entry['values'], dtype=float)
+        kwargs = {'color': entry.get('color'), 'align': layer.get('align', 'center'),
+                  'log': layer.get('log', False)}
+        if entry.get('label') is not None:
+            kwargs['label'] = entry['label']
+        if layer.get('edgecolor') is not None:
+            kwargs['edgecolor'] = layer['edgecolor']
+        start = base if stacked or 'base' in layer else None
+        if horizontal:
+            bars.append(axis.barh(x, values, width, left=start, **kwargs))
+        else:
+            bars.append(axis.bar(x, values, width, bottom=start, **kwargs))
+        if stacked:
+            base = base + values
+    if layer.get('value_labels') is not None:
+        for rects in bars:
+            for rect in rects:
+                if horizontal:
+                    length = rect.get_width()
+                    axis.text(1.05 * length, rect.get_y() + rect.get_height() / 2.,
+                              layer['value_labels'] % length, ha='left', va='center')
+                else:
+                    length = rect.get_height()
+                    axis.text(rect.get_x() + rect.get_width() / 2., 1.05 * length,
+                              layer['value_labels'] % length, ha='center', va='bottom')
+
+
+def _draw_layer(axis, layer):
+    kind = layer['kind']
+    if kind == 'bar':
+        _draw_bars(axis, layer)
+    elif kind == 'hist':
+        kwargs = {'histtype': layer.get('histtype', 'bar'), 'log': layer.get('log', False)}
+        if layer.get('stacked', False):
+            kwargs['stacked'] = True
+        for key, name in (('weights', 'weights'), ('range', 'range'), ('colors', 'color'), ('labels', 'label')):
+            if layer.get(key) is not None:
+                kwargs[name] = layer[key]
+        axis.hist(layer['values'], layer.get('bins', 10), **kwargs)
+    elif kind == 'errorbar':
+        axis.errorbar(layer['x'], layer['y'], xerr=layer.get('xerr'), yerr=layer.get('yerr'),
+                      fmt=layer.get('fmt', 'o'), color=layer.get('color'), label=layer.get('label'))
+    elif kind == 'line':
+        kwargs = {}
+        for key in ('color', 'linestyle', 'label'):
+            if layer.get(key) is not None:
+                kwargs[key] = layer[key]
+        axis.plot(layer['x'], layer['y'], layer.get('fmt', '-'), **kwargs)
+    elif kind == 'vline':
+        axis.axvline(layer['x'], color=layer.get('color'), lw=layer.get('linewidth', 1))
+    elif kind == 'text':
+        kwargs = {'ha': layer.get('ha', 'left'), 'va': layer.get('va', 'center')}
+        for key in ('fontsize', 'fontweight'):
+            if layer.get(key) is not None:
+                kwargs[key] = layer[key]
+        if layer.get('axes_x', False):
+            from matplotlib.transforms import blended_transform_factory
+            kwargs['transform'] = blended_transform_factory(axis.transAxes, axis.transData)
+        axis.text(layer['x'], layer['y'], layer['text'], **kwargs)
+    else:
+        raise ValueError("Unknown plot layer kind %r" % kind)
+
+
+def _draw_legend(axis, legend):
+    from matplotlib.font_manager import FontProperties
+    import matplotlib.patches as mpatches
+    font = FontProperties()
+    font.set_size(legend.get('fontsize', 'small'))
+    if legend.get('patches') is not None:
+        handles = [mpatches.Patch(facecolor=color, label=label, edgecolor='black')
+                   for label, color in legend['patches']]
+        labels = [label for label, color in legend['patches']]
+    else:
+        handles, labels = axis.get_legend_handles_labels()
+    if legend.get('reverse', False):
+        handles, labels = handles[::-1], labels[::-1]
+    kwargs = {'prop': font}
+    for key in ('loc', 'bbox_to_anchor', 'ncol', 'borderaxespad'):
+        if legend.get(key) is not None:
+            kwargs[key] = legend[key]
+    axis.legend(handles, labels, **kwargs)
+
+
+def _draw_axes(axis, spec):
+    for scale in ('xscale', 'yscale'):
+        if spec.get(scale) is not None:
+            getattr(axis, 'set_' + scale)(spec[scale])
+    for layer in spec['layers']:
+        _draw_layer(axis, layer)
+    for name in ('x', 'y'):
+        low, high = getattr(axis, 'get_%slim' % name)()
+        if spec.get(name + 'lim_scale') is not None:
+            high *= spec[name + 'lim_scale']
+        limits = spec.get(name + 'lim')
+        if limits is not None:
+            low = limits[0] if limits[0] is not None else low
+            high = limits[1] if limits[1] is not None else high
+        if limits is not None or spec.get(name + 'lim_scale') is not None:
+            getattr(axis, 'set_%slim' % name)(low, high)
+    if spec.get('xticks') is not None:
+        axis.set_xticks(spec['xticks'])
+    if spec.get('xticklabels') is not None:
+        axis.set_xticklabels(spec['xticklabels'], rotation=spec.get('xticklabels_rotation'))
+    if spec.get('yticks') is not None:
+        axis.set_yticks(spec['yticks'])
+    if spec.get('yticklabels') is not None:
+        axis.set_yticklabels(spec['yticklabels'])
+    for key in ('title', 'xlabel', 'ylabel', 'position'):
+        if spec.get(key) is not None:
+            getattr(axis, 'set_' + key)(spec[key])
+    if spec.get('legend') is not None:
+        _draw_legend(axis, spec['legend'])
+
+
+def render_plot(spec, path):
+    """
+    Render the plot spec into the PNG file path, the figure is always
+    closed. Returns the seconds needed.
+    """
+    if _WORKER_MATPLOTLIB is None:
+        _init_worker()
+    import matplotlib.pyplot as plt
+    start = time.time()
+    fig = plt.figure(figsize=spec.get('figsize'))
+    try:
+        axes_specs = spec['axes']
+        for index, axes_spec in enumerate(axes_specs):
+            _draw_axes(fig.add_subplot(len(axes_specs), 1, index + 1), axes_spec)
+        if spec.get('tight_layout', True):
+            fig.tight_layout()
+        fig.savefig(path, dpi=spec.get('dpi', 91), bbox_inches=spec.get('bbox_inches'))
+    finally:
+        plt.close(fig)
+    return time.time() - start
+
+
+def _cache_directory():
+    """
+    plot_cache_dir of the paths section of the HappyFace config, by
+    default plot_cache in its tmp_dir. None if neither is configured.
+    """
+    try:
+        if hf.config.has_option('paths', 'plot_cache_dir'):
+            return hf.config.get('paths', 'plot_cache_dir')
+        return os.path.join(hf.config.get('paths', 'tmp_dir'), 'plot_cache')
+    except ConfigParser.Error:
+        return None
+
+
+class _Rendered(object):
+    """Outcome of a plot rendered inline or taken from the cache, read like an AsyncResult."""
+
+    def __init__(self, seconds=None, error=None):
+        self.seconds = seconds
+        self.error = error
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.seconds
+
+
+class PlotService(object):
+    """
+    Process pool rendering plot specs, shared by all modules of the
+    HappyFace process and obtained with instance().
+
+    Modules call instance() in prepareAcquisition, so the workers are
+    forked before the downloads and the schedd queries start threads.
+    If other threads are running when the service is created anyway,
+    forking could leave locks held in the workers, so plots are rendered
+    inline, as they are if matplotlib cannot be found. The chosen mode is
+    logged.
+
+    submit() returns right away. wait_all() collects the renders of a run
+    and writes the file names of the plots that were written into the
+    datasets of their modules, failed renders are logged and leave the
+    file name empty. It is called when the first plot of the next run is
+    submitted and at process exit, then the PlotCache counters of the run
+    are logged. Modules rendering their plots themselves get the cache
+    with cache_for_run().
+    """
+
+    _lock = threading.Lock()
+    _instance = None
+
+    @classmethod
+    def instance(cls, workers=2):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls(workers)
+                atexit.register(cls._instance.close)
+            return cls._instance
+
+    def __init__(self, workers=2, timeout=120):
+        self.logger = logging.getLogger(__name__)
+        self.timeout = timeout
+        directory = _cache_directory()
+        if directory is None:
+            self.logger.warning("Plots are not cached, set plot_cache_dir or tmp_dir in the paths section")
+        self.cache = PlotCache(directory)
+        self.pool = None
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._run_key = None
+        if threading.active_count() > 1:
+            others = [thread.name for thread in threading.enumerate()
+                      if thread is not threading.current_thread()]
+            self.logger.warning("Rendering plots inline, threads were started before the plot workers: %s"
+                                % ', '.join(others))
+            return
+        try:
+            # a worker failing in _init_worker is replaced by the pool
+            # over and over, so check for matplotlib before forking
+            imp.find_module('matplotlib')
+            self.pool = multiprocessing.Pool(workers, _init_worker)
+        except (OSError, ImportError), e:
+            self.logger.warning("Rendering plots inline, could not start plot workers: %s" % e)
+            return
+        self.logger.info("Rendering plots in %d worker processes" % workers)
+
+    def submit(self, spec, path, module=None, column=None, filename=None):
+        """
+        Start rendering spec into path. Once the PNG is written, wait_all()
+        sets column of the dataset of module to filename, the base name of
+        path by default.
+        """
+        if module is not None:
+            self._start_run(module.run)
+        digest = plot_digest(spec)
+        if self.cache.fetch(digest, path):
+            result, digest = _Rendered(), None
+        elif self.pool is None:
+            try:
+                result = _Rendered(render_plot(spec, path))
+            except Exception, e:
+                result = _Rendered(error=e)
+        else:
+            result = self.pool.apply_async(render_plot, (spec, path))
+        with self._pending_lock:
+            self._pending.append((result, digest, path, module, column, filename or os.path.basename(path)))
+
+    def cache_for_run(self, run):
+        """The PlotCache, for a module of run rendering a plot itself."""
+        self._start_run(run)
+        return self.cache
+
+    def _start_run(self, run):
+        if run['id'] != self._run_key:
+            if self._run_key is not None:
+                self._end_run()
+            self._run_key = run['id']
+
+    def _end_run(self):
+        self.wait_all()
+        self.cache.log_stats(self._run_key)
+
+    def wait_all(self):
+        """
+        Wait up to timeout seconds for the submitted renders and write the
+        file names of the plots that were written.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        deadline = time.time() + self.timeout
+        for result, digest, path, module, column, filename in pending:
+            try:
+                seconds = result.get(max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                self.logger.error("Rendering %s did not finish within %s seconds" % (path, self.timeout))
+                continue
+            except Exception, e:
+                self.logger.error("Rendering %s failed: %s" % (path, e))
+                continue
+            if digest is not None:
+                self.cache.store(digest, path, seconds)
+            if module is not None:
+                self._write_filename(module, column, filename)
+
+    def _write_filename(self, module, column, filename):
+        # the dataset was inserted after extractData returned
+        table = module.module_table
+        try:
+            table.update().where(and_(table.c.run_id == module.run['id'],
+                                      table.c.instance == module.instance_name)).\
+                values({column: filename}).execute()
+        except Exception, e:
+            self.logger.error("Could not set %s of %s to %s: %s" % (column, module.instance_name, filename, e))
+
+    def close(self):
+        self._end_run()
+        if self.pool is None:
+            return
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Streaming reader for the qstat XML file of the batch system modules.
+
+The file is read with lxml.etree.iterparse in a single pass. Every job
+element is folded into per (user, group) counters and cleared right
+away, so the memory needed does not grow with the number of jobs beyond
+the numeric values of the running jobs. JobsStatistics, JobsDist and
+JobsEfficiencyPlot all work on the resulting QstatSummary, which is
+shared between the instances of a run via the ParseCache:
+
+    summary = ParseCache.for_run(self.run).parse(self.qstat_xml, parse_qstat)
+"""
+
+from array import array
+from lxml import etree
+
+
+def cpueff_class(cpueff):
+    """Efficiency class of a running job with the CPU efficiency cpueff in percent."""
+    if cpueff > 80:
+        return 'ratio100'
+    elif cpueff > 30:
+        return 'ratio80'
+    elif cpueff > 10:
+        return 'ratio30'
+    return 'ratio10'
+
+
+class QstatSummary(object):
+    """
+    Aggregated content of a qstat XML file.
+
+    date            timestamp in the header, 0 if missing
+    summaries       list of dicts with group, parent (None if not set) and
+                    values, the stripped texts of the summary children
+    hierarchy       group -> parent group (None for the top group)
+    jobs_group      group attribute of the first jobs element
+    users           (user, group) -> counters total, stateless, running,
+                    pending, waiting, ncpus (of running jobs), ratio100,
+                    ratio80, ratio30, ratio10 and noeff (running jobs
+                    without a valid cpueff)
+    running_values  (group, tag) -> array of the numeric values of tag of
+                    all running jobs of group, including jobs without user
+    """
+
+    COUNTERS = ('total', 'stateless', 'running', 'pending', 'waiting', 'ncpus',
+                'ratio100', 'ratio80', 'ratio30', 'ratio10', 'noeff')
+
+    def __init__(self):
+        self.date = 0
+        self.summaries = []
+        self.hierarchy = {}
+        self.jobs_group = None
+        self.users = {}
+        self.running_values = {}
+
+    def _add_summary(self, element):
+        group = element.get('group', 'all')
+        parent = element.get('parent')
+        values = {}
+        for child in element:
+            if child.text is not None:
+                values[child.tag] = child.text.strip()
+        self.summaries.append({'group': group, 'parent': parent, 'values': values})
+        self.hierarchy[group] = parent
+
+    def _add_job(self, element):
+        fields = {}
+        for child in element:
+            if child.text is not None:
+                fields[child.tag] = child.text.strip()
+        state = fields.get('state', '')
+        group = fields.get('group', '')
+        if state == 'running':
+            for tag, text in fields.iteritems():
+                try:
+                    value = float(text)
+                except ValueError:
+                    continue
+                values = self.running_values.get((group, tag))
+                if values is None:
+                    values = self.running_values[(group, tag)] = array('d')
+                values.append(value)
+        user = fields.get('user', '')
+        if user == '':
+            return
+        key = (user, group)
+        counters = self.users.get(key)
+        if counters is None:
+            counters = self.users[key] = dict.fromkeys(self.COUNTERS, 0)
+        counters['total'] += 1
+        if state == '':
+            counters['stateless'] += 1
+        elif state == 'pending' or state == 'waiting':
+            counters[state] += 1
+        elif state == 'running':
+            counters['running'] += 1
+            try:
+                counters['ncpus'] += int(fields.get('ncpus', 0))
+            except ValueError:
+                pass
+            try:
+                counters[cpueff_class(float(fields['cpueff']))] += 1
+            except (KeyError, ValueError):
+                counters['noeff'] += 1
+
+
+def parse_qstat(source):
+    """Read the qstat XML from the file object source into a QstatSummary."""
+    summary = QstatSummary()
+    for event, element in etree.iterparse(source, events=('end',)):
+        parent = element.getparent()
+        parent_tag = parent.tag if parent is not None else None
+        top_level = parent is not None and parent.getparent() is None
+        if element.tag == 'job' and parent_tag == 'jobs':
+            summary._add_job(element)
+        elif element.tag == 'summary' and parent_tag == 'summaries':
+            summary._add_summary(element)
+        elif element.tag == 'date' and parent_tag == 'header':
+            if element.text is not None:
+                summary.date = int(float(element.text.strip()))
+            continue
+        elif element.tag == 'jobs' and top_level:
+            # the jobs list itself, summaries have a jobs child as well
+            if summary.jobs_group is None:
+                summary.jobs_group = element.get('group', '')
+            element.clear()
+            continue
+        else:
+            continue
+        # drop the processed job or summary and the ones before it, their
+        # parent only holds further jobs or summaries
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+    return summary
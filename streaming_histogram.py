@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Histograms that are filled one value at a time without knowing the range
+of the values in advance.
+
+A StreamingHistogram covers [0, size * width) with a fixed number of fine
+bins. A value beyond the range doubles the bin width and merges
+neighbouring bins, so the memory stays constant no matter how many values
+are filled. common_binning brings several of these histograms to shared
+bins for a stacked plot.
+"""
+
+import math
+import numpy as np
+
+
+class StreamingHistogram(object):
+    """
+    Histogram of non-negative values, negative values are counted in the
+    first bin. resolution fine bins are kept per requested plot bin.
+    Infinite and NaN values do not fit any bin, they are only counted in
+    skipped.
+    """
+
+    def __init__(self, nbins, resolution=8, width=1e-3):
+        self.size = max(1, int(nbins)) * resolution
+        self.width = float(width)
+        self.counts = [0] * self.size
+        self.entries = 0
+        self.skipped = 0
+
+    def _coarsen(self):
+        counts = self.counts
+        self.counts = [counts[i] + counts[i + 1] for i in xrange(0, self.size, 2)] + [0] * (self.size // 2)
+        self.width *= 2
+
+    def fill(self, value):
+        if math.isinf(value) or math.isnan(value):
+            self.skipped += 1
+            return
+        while value >= self.size * self.width:
+            self._coarsen()
+        self.counts[max(0, int(value / self.width))] += 1
+        self.entries += 1
+
+    def coarsened(self, width):
+        """Copy of the histogram with a bin width of (at least) width."""
+        copy = StreamingHistogram(1)
+        copy.size, copy.width, copy.counts, copy.entries = self.size, self.width, list(self.counts), self.entries
+        copy.skipped = self.skipped
+        while copy.width < width * (1 - 1e-9):
+            copy._coarsen()
+        return copy
+
+
+def common_binning(histograms, nbins):
+    """
+    Bin edges and the list of bin contents of each of histograms (all of
+    the same size and initial width) on about nbins shared bins spanning
+    the filled range.
+    """
+    if not any(histogram.entries for histogram in histograms):
+        return np.array([0., 1.]), [np.zeros(1, dtype=int) for histogram in histograms]
+    width = max(histogram.width for histogram in histograms)
+    counts = np.array([histogram.coarsened(width).counts for histogram in histograms])
+    filled = np.flatnonzero(counts.sum(axis=0))
+    first, last = filled[0], filled[-1] + 1
+    group = max(1, int(math.ceil(float(last - first) / max(1, int(nbins)))))
+    ngroups = int(math.ceil(float(last - first) / group))
+    counts = counts[:, first:first + ngroups * group]
+    counts = np.hstack([counts, np.zeros((len(histograms), ngroups * group - counts.shape[1]), dtype=counts.dtype)])
+    counts = counts.reshape(len(histograms), ngroups, group).sum(axis=2)
+    edges = (first + group * np.arange(ngroups + 1)) * width
+    return edges, list(counts)
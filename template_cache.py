@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Memoization of getTemplateData for modules whose template data only
+depends on the stored dataset.
+
+A stored dataset never changes, so the subtable queries and the post
+processing of getTemplateData are only needed once per dataset. Modules
+opt in by decorating their getTemplateData:
+
+    @cached_template_data()
+    def getTemplateData(self):
+        ...
+
+The results are kept per (instance, dataset id) in a bounded LRU cache.
+Callers get a shallow copy of the cached dict, the values inside are
+shared between page views and must not be modified by the templates.
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread-safe least recently used cache of at most maxsize entries
+    with hit and miss counters.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Cached value of key, build() creates it if it is not cached."""
+        with self._lock:
+            if key in self._entries:
+                value = self._entries.pop(key)
+                self._entries[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+def cached_template_data(maxsize=64):
+    """
+    Decorator for getTemplateData caching its result per module instance
+    and dataset id. The cache of a decorated method is available as its
+    cache attribute, e.g. Panda.getTemplateData.cache.stats().
+    """
+    def decorator(get_template_data):
+        cache = LRUCache(maxsize)
+
+        @functools.wraps(get_template_data)
+        def wrapper(self):
+            if getattr(self, 'dataset', None) is None:
+                return get_template_data(self)
+            key = (self.instance_name, self.dataset['id'])
+            return dict(cache.get(key, lambda: get_template_data(self)))
+        wrapper.cache = cache
+        return wrapper
+    return decorator
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Job-state-over-time histograms built with difference arrays.
+
+Every state interval of a job adds +1 at the first and -1 after the last
+sample point it covers, every point event (a job finishing, being
+removed, ...) adds one count to the bin it happened in. A single
+cumulative sum per state then gives the number of jobs per time bin, so
+the cost is O(jobs + bins) independent of the length of the intervals.
+"""
+
+import math
+import numpy as np
+
+
+class StateTimeline(object):
+    """
+    Number of jobs per state at the sample points start, start + binwidth,
+    ..., end (all timestamps in seconds).
+
+    A job is counted in a state at a sample point t if the state was
+    entered at or before t and left after t. Events are counted in the bin
+    (t - binwidth, t] of the first sample point t at or after the event.
+    """
+
+    def __init__(self, start, end, binwidth, states):
+        self.start = float(start)
+        self.binwidth = float(binwidth)
+        self.nbins = int(math.floor((float(end) - self.start) / self.binwidth)) + 1
+        self.end = self.start + (self.nbins - 1) * self.binwidth
+        self.states = list(states)
+        self._deltas = dict((state, np.zeros(self.nbins + 1)) for state in self.states)
+
+    def sample_points(self):
+        return self.start + self.binwidth * np.arange(self.nbins)
+
+    def _first_bin(self, timestamp):
+        # index of the first sample point at or after timestamp, clipped to [0, nbins]
+        index = int(math.ceil((float(timestamp) - self.start) / self.binwidth))
+        return min(max(index, 0), self.nbins)
+
+    def add_interval(self, state, begin, end=None):
+        """Count a job in state from begin until end, end=None means ongoing."""
+        first = self._first_bin(begin)
+        last = self.nbins if end is None else self._first_bin(end)
+        if first < last:
+            delta = self._deltas[state]
+            delta[first] += 1
+            delta[last] -= 1
+
+    def add_event(self, state, timestamp):
+        """Count a single event of state at timestamp, events outside the window are dropped."""
+        if self.start - self.binwidth < timestamp <= self.end:
+            index = self._first_bin(timestamp)
+            delta = self._deltas[state]
+            delta[index] += 1
+            delta[index + 1] -= 1
+
+    def counts(self, state):
+        """Array with the number of jobs in state per sample point."""
+        return np.cumsum(self._deltas[state])[:self.nbins]
+
+    def __getitem__(self, state):
+        return self.counts(state)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Run HTCondorJobsPerUser.extractData on synthetic job ad streams and
+compare the main table and the per-user statistics with the per-job
+loop it used before:
+
+    python tools/bench_jobs_per_user.py [jobs ...]
+
+The hf package of HappyFace and the htcondor bindings have to be
+importable. The default streams have 10k, 100k and 1M jobs of 50 users
+from 4 schedds. The ads are handed to the module the way CondorAcquisition
+streams them, the plot is not drawn. Both timings include creating the
+synthetic ads, which is timed on its own as well. The old loop keeps a
+dict per job and is only run up to OLD_LIMIT jobs. Exits with 1 on the
+first difference.
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import HTCondorJobsPerUser as module
+
+USERS = ['user%02i' % n for n in range(50)]
+SITES = [None, 'ekpcloud', 'GridKa', 'bwForCluster', 'ekpsupermachines']
+STATUS = [1] * 30 + [2] * 55 + [3, 4, 5, 5, 6, 7]
+SCHEDDS = ['schedd%i.ekp.kit.edu' % n for n in range(4)]
+NOW = 1440000000
+OLD_LIMIT = 100000
+CONFIG = {
+    'source_url': 'http://google.com', 'plotsize_x': '10.9', 'plotsize_y': '5.8', 'log_limit': '500',
+    'efficiency_warning': '0.9', 'efficiency_critical': '0.5', 'n_held_warning': '10',
+    'n_held_critical': '20', 'ram_requested_memory_ratio': '1.2', 'schedd_timeout': '60'}
+
+
+def job_ads(jobs):
+    """(schedd name, ad) of jobs synthetic jobs, the same for the same number."""
+    generator = random.Random(jobs)
+    for n in xrange(jobs):
+        status = generator.choice(STATUS)
+        cpus = generator.choice((1, 1, 1, 4, 8))
+        qdate = NOW - generator.randint(60, 3 * 86400)
+        ad = {
+            'JobStatus': status,
+            'User': generator.choice(USERS) + '@ekp.kit.edu',
+            'ResidentSetSize': generator.randint(0, 4 * 1024 ** 2) if status != 1 else None,
+            'RequestMemory': generator.choice((2000, 2500, 4000)) * cpus,
+            'RequestCpus': cpus,
+            'RemoteJob': generator.random() < 0.3,
+            'GlobalJobId': 'schedd#%i.0#%i' % (n, qdate),
+            'CurrentTime': NOW,
+            'QDate': qdate,
+            'ServerTime': NOW,
+            'NetworkInputMb': generator.uniform(0, 500) if generator.random() < 0.8 else None,
+            'NetworkOutputMb': generator.uniform(0, 50) if generator.random() < 0.8 else None,
+            'TransferInputSizeMB': generator.randint(0, 100)}
+        if status == 2:
+            start = generator.randint(qdate, NOW)
+            ad['JobStartDate'] = ad['JobCurrentStartDate'] = start
+            ad['RemoteUserCpu'] = generator.uniform(0, 1.05) * cpus * (NOW - start)
+            ad['RemoteSysCpu'] = generator.uniform(0, 0.02) * cpus * (NOW - start)
+            ad['MachineAttrCloudSite0'] = generator.choice(SITES)
+        yield SCHEDDS[n % len(SCHEDDS)], ad
+
+
+class AdStream(object):
+    """The result of CondorAcquisition.query_schedds for the synthetic jobs."""
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.errors = {}
+
+    def __iter__(self):
+        return job_ads(self.jobs)
+
+
+class Negotiator(object):
+    def getPriorities(self):
+        return [{'Name': 'group_cms.' + user + '@ekp.kit.edu', 'AccountingGroup': 'group_cms',
+                 'Priority': 500.0 + n} for n, user in enumerate(USERS)]
+
+
+class Acquisition(object):
+    """Takes the place of CondorAcquisition, the jobs are not queried."""
+    jobs = 0
+
+    @classmethod
+    def for_run(cls, run):
+        return cls()
+
+    def negotiator(self, machine=None):
+        return Negotiator()
+
+    def query_schedds(self, method, requirements, projection, limit=-1, timeout=60, schedd_names=None):
+        return AdStream(self.jobs)
+
+
+def new_module():
+    instance = module.HTCondorJobsPerUser.__new__(module.HTCondorJobsPerUser)
+    instance.config = CONFIG
+    instance.run = {'id': 0}
+    instance.plot = lambda: ''
+    instance.prepareAcquisition()
+    return instance
+
+
+def old_statistics(jobs):
+    """Main table and per-user rows as the per-job loop computed them."""
+    instance = new_module()
+    data = {'running': 0, 'idle': 0, 'cores': 0, 'ram': 0, 'requested_memory': 0, 'efficiency': 0,
+            'qtime': [], 'remote': 0, 'filename_plot': ''}
+    for ad in instance.negotiator.getPriorities():
+        name = ad.get("Name").replace(ad.get("AccountingGroup") + ".", "")
+        instance.priorities[name] = max(ad.get("Priority"), instance.priorities.setdefault(name, 500.0))
+    condor_jobs_information = {}
+    for schedd_name, ads in AdStream(jobs):
+        condor_jobs_information[ads.get("GlobalJobId")] = dict(
+            (quantity, ads.get(quantity)) for quantity in instance.quantities_list)
+    statistics = {}
+    for jobid, job in condor_jobs_information.iteritems():
+        if job["RemoteJob"]:
+            data["remote"] += 1
+        user = job["User"]
+        if user not in statistics:
+            statistics[user] = dict((status, 0) for status in instance.jobs_status_dict.itervalues())
+            statistics[user].update({"cores": 0, "efficiencies": [], "sites": [], "ram": 0,
+                                     "requested_memory": 0, "NetworkInputMb": 0., "NetworkOutputMb": 0.})
+        if job["ResidentSetSize"] is not None:
+            statistics[user]["ram"] += job["ResidentSetSize"] / 1024.
+            data["ram"] += job["ResidentSetSize"] / 1024.
+        statistics[user]["requested_memory"] += job["RequestMemory"]
+        data["requested_memory"] += job["RequestMemory"]
+        statistics[user]["cores"] += job["RequestCpus"]
+        data["cores"] += job["RequestCpus"]
+        if job["NetworkInputMb"] is not None:
+            statistics[user]["NetworkInputMb"] += job["NetworkInputMb"]
+        if job["NetworkOutputMb"] is not None:
+            statistics[user]["NetworkOutputMb"] += job["NetworkOutputMb"]
+        status = instance.jobs_status_dict.get(job["JobStatus"])
+        statistics[user][status] += 1
+        if status in data:
+            data[status] += 1
+        if status == "running":
+            try:
+                data["qtime"].append(max(0, job["JobStartDate"] - job["QDate"]))
+            except Exception:
+                pass
+        site = "Undefined" if job["MachineAttrCloudSite0"] is None else job["MachineAttrCloudSite0"]
+        if site.lower() not in statistics[user]["sites"] and status == "running":
+            statistics[user]["sites"].append(site.lower())
+        if status == "running":
+            try:
+                cputime = job["RemoteUserCpu"] + job["RemoteSysCpu"]
+                runtime = job["RequestCpus"] * (job["ServerTime"] - job["JobStartDate"])
+                efficiency = float(cputime) / float(runtime)
+                if efficiency <= 1.:
+                    statistics[user]["efficiencies"].append(efficiency)
+            except Exception:
+                pass
+    rows = []
+    all_efficiencies = []
+    for user in statistics:
+        user_data = {"batchsystem_user": user}
+        for status in instance.jobs_status_dict.itervalues():
+            user_data[status] = statistics[user][status]
+        user_data["cores"] = statistics[user]["cores"]
+        user_data["ram"] = instance.determine_diskspace(statistics[user]["ram"], given_unit="MiB")
+        user_data["requested_memory"] = max(1, instance.determine_diskspace(
+            statistics[user]["requested_memory"], given_unit="MiB"))
+        user_data["efficiency"] = round(np.mean(statistics[user]["efficiencies"]), 2) \
+            if len(statistics[user]["efficiencies"]) > 0 else 1.0
+        all_efficiencies += statistics[user]["efficiencies"]
+        user_data["sites"] = ",\n".join(statistics[user]["sites"])
+        user_data["priority"] = round(instance.priorities[user], 1)
+        user_data["NetworkInputMb"] = round(statistics[user]["NetworkInputMb"], 2)
+        user_data["NetworkOutputMb"] = round(statistics[user]["NetworkOutputMb"], 2)
+        rows.append(user_data)
+    data["efficiency"] = round(np.mean(all_efficiencies), 2) if len(all_efficiencies) > 0 else 1.0
+    data["ram"] = instance.determine_diskspace(data["ram"], given_unit="MiB")
+    data["requested_memory"] = max(1, instance.determine_diskspace(data["requested_memory"], given_unit="MiB"))
+    data["qtime"] = str(timedelta(seconds=int(np.mean(data["qtime"])))) if data["qtime"] else str(0)
+    return data, rows
+
+
+def new_statistics(jobs):
+    """The same from HTCondorJobsPerUser.extractData."""
+    Acquisition.jobs = jobs
+    instance = new_module()
+    data = instance.extractData()
+    return data, instance.statistics_db_value_list
+
+
+def comparable(data, rows):
+    """
+    Values both variants give. The old loop went through the jobs in the
+    order of a dict keyed by GlobalJobId, so the order of the sites of a
+    user was arbitrary and only the sites are compared.
+    """
+    keys = ('running', 'idle', 'cores', 'ram', 'requested_memory', 'efficiency', 'qtime', 'remote')
+    columns = ('batchsystem_user', 'idle', 'running', 'removed', 'completed', 'held', 'transferred',
+               'suspended', 'cores', 'ram', 'requested_memory', 'efficiency', 'sites', 'priority',
+               'NetworkInputMb', 'NetworkOutputMb')
+    return (dict((key, data[key]) for key in keys),
+            sorted(tuple(sorted(row[column].split(",\n")) if column == 'sites' else row[column]
+                         for column in columns) for row in rows))
+
+
+def main(sizes):
+    module.CondorAcquisition = Acquisition
+    for jobs in sizes:
+        start = time.time()
+        for ad in AdStream(jobs):
+            pass
+        stream_time = time.time() - start
+        start = time.time()
+        new = comparable(*new_statistics(jobs))
+        new_time = time.time() - start
+        if jobs > OLD_LIMIT:
+            print '%i jobs: creating the ads %.2f s, now %.2f s, old loop skipped' % (
+                jobs, stream_time, new_time)
+            continue
+        start = time.time()
+        old = comparable(*old_statistics(jobs))
+        old_time = time.time() - start
+        for name, want, got in zip(('main table', 'user statistics'), old, new):
+            if want != got:
+                print '%i jobs: %s differs\n  before: %r\n  now:    %r' % (jobs, name, want, got)
+                return 1
+        print '%i jobs: creating the ads %.2f s, before %.2f s, now %.2f s' % (
+            jobs, stream_time, old_time, new_time)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main([int(jobs) for jobs in sys.argv[1:]] or [10000, 100000, 1000000]))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Run CMS6MachineStatus.extractData on synthetic condor_status pools and
+compare the per-site tables with the nested loops it used before:
+
+    python tools/bench_machine_status.py [slots ...]
+
+The hf package of HappyFace has to be importable, e.g. with the HappyFace
+directory in PYTHONPATH. The default pools have 1k, 10k, 50k and 200k
+slots. The plot spec is dropped instead of being rendered, so only the
+reading and counting of the slots is timed. The old loops grow with slots
+times machines and are only run up to OLD_LIMIT slots. Every machine
+belongs to exactly one site, so both have to give the same numbers. The
+one exception is kept out of the comparison: the old condor version table
+counted the ekpsm machines for the last site instead of for ekpsg.
+Exits with 1 on the first difference.
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import hf
+import CMS6MachineStatus as module
+
+SITES = ["gridka", "ekpcms6", "ekp-cloud", "ekpsg", "ekpsm", "bwforcluster"]
+HOSTS = ["c%02i-%03i.gridka.de", "ekpcms6-%03i-%02i", "vm%02i-%03i.ekp-cloud", "ekpsg%02i%03i",
+         "ekpsm%02i%03i", "n%02i-%03i.bwforcluster"]
+STATES = [("Claimed", "Busy")] * 6 + [("Claimed", "Retiring"), ("Claimed", "Suspended"),
+                                       ("Unclaimed", "Idle"), ("Unclaimed", "Idle"),
+                                       ("Owner", "Idle"), ("Drained", "Idle"), ("Drained", "Retiring")]
+WEAK_THRESHOLD = 0.5
+OLD_LIMIT = 10000
+
+
+class Source(object):
+    def __init__(self, path):
+        self.path = path
+
+    def getTmpPath(self):
+        return self.path
+
+
+class DroppedPlots(object):
+    """Takes the place of the PlotService, the specs are not rendered."""
+    def submit(self, spec, path, module=None, column=None, filename=None):
+        pass
+
+    @classmethod
+    def instance(cls):
+        return cls()
+
+
+class ArchivePaths(object):
+    def getArchivePath(self, run, filename):
+        return os.path.join(tempfile.gettempdir(), filename)
+
+
+def synthetic_pool(slots):
+    """Path of a condor_status dump with slots slots on machines of 8 slots."""
+    random.seed(slots)
+    pool = {}
+    for n in range(slots):
+        site = random.randrange(len(HOSTS))
+        machine = HOSTS[site] % (site, n / 8)
+        state, activity = random.choice(STATES)
+        pool['slot%i@%s' % (n % 8 + 1, machine)] = {
+            'Machine': machine,
+            'State': state,
+            'Activity': activity,
+            'LoadAvg': '%.3f' % random.uniform(0, 1.2),
+            'TotalCondorLoadAvg': '%.3f' % random.uniform(0, 8),
+            'Disk': str(random.randint(10 ** 6, 10 ** 8)),
+            'TotalSlots': '8',
+            'CondorVersion': '$CondorVersion: 8.%i.%i $' % (random.randint(2, 4), random.randint(0, 9))}
+    handle, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(handle, 'w') as output:
+        output.write(json.dumps(pool)[:-1] + ', }')
+    return path
+
+
+def old_tables(path):
+    """Plot and condor tables and slot numbers counted with the old loops."""
+    services = json.loads(open(path).read().replace("}, }", "} }"))
+    slot_id_list = list(services.keys())
+    sites = list(SITES)
+    act_states = ["Idle", "Busy", "Suspended", "Retiring"]
+
+    def sitescan(machine_name, sites):
+        i = 0
+        while sites[i] not in machine_name and i + 1 < len(sites):
+            i += 1
+        if sites[i] == "ekpsm":
+            return "ekpsg"
+        else:
+            return sites[i]
+    state_list = list(services[id]['State']for id in slot_id_list)
+    activity_list = list(services[id]['Activity'] for id in slot_id_list)
+    load_list = list(float(services[id]['LoadAvg']) for id in slot_id_list)
+    machine_name_list = list(services[id]['Machine']for id in slot_id_list)
+    condor_version_list = list(services[id]['CondorVersion'].replace("$", "") for id in slot_id_list)
+    disk_list = list(round(float(services[id]['Disk']) / (1024 * 1024), 2)for id in slot_id_list)
+    total_slot_list = list(int(services[id]['TotalSlots'])for id in slot_id_list)
+    slot_count = len(slot_id_list)
+    machine_names = list(set(machine_name_list))
+    condor_versions = list(set(condor_version_list))
+    machine_slots = [0] * len(machine_names)
+    for i in xrange(slot_count):
+        for k in xrange(len(machine_names)):
+            if machine_name_list[i] == machine_names[k] and machine_slots[k] == 0:
+                machine_slots[k] = total_slot_list[i]
+    for k in xrange(len(machine_names)):
+        machine_names[k] = sitescan(machine_names[k], sites)
+    sites.remove("ekpsm")
+    zeros = lambda: [0.0] * len(sites)
+    plot_claimed, plot_unclaimed, plot_machines_per_site = zeros(), zeros(), zeros()
+    plot_avg_load_claimed, plot_avg_load_unclaimed, plot_disk, plot_weak = zeros(), zeros(), zeros(), zeros()
+    plot_activity = dict((activity, zeros()) for activity in act_states + ["Blocked"])
+    for i in xrange(len(machine_name_list)):
+        for j in xrange(len(sites)):
+            if sites[j] in machine_name_list[i] or ("ekpsm" in machine_name_list[i] and sites[j] == "ekpsg"):
+                plot_disk[j] += disk_list[i]
+                if state_list[i] == "Claimed":
+                    plot_claimed[j] += 1
+                    plot_avg_load_claimed[j] += load_list[i]
+                    if load_list[i] <= WEAK_THRESHOLD:
+                        plot_weak[j] += 1
+                elif activity_list[i] == "Idle":
+                    plot_unclaimed[j] += 1
+                    plot_avg_load_unclaimed[j] += load_list[i]
+                for activity in act_states:
+                    if activity_list[i] == activity:
+                        if activity_list[i] == "Idle" and (state_list[i] == "Drained" or state_list[i] == "Owner"):
+                            plot_activity["Blocked"][j] += 1
+                        else:
+                            plot_activity[activity][j] += 1
+    for j in xrange(len(sites)):
+        plot_machines_per_site[j] = machine_names.count(sites[j])
+        try:
+            plot_avg_load_claimed[j] = round(float(plot_avg_load_claimed[j]) / float(plot_claimed[j]), 2)
+        except (ValueError, ZeroDivisionError):
+            plot_avg_load_claimed[j] = 0
+        try:
+            plot_avg_load_unclaimed[j] = round(float(plot_avg_load_unclaimed[j]) / float(plot_unclaimed[j]), 2)
+        except (ValueError, ZeroDivisionError):
+            plot_avg_load_unclaimed[j] = 0
+    condor_version_per_site = dict((site, dict.fromkeys(condor_versions, 0)) for site in sites)
+    for i in xrange(slot_count):
+        # the old loop scanned sites without ekpsm here and counted ekpsm
+        # machines for the last site, they belong to ekpsg like in the plot
+        condor_version_per_site[sitescan(machine_name_list[i], SITES)][condor_version_list[i]] += 1
+    plot = [(sites[i], int(plot_claimed[i]), int(plot_unclaimed[i]), int(plot_machines_per_site[i]),
+             plot_avg_load_claimed[i], plot_avg_load_unclaimed[i], round(plot_disk[i], 2),
+             [plot_activity[activity][i] for activity in ("Idle", "Busy", "Suspended", "Retiring", "Blocked")])
+            for i in xrange(len(sites))]
+    condor = sorted((site, version, count) for site, versions in condor_version_per_site.iteritems()
+                    for version, count in versions.iteritems() if count)
+    summary = (sum(plot_weak), len(machine_names), sum(machine_slots))
+    return plot, condor, summary
+
+
+def new_tables(path):
+    """The same numbers from CMS6MachineStatus.extractData."""
+    instance = module.CMS6MachineStatus.__new__(module.CMS6MachineStatus)
+    instance.source = Source(path)
+    instance.sites = list(SITES)
+    instance.weak_threshold = WEAK_THRESHOLD
+    instance.plotsize_x, instance.plotsize_y, instance.plot_width = 10, 3.6, 0.38
+    instance.log_limit, instance.plot_right_margin, instance.min_plotsize = 500, 0.1, 3
+    instance.machine_slot_min, instance.slots_min, instance.weak_slots_limit = 2, 20, 0.1
+    instance.instance_name, instance.run = 'bench', {'id': 0}
+    instance.statistics_db_value_list = []
+    instance.plot_db_value_list = []
+    instance.condor_db_value_list = []
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        data = instance.extractData()
+    finally:
+        sys.stdout = stdout
+    plot = [(row['site'], row['claimed'], row['unclaimed'], row['machines'], row['claimed_avg'],
+             row['unclaimed_avg'], round(row['disk'], 2),
+             [row[activity] for activity in ('idle', 'busy', 'suspended', 'retiring', 'blocked')])
+            for row in instance.plot_db_value_list]
+    condor = sorted((row['site'], row['condor_version'], row['value']) for row in instance.condor_db_value_list)
+    summary = (data['weak_slots'], data['machines'], data['slots'])
+    return plot, condor, summary
+
+
+def main(sizes):
+    module.PlotService = DroppedPlots
+    hf.downloadService = ArchivePaths()
+    for slots in sizes:
+        path = synthetic_pool(slots)
+        try:
+            start = time.time()
+            new = new_tables(path)
+            new_time = time.time() - start
+            if slots > OLD_LIMIT:
+                print '%i slots: now %.2f s, old loops skipped' % (slots, new_time)
+                continue
+            start = time.time()
+            old = old_tables(path)
+            old_time = time.time() - start
+        finally:
+            os.remove(path)
+        for name, want, got in zip(('plot table', 'condor table', 'summary'), old, new):
+            if want != got:
+                print '%i slots: %s differs\n  before: %r\n  now:    %r' % (slots, name, want, got)
+                return 1
+        print '%i slots: before %.2f s, now %.2f s' % (slots, old_time, new_time)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main([int(slots) for slots in sys.argv[1:]] or [1000, 10000, 50000, 200000]))
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Replay a PhEDEx linktest dump through the link confirmation of
+CMSPhedexDataExtract, once the way it was done before (the file is loaded
+and all links are scanned for every low quality timebin) and once with
+CMSPhedexDataExtract.confirmLinkStatus:
+
+    python tools/bench_phedex_linktest.py [linktest.json ...]
+
+The hf package of HappyFace has to be importable, e.g. with the HappyFace
+directory in PYTHONPATH. Without arguments synthetic dumps with 50, 200
+and 500 links over 24 hourly timebins are replayed. The link status of
+every query has to agree. The time of both variants and how often each
+parsed the file (once per query before, once now) are printed.
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from CMSPhedexDataExtract import CMSPhedexDataExtract
+
+YOUR_NAME = 'T1_DE_KIT_Buffer'
+LINK_DIRECTION = 'to'
+PARSE_DIRECTION = 'from'
+CRITICAL_AVERAGE_QUALITY = 0.5
+EVAL_HOURS = 3
+
+
+class Source(object):
+    def __init__(self, path):
+        self.path = path
+
+    def getTmpPath(self):
+        return self.path
+
+
+def synthetic_dump(links, timebins=24):
+    """Path of a linktest dump with links from half as many sites to YOUR_NAME and others."""
+    random.seed(links)
+    now = int(time.time()) / 3600 * 3600
+    dump = []
+    for n in range(links):
+        transfers = []
+        for t in range(timebins):
+            done, fail = random.randint(0, 50), random.randint(0, 50)
+            transfers.append({
+                'timebin': now - t * 3600,
+                'done_files': done,
+                'fail_files': fail,
+                'rate': random.randint(0, 10 ** 8),
+                'quality': float(done) / (done + fail) if done + fail else None})
+        # every second name is the prefix of the one before, which has to
+        # be counted for it as well
+        name = 'T%i_XX_Site%04i' % (n / 2 % 3 + 1, n / 2)
+        if n % 2 == 0:
+            name += '_' + random.choice(['Buffer', 'MSS', 'Disk'])
+        dump.append({'from': name,
+                     'to': random.choice([YOUR_NAME, 'T1_US_FNAL_Buffer', 'T2_CH_CERN']),
+                     'transfer': transfers})
+    handle, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(handle, 'w') as output:
+        json.dump({'phedex': {'link': dump}}, output)
+    return path
+
+
+def queries(path, quality_x_line):
+    """Link names extractData confirms, one per low quality timebin."""
+    names = []
+    for links in json.load(open(path))['phedex']['link']:
+        for transfer in links['transfer']:
+            done, fail = int(transfer['done_files']), int(transfer['fail_files'])
+            if done == 0 and fail == 0:
+                continue
+            quality = float(done) / (done + fail)
+            if transfer['timebin'] >= quality_x_line and quality < CRITICAL_AVERAGE_QUALITY:
+                names.append(links[PARSE_DIRECTION])
+    return names
+
+
+def old_confirm(path, link_name, quality_x_line):
+    """confirmLinkStatus as it was before."""
+    fobj1 = json.load(open(path, 'r'))['phedex']['link']
+    i = 0
+    avg_quality = 0.0
+    for links in fobj1:
+        if links[PARSE_DIRECTION].startswith(link_name) and YOUR_NAME not in links[LINK_DIRECTION]:
+            for transfer in links['transfer']:
+                if transfer['quality'] != None and transfer['timebin'] >= quality_x_line:
+                    i += 1
+                    avg_quality += float(transfer['quality'])
+    if i > 0:
+        avg_quality = avg_quality / float(i)
+        if avg_quality < CRITICAL_AVERAGE_QUALITY:
+            return 0
+        return 1
+    return 1
+
+
+def count_parses(function, *args):
+    """Result of function(*args) and the number of json.load calls it made."""
+    calls = [0]
+    load = json.load
+
+    def counted(*load_args, **load_kwargs):
+        calls[0] += 1
+        return load(*load_args, **load_kwargs)
+    json.load = counted
+    try:
+        return function(*args), calls[0]
+    finally:
+        json.load = load
+
+
+def new_module(path, quality_x_line):
+    """A CMSPhedexDataExtract with only what confirmLinkStatus needs."""
+    module = CMSPhedexDataExtract.__new__(CMSPhedexDataExtract)
+    module.source1 = Source(path)
+    module.your_name = YOUR_NAME
+    module.link_direction = LINK_DIRECTION
+    module.parse_direction = PARSE_DIRECTION
+    module.quality_x_line = quality_x_line
+    module.critical_average_quality = CRITICAL_AVERAGE_QUALITY
+    module.linktest_index = None
+    return module
+
+
+def replay(path):
+    timebins = [transfer['timebin'] for links in json.load(open(path))['phedex']['link']
+                for transfer in links['transfer']]
+    quality_x_line = max(timebins) - EVAL_HOURS * 3600 if timebins else 0
+    names = queries(path, quality_x_line)
+
+    start = time.time()
+    old, old_parses = count_parses(lambda: [old_confirm(path, name, quality_x_line) for name in names])
+    old_time = time.time() - start
+
+    start = time.time()
+    module = new_module(path, quality_x_line)
+    new, new_parses = count_parses(lambda: [module.confirmLinkStatus(name) for name in names])
+    new_time = time.time() - start
+
+    if old != new:
+        different = [name for name, o, n in zip(names, old, new) if o != n]
+        print '%s: link status differs for %s' % (path, ', '.join(sorted(set(different))))
+        return False
+    print '%s: %i queries, before %i parses in %.3f s, now %i in %.3f s' % (
+        path, len(names), old_parses, old_time, new_parses, new_time)
+    return True
+
+
+def main(paths):
+    synthetic = []
+    if not paths:
+        synthetic = paths = [synthetic_dump(links) for links in (50, 200, 500)]
+    try:
+        for path in paths:
+            if not replay(path):
+                return 1
+    finally:
+        for path in synthetic:
+            os.remove(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Compare json_stream.iter_object_items with json.loads on JSON objects
+read in chunks of every size from 1 byte to the whole text:
+
+    python tools/check_json_stream.py [file.json ...]
+
+Without arguments a set of objects mixing numbers with fractions and
+exponents, strings with escapes, literals, nested arrays and objects and
+whitespace is checked. A value cut by a chunk boundary has to be read as
+a whole. Exits with 1 on the first difference.
+"""
+
+import json
+import os
+import sys
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from json_stream import iter_object_items
+
+TEXTS = [
+    '{"x":3.14,"y":12345}',
+    '{"a":-1.5e-3}',
+    '{}',
+    ' { } ',
+    '{"n": 0, "big": 12345678901234567890, "neg": -0.25E+10, "exp": 1e5}',
+    '{"s": "a \\"quoted\\" \\\\ \\u00e9 string", "t": true, "f": false, "z": null}',
+    '{"list": [1, 2.5, -3e2, "x", [], {}], "obj": {"inner": {"deep": [null, 10]}}, "last": 7}',
+    '{\n  "file1": {"size": 1024, "atime": 1440000000.5},\n  "file2": {"size": 0, "atime": 1e9}\n}\n',
+    '{"details": [{"count": 12, "error": "TRANSFER failed"}, {"count": 3, "error": ""}], "pages": 2}',
+]
+
+
+def check(name, text):
+    expected = json.loads(text).items()
+    for chunk_size in range(1, len(text) + 1):
+        try:
+            found = list(iter_object_items(StringIO(text), chunk_size=chunk_size))
+        except ValueError, e:
+            print '%s, chunk size %i: %s' % (name, chunk_size, e)
+            return False
+        if sorted(found) != sorted(expected):
+            print '%s, chunk size %i: members differ\n  json.loads: %r\n  json_stream: %r' % (
+                name, chunk_size, expected, found)
+            return False
+    return True
+
+
+def main(paths):
+    texts = [(path, open(path).read()) for path in paths] or \
+        [('object %i' % n, text) for n, text in enumerate(TEXTS)]
+    for name, text in texts:
+        if not check(name, text):
+            return 1
+    print '%i objects agree at every chunk size' % len(texts)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Compare qstat_summary.parse_qstat with the DOM walk JobsStatistics used
+before, on a recorded qstat XML file:
+
+    python tools/check_qstat_summary.py [qstat.xml]
+
+Without an argument tools/data/qstat_sample.xml is used. The header date,
+the values of every summary, the group of the jobs list and the job
+counters per user have to agree. Exits with 1 on the first difference.
+"""
+
+import os
+import sys
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from qstat_summary import parse_qstat
+
+
+def reference(path):
+    """date, summaries, jobs group and users the way the DOM walk read them."""
+    root = etree.parse(open(path)).getroot()
+    date = 0
+    summaries = []
+    jobs_group = None
+    users = {}
+    for element in root:
+        if element.tag == 'header':
+            for child in element:
+                if child.tag == 'date' and child.text is not None:
+                    date = int(float(child.text.strip()))
+        elif element.tag == 'summaries':
+            for child in element:
+                if child.tag == 'summary':
+                    values = dict((subchild.tag, subchild.text.strip()) for subchild in child
+                                  if subchild.text is not None)
+                    summaries.append((child.get('group', 'all'), child.get('parent'), values))
+        elif element.tag == 'jobs' and jobs_group is None:
+            jobs_group = element.get('group', '')
+            for child in element:
+                if child.tag != 'job':
+                    continue
+                fields = dict((subchild.tag, subchild.text.strip()) for subchild in child
+                              if subchild.text is not None)
+                user, state = fields.get('user', ''), fields.get('state', '')
+                if user == '' or state == '':
+                    continue
+                counters = users.setdefault(user, dict.fromkeys(
+                    ('total', 'ncpus', 'running', 'pending', 'waiting'), 0))
+                counters['total'] += 1
+                if state == 'running':
+                    counters['running'] += 1
+                    counters['ncpus'] += int(fields.get('ncpus', 0))
+                elif state in ('pending', 'waiting'):
+                    counters[state] += 1
+    return date, summaries, jobs_group, users
+
+
+def streamed(path):
+    """The same values from parse_qstat."""
+    summary = parse_qstat(open(path))
+    summaries = [(entry['group'], entry['parent'], entry['values']) for entry in summary.summaries]
+    users = {}
+    for (user, group), counters in summary.users.iteritems():
+        if counters['total'] == counters['stateless']:
+            continue
+        total = users.setdefault(user, dict.fromkeys(
+            ('total', 'ncpus', 'running', 'pending', 'waiting'), 0))
+        total['total'] += counters['total'] - counters['stateless']
+        for key in ('ncpus', 'running', 'pending', 'waiting'):
+            total[key] += counters[key]
+    return summary.date, summaries, summary.jobs_group, users
+
+
+def main(path):
+    expected = reference(path)
+    found = streamed(path)
+    for name, want, got in zip(('date', 'summaries', 'jobs group', 'users'), expected, found):
+        if want != got:
+            print '%s differ:\n  DOM walk:   %r\n  parse_qstat: %r' % (name, want, got)
+            return 1
+    print '%s: %i summaries and %i users agree' % (path, len(expected[1]), len(expected[3]))
+    return 0
+
+
+if __name__ == '__main__':
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'qstat_sample.xml')
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else default))
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2015 Institut für Experimentelle Kernphysik - Karlsruher Institut für Technologie
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Replay a recorded dashboard JSON file through the list based counting
+NodeMonitoring used before and through node_statistics, for a set of
+module configurations:
+
+    python tools/replay_node_monitoring.py [jobs.json]
+
+Without an argument tools/data/node_monitoring_sample.json is used.
+
+With eval_time 24 no jobs are filtered. The attribute values, primary and
+secondary keys, the job matrix, the totals per node, the module status and
+the nodes and numbers that go into the plot have to be identical.
+
+With other eval_time the old filter never removed a job: it compared the
+time zone aware finishing date with the naive interval start, which raises
+a TypeError that was swallowed. So the old counting is compared with
+node_statistics on the jobs the filter was meant to keep, finished at the
+interval start or later or still running, and the number of jobs the fixed
+filter drops is reported. Exits with 1 on the first difference.
+"""
+
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from node_statistics import finished_since, count_jobs, top_nodes
+
+ZONE = pytz.timezone('Europe/Berlin')
+
+# attribute, primary_key, secondary_key, attribute_values, eval_attribute_value,
+# eval_mode, plot_filter_attribute_value, plot_filter_node_number
+CONFIGS = [
+    ('JobStatus', 'WNHostName', '', '', '', 1, '', 20),
+    ('JobStatus', 'WNHostName', 'SiteName', '', 'failed', 2, 'failed', 15),
+    ('JobStatus', 'WNHostName', '', 'succeeded|failed|running', 'failed', 3, '', 100),
+    ('JobStatus', 'WNHostName', 'SiteName', 'failed|cancelled', 'failed', 4, 'failed', 10),
+    ('JobStatus', 'TaskMonitorId', '', '', 'running', 4, 'running', 8),
+    ('WNHostName', 'TaskMonitorId', '', '', '', 1, 'unknown', 5),
+    ('JobStatus', 'WNHostName', '', 'doesnotexist', '', 1, '', 20),
+]
+THRESHOLDS = (0, 5, 10, 20, 40)
+
+
+def old_counts(jobs, attribute, primary_key, secondary_key, attribute_values, eval_attribute_value):
+    """Attribute values, keys, job matrix and totals per node as counted before."""
+    AttributeValues = []
+    if eval_attribute_value <> '':
+        AttributeValues.append(eval_attribute_value)
+    if attribute_values <> '':
+        AddAttributeValues = attribute_values.split('|')
+        for i in range(len(AddAttributeValues)):
+            if AddAttributeValues[i] not in AttributeValues:
+                AttributeValues.append(AddAttributeValues[i])
+    else:
+        for item in jobs:
+            if item[attribute] not in AttributeValues:
+                AttributeValues.append(item[attribute])
+
+    PrimaryKeys = []
+    SecondaryKeys = []
+    for item in jobs:
+        if item[attribute] in AttributeValues:
+            if item[primary_key] not in PrimaryKeys:
+                PrimaryKeys.append(item[primary_key])
+                if secondary_key <> '':
+                    SecondaryKeys.append(item[secondary_key])
+
+    Jobs = [[0 for k in range(len(PrimaryKeys))] for a in range(len(AttributeValues))]
+    for item in jobs:
+        if item[attribute] in AttributeValues:
+            Jobs[AttributeValues.index(item[attribute])][
+                    PrimaryKeys.index(item[primary_key])] += 1
+
+    TotalJobsPerNode = [0 for k in range(len(PrimaryKeys))]
+    for k in range(len(PrimaryKeys)):
+        for a in range(len(AttributeValues)):
+            TotalJobsPerNode[k] += Jobs[a][k]
+    return AttributeValues, PrimaryKeys, SecondaryKeys, Jobs, TotalJobsPerNode
+
+
+def old_plot_indices(AttributeValues, Jobs, TotalJobsPerNode, plot_filter_attribute_value, number):
+    """Nodes that went into the plot before."""
+    PlotIndices = []
+    if plot_filter_attribute_value in AttributeValues:
+        SortCounts = Jobs[AttributeValues.index(plot_filter_attribute_value)]
+    else:
+        SortCounts = TotalJobsPerNode
+    Counts = sorted(set(SortCounts), reverse=True)
+    for c in range(len(Counts)):
+        for k in range(len(SortCounts)):
+            if SortCounts[k] == Counts[c]:
+                PlotIndices.append(k)
+    return PlotIndices[:max(0, min(number, len(PlotIndices)))]
+
+
+def new_plot_indices(AttributeValues, Jobs, TotalJobsPerNode, plot_filter_attribute_value, number):
+    if plot_filter_attribute_value in AttributeValues:
+        SortCounts = Jobs[AttributeValues.index(plot_filter_attribute_value)]
+    else:
+        SortCounts = TotalJobsPerNode
+    return top_nodes(SortCounts, number)
+
+
+def status(AttributeValues, Jobs, TotalJobsPerNode, eval_attribute_value, eval_mode, warning, critical):
+    """Module status, the evaluation of NodeMonitoring.extractData with threshold 0."""
+    nodes = range(len(TotalJobsPerNode))
+    if eval_mode == 1:
+        Statistics = TotalJobsPerNode
+        TotalEval = sum(Statistics)
+    else:
+        i = AttributeValues.index(eval_attribute_value)
+        if eval_mode == 2:
+            Statistics = sum(Jobs[i])
+            TotalEval = sum(TotalJobsPerNode)
+        else:
+            Statistics = Jobs[i]
+            TotalEval = sum(Statistics) if eval_mode == 3 else 0
+    result = 1.0
+    if eval_mode == 2:
+        if 100.0 * Statistics / float(TotalEval) >= warning:
+            result = 0.5
+        if 100.0 * Statistics / float(TotalEval) >= critical:
+            result = 0.0
+    elif eval_mode in (1, 3):
+        if any(100.0 * Statistics[k] / float(TotalEval) >= warning for k in nodes):
+            result = 0.5
+        if any(100.0 * Statistics[k] / float(TotalEval) >= critical for k in nodes):
+            result = 0.0
+    else:
+        if any(100.0 * Statistics[k] / float(TotalJobsPerNode[k]) >= warning for k in nodes):
+            result = 0.5
+        count = sum(1 for k in nodes if 100.0 * Statistics[k] / float(TotalJobsPerNode[k]) >= critical)
+        if count == 1:
+            result = 0.5
+        elif count > 1:
+            result = 0.0
+    return result
+
+
+def outputs(counts, plot_indices, config):
+    """Everything of a counting that ends up in the database or the plot."""
+    attribute, primary_key, secondary_key, attribute_values, eval_attribute_value, \
+        eval_mode, plot_filter_attribute_value, plot_filter_node_number = config
+    AttributeValues, PrimaryKeys, SecondaryKeys, Jobs, TotalJobsPerNode = counts
+    result = {'counts': counts}
+    if PrimaryKeys:
+        result['status'] = [status(AttributeValues, Jobs, TotalJobsPerNode, eval_attribute_value,
+                                   eval_mode, warning, critical)
+                            for warning in THRESHOLDS for critical in THRESHOLDS]
+    PlotIndices = plot_indices(AttributeValues, Jobs, TotalJobsPerNode,
+                               plot_filter_attribute_value, plot_filter_node_number)
+    result['plot'] = [(PrimaryKeys[k], [Jobs[a][k] for a in range(len(AttributeValues))])
+                      for k in PlotIndices]
+    return result
+
+
+def old_filter(jobs, IntervalStart):
+    """The jobs left by the filter of NodeMonitoring.extractData before."""
+    jobs = list(jobs)
+    for item in jobs:
+        try:
+            date = datetime.strptime(item['FinishedTimeStamp'], "%Y-%m-%dT%H:%M:%S").replace(
+                    tzinfo=pytz.utc).astimezone(ZONE)
+            if date < IntervalStart:
+                jobs.remove(item)
+        except Exception:
+            pass
+    return jobs
+
+
+def intended_filter(jobs, start):
+    """Jobs finished at the local time start or later or still running, by their dates."""
+    kept = []
+    for item in jobs:
+        try:
+            date = datetime.strptime(item['FinishedTimeStamp'], "%Y-%m-%dT%H:%M:%S").replace(
+                    tzinfo=pytz.utc).astimezone(ZONE).replace(tzinfo=None)
+        except Exception:
+            kept.append(item)
+            continue
+        if date >= start:
+            kept.append(item)
+    return kept
+
+
+def compare(name, config, old_jobs, new_jobs):
+    attribute, primary_key, secondary_key, attribute_values, eval_attribute_value = config[:5]
+    old = outputs(old_counts(old_jobs, attribute, primary_key, secondary_key,
+                             attribute_values, eval_attribute_value), old_plot_indices, config)
+    AttributeValues = []
+    if eval_attribute_value <> '':
+        AttributeValues.append(eval_attribute_value)
+    for value in attribute_values.split('|') if attribute_values <> '' else ():
+        if value not in AttributeValues:
+            AttributeValues.append(value)
+    new = outputs(count_jobs(new_jobs, attribute, primary_key, secondary_key,
+                             AttributeValues, attribute_values <> ''), new_plot_indices, config)
+    for key in ('counts', 'status', 'plot'):
+        if old.get(key) != new.get(key):
+            print '%s, %r: %s differ\n  old: %r\n  new: %r' % (name, config, key, old.get(key), new.get(key))
+            return False
+    return True
+
+
+def main(path):
+    rawdata = json.load(open(path))
+    jobs = rawdata['jobs']
+    IntervalEnd = datetime.strptime(rawdata['meta']['date2'][0], "%Y-%m-%d %H:%M:%S").replace(
+            tzinfo=pytz.utc).astimezone(ZONE).replace(tzinfo=None)
+    for config in CONFIGS:
+        if not compare('eval_time 24', config, jobs, jobs):
+            return 1
+    for eval_time in (1, 6, 12):
+        IntervalStart = IntervalEnd - timedelta(hours=eval_time)
+        IntervalStartUTC = ZONE.localize(IntervalStart).astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        if old_filter(jobs, IntervalStart) != jobs:
+            print 'eval_time %i: the old filter removed jobs' % eval_time
+            return 1
+        kept = finished_since(jobs, IntervalStartUTC)
+        if kept != intended_filter(jobs, IntervalStart):
+            print 'eval_time %i: filter keeps other jobs than intended' % eval_time
+            return 1
+        for config in CONFIGS:
+            if not compare('eval_time %i' % eval_time, config, kept, kept):
+                return 1
+        print 'eval_time %i: %i of %i jobs kept, the old filter kept all' % (eval_time, len(kept), len(jobs))
+    print '%s: %i jobs, %i configurations agree' % (path, len(jobs), len(CONFIGS))
+    return 0
+
+
+if __name__ == '__main__':
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'node_monitoring_sample.json')
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else default))